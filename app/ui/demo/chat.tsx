@@ -3,6 +3,51 @@
 import { useSearchParams } from 'next/navigation';
 import { useState, useEffect, useRef } from 'react';
 
+type ChatRequest = { message: string; user_id: string; theme: string };
+
+// Stream a bot reply from the backend, calling onToken as each piece arrives
+async function streamChat(body: ChatRequest, onToken: (token: string) => void) {
+    const response = await fetch('http://localhost:8000/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(body)
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`Chat request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-sent events are separated by a blank line
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            boundary = buffer.indexOf('\n\n');
+
+            let event = 'message';
+            let data = '';
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            }
+            if (!data) continue;
+
+            const payload = JSON.parse(data);
+            if (event === 'error') throw new Error(payload.detail);
+            if (event === 'message' && payload.token) onToken(payload.token);
+        }
+    }
+}
+
 export default function Chat({title, user_id}: {title: string, user_id: string}) {
     // State to store all chat messages
     const [messages, setMessages] = useState<{ id: number; user: "user" | "bot"; text: string; timestamp: string }[]>([]);
@@ -13,12 +58,39 @@ export default function Chat({title, user_id}: {title: string, user_id: string})
     // Function to add a new message
     const addMessage = (text: string, sender: "user" | "bot") => {
         const newMessage = {
-            id: Date.now(), // Simple ID generation
+            id: Date.now() + Math.random(), // Simple ID generation
             user: sender,
             text: text,
             timestamp: new Date().toLocaleTimeString()
         };
         setMessages(prevMessages => [...prevMessages, newMessage]);
+        return newMessage.id;
+    };
+
+    // Function to append streamed text to an existing message
+    const appendToMessage = (id: number, text: string) => {
+        setMessages(prevMessages => prevMessages.map(message =>
+            message.id === id ? { ...message, text: message.text + text } : message
+        ));
+    };
+
+    // Function to stream a bot reply into a new message
+    const askBot = async (message: string, fallback: string) => {
+        const id = addMessage('', 'bot');
+        let received = false;
+        try {
+            await streamChat(
+                { message: message, user_id: user_id, theme: topic || 'default' },
+                token => {
+                    received = true;
+                    appendToMessage(id, token);
+                }
+            );
+        } catch (error) {
+            console.error('Error:', error);
+            // A reply cut short is kept as the backend saves it, marked as incomplete
+            appendToMessage(id, received ? ' […]' : fallback);
+        }
     };
 
     useEffect(() => {
@@ -27,36 +99,22 @@ export default function Chat({title, user_id}: {title: string, user_id: string})
             if (hasInitialized.current) return;
             hasInitialized.current = true;
             
-            try {
-                const response = await fetch('http://localhost:8000/chat', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        message: `Eres un assistente de profesor de secundaria cuyo objetivo es ayudar a los alummnos a aprender. Para ello, deberás motivarlos a que se interesen en el tema, y dejarles una pregunta al final de cada mensaje tuyo. Por ejemplo, en vez de terminar dicendo "La importancia de la investigación es ...", pregunta "¿Cuáles crees que son los beneficios de la investigación?". Sé breve, sintetiza tu respuesta en 40 palabras o menos, usa tres oraciones por respuesta: la primera para contextualizar, la segunda para motivar, y la tercera para preguntar. En esta oportunidad, introduce el tema de ${topic || 'Introducción a la investigación'}.`,
-                        user_id: user_id,
-                        theme: topic || 'default' // Default to 'general' if no topic
-                    })
-                });
-                
-                const data = await response.json();
-                addMessage(data.response, 'bot');
-                console.log('Chat initialized:', data);
-            } catch (error) {
-                console.error('Error initializing chat:', error);
-                addMessage(`Welcome to the chat about ${topic}!`, 'bot');
-            }
+            await askBot(
+                `Eres un assistente de profesor de secundaria cuyo objetivo es ayudar a los alummnos a aprender. Para ello, deberás motivarlos a que se interesen en el tema, y dejarles una pregunta al final de cada mensaje tuyo. Por ejemplo, en vez de terminar dicendo "La importancia de la investigación es ...", pregunta "¿Cuáles crees que son los beneficios de la investigación?". Sé breve, sintetiza tu respuesta en 40 palabras o menos, usa tres oraciones por respuesta: la primera para contextualizar, la segunda para motivar, y la tercera para preguntar. En esta oportunidad, introduce el tema de ${topic || 'Introducción a la investigación'}.`,
+                `Welcome to the chat about ${topic}!`
+            );
         };
 
         initializeChat();
-    });
+        // The opening turn is sent once per mount, not after every render
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, []);
 
     return (
         <div className="max-w-2xl mx-auto p-4">
             <h2 className="text-xl font-semibold mb-4">{title}</h2>
             <Viewer messages={messages} />
-            <Input onSendMessage={addMessage} user_id={user_id} />
+            <Input onSendMessage={addMessage} onAskBot={askBot} />
         </div>
     );
 }
@@ -87,40 +145,17 @@ function Viewer({messages}: { messages: { id: number; user: "user" | "bot"; text
     );
 }
 
-function Input({onSendMessage, user_id}: { onSendMessage: (text: string, user: "user" | "bot") => void, user_id: string }) {
+function Input({onSendMessage, onAskBot}: { onSendMessage: (text: string, user: "user" | "bot") => void, onAskBot: (message: string, fallback: string) => Promise<void> }) {
     // State for the current input value
     const [inputText, setInputText] = useState('');
-    const searchParams = useSearchParams();
-    const topic = searchParams.get('topic');
 
     const handleSend = async () => {
     if (inputText.trim()) {
         // Add user message immediately
         onSendMessage(inputText, 'user');
         setInputText('');
-        try {
-            // Send to backend
-            const response = await fetch('http://localhost:8000/chat', { //   https://my-mvp-production-4b5f.up.railway.app/chat
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    message: inputText,
-                    user_id: user_id,
-                    theme: topic || 'default'
-                })
-            });
-            
-            const data = await response.json();
-            
-            // Add bot response
-            onSendMessage(data.response, 'bot');
-            
-        } catch (error) {
-            console.error('Error:', error);
-            onSendMessage('Sorry, I had trouble responding. Please try again.', 'bot');
-        }
+        // Stream the bot response from the backend
+        await onAskBot(inputText, 'Sorry, I had trouble responding. Please try again.');
     }
 };
 
@@ -0,0 +1,3 @@
+"""
+Microbenchmarks for the backend hot paths; run with `python -m benchmarks` from backend/.
+"""
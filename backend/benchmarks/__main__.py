@@ -0,0 +1,95 @@
+"""
+Run the backend microbenchmarks and optionally compare with an earlier run.
+
+    cd backend
+    python -m benchmarks --output before.json
+    # ...change something...
+    python -m benchmarks --output after.json --compare before.json
+
+Results are medians in nanoseconds per operation. --compare exits with
+status 1 when any benchmark got slower than --threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+SUITES = ["conversation", "chatbot", "memory", "database", "retrieval"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backend hot path microbenchmarks")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="Suite to run (repeatable; default: all)")
+    parser.add_argument("--only", help="Run only benchmarks whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and shorter rounds")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed rounds per benchmark")
+    parser.add_argument("--output", help="Write JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of a baseline run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    parser.add_argument("--database-url", help="Database to benchmark (default: a temporary SQLite file)")
+    return parser.parse_args()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def run_suites(args, runner) -> None:
+    import importlib
+
+    for suite in args.suite or SUITES:
+        print(f"# {suite}")
+        module = importlib.import_module(f"benchmarks.bench_{suite}")
+        await module.run(runner, args.quick)
+
+
+def main() -> int:
+    args = parse_args()
+    tmpdir = tempfile.TemporaryDirectory()
+    # Must be set before scripts.database is imported, which reads it once
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tmpdir.name}/bench.db"
+    os.environ.setdefault("LLM_BACKEND", "none")
+
+    from .harness import Runner, compare
+
+    runner = Runner(rounds=args.rounds, min_time=0.02 if args.quick else 0.1, only=args.only)
+    asyncio.run(run_suites(args, runner))
+    tmpdir.cleanup()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "quick": args.quick,
+        },
+        "results": runner.results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"{regressions} benchmark(s) slower than the baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
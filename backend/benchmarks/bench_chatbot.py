@@ -0,0 +1,35 @@
+"""
+Prompt rendering and response cleanup at growing context lengths.
+"""
+from scripts.chatbot import ChatBot, PromptBuffer
+
+from .harness import Runner
+from .bench_conversation import BOT_TURN, SYSTEM_PROMPT, USER_TURN
+
+
+def make_context(turns: int):
+    context = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for i in range(turns):
+        context.append({"role": "user", "content": USER_TURN} if i % 2 == 0
+                       else {"role": "assistant", "content": BOT_TURN})
+    return context
+
+
+async def run(bench: Runner, quick: bool) -> None:
+    # Dummy mode has no backend; only the pure-Python formatting paths are measured
+    chatbot = ChatBot(dummy=True)
+    for turns in ([10, 100] if quick else [10, 100, 1000]):
+        context = make_context(turns)
+        bench.sync("chatbot.format_conversation", lambda: chatbot._format_conversation(context), turns=turns)
+
+        # Steady state of a conversation: the same context plus one new message each turn
+        buffer = PromptBuffer()
+        buffer.render(context)
+        next_context = context + [{"role": "user", "content": USER_TURN}]
+        bench.sync("prompt_buffer.render_incremental", lambda: buffer.render(next_context), turns=turns)
+
+        prompt = chatbot._format_conversation(context)
+        generated = BOT_TURN + "<|eot_id|>"
+        bench.sync("chatbot.clean_response", lambda: chatbot._clean_response(generated, prompt), turns=turns)
+        echoed = prompt + generated
+        bench.sync("chatbot.clean_response_echoed", lambda: chatbot._clean_response(echoed, prompt), turns=turns)
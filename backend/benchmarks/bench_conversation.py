@@ -0,0 +1,38 @@
+"""
+Conversation.add_message, get_context and serialization at growing history lengths.
+"""
+from utils.messages import SimpleChatMessage
+from scripts.chatManager import Conversation
+
+from .harness import Runner
+
+SYSTEM_PROMPT = "Eres un asistente de profesor de secundaria. " * 20
+USER_TURN = "¿Por qué es importante formular una buena pregunta de investigación antes de empezar?"
+BOT_TURN = ("Una buena pregunta delimita el tema y orienta la búsqueda de fuentes. "
+            "Te ayuda a decidir qué datos necesitas. ¿Qué tema te gustaría investigar?")
+
+
+def make_history(turns: int):
+    """A theme prompt followed by alternating user and bot messages."""
+    messages = [SimpleChatMessage(SYSTEM_PROMPT, "system", 0.0)]
+    for i in range(turns):
+        messages.append(SimpleChatMessage(USER_TURN if i % 2 == 0 else BOT_TURN,
+                                          "user" if i % 2 == 0 else "bot", float(i)))
+    return messages
+
+
+async def run(bench: Runner, quick: bool) -> None:
+    for turns in ([10, 100] if quick else [10, 100, 1000]):
+        conversation = Conversation("bench", make_history(turns))
+        bench.sync("conversation.add_message", lambda: conversation.add_message(USER_TURN, "user"), turns=turns)
+
+        conversation = Conversation("bench", make_history(turns))
+        bench.sync("conversation.get_context", lambda: conversation.get_context(reserve_tokens=32), turns=turns)
+
+        bench.sync("conversation.load", lambda: Conversation("bench", make_history(turns)), turns=turns)
+
+        # What a shared conversation store pays per turn written or read by another worker
+        conversation = Conversation("bench", make_history(turns))
+        bench.sync("conversation.to_bytes", conversation.to_bytes, turns=turns)
+        data = conversation.to_bytes()
+        bench.sync("conversation.from_bytes", lambda: Conversation.from_bytes(data), turns=turns)
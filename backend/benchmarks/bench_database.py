@@ -0,0 +1,78 @@
+"""
+DatabaseManager history reads, searches and turn writes against a seeded SQLite database.
+
+The database comes from DATABASE_URL, which __main__ points at a temporary
+file unless --database-url is given.
+"""
+import itertools
+import random
+from datetime import datetime, timedelta
+
+from scripts.database import DatabaseManager
+
+from .harness import Runner
+from .bench_conversation import BOT_TURN, USER_TURN
+
+THEMES = ["Introducción a la investigación", "Método científico"]
+
+
+async def seed(database: DatabaseManager, users: int, turns: int) -> None:
+    """Insert `turns` turns for every (user, theme) pair, oldest first."""
+    start = datetime.utcnow() - timedelta(days=30)
+    batch = []
+    for user in range(users):
+        for theme in THEMES:
+            for turn in range(turns):
+                batch.append({
+                    "user_id": f"user{user}",
+                    "theme": theme,
+                    "message": USER_TURN,
+                    "response": BOT_TURN,
+                    "response_time_ms": 900,
+                    "timestamp": start + timedelta(minutes=turn, seconds=user),
+                })
+                if len(batch) >= 1000:
+                    await database.save_chat_messages(batch)
+                    batch = []
+    if batch:
+        await database.save_chat_messages(batch)
+
+
+async def run(bench: Runner, quick: bool) -> None:
+    users, turns = (50, 20) if quick else (500, 40)
+    database = DatabaseManager()
+    await database.initialize()
+    try:
+        await database.clear_all_data()
+        await seed(database, users, turns)
+        rows = users * len(THEMES) * turns
+
+        keys = [(f"user{random.randrange(users)}", random.choice(THEMES)) for _ in range(1024)]
+        cycle = itertools.cycle(keys)
+        for limit in (20, 50):
+            await bench.run_async("database.get_chat_history",
+                                  lambda: database.get_chat_history(*next(cycle), limit=limit),
+                                  rows=rows, limit=limit)
+
+        # Every seeded turn matches, so ranking covers the whole table unless filtered
+        await bench.run_async("database.search_chat_messages",
+                              lambda: database.search_chat_messages("fuentes datos", limit=20), rows=rows)
+        await bench.run_async("database.search_chat_messages_user_theme",
+                              lambda: database.search_chat_messages("fuentes datos", theme=THEMES[0],
+                                                                    user_id=next(cycle)[0], limit=20), rows=rows)
+
+        counter = itertools.count()
+        await bench.run_async("database.save_chat_message", lambda: database.save_chat_message({
+            "user_id": f"user{next(counter) % users}",
+            "theme": THEMES[0],
+            "message": USER_TURN,
+            "response": BOT_TURN,
+            "response_time_ms": 900,
+        }), rows=rows)
+
+        batch = [{"user_id": f"user{i % users}", "theme": THEMES[1], "message": USER_TURN,
+                  "response": BOT_TURN, "response_time_ms": 900} for i in range(100)]
+        await bench.run_async("database.save_chat_messages_batch100",
+                              lambda: database.save_chat_messages(batch), rows=rows)
+    finally:
+        await database.close()
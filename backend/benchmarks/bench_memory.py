@@ -0,0 +1,39 @@
+"""
+ChatMemoryManager.get_conversation hit and miss paths with many active conversations.
+"""
+import itertools
+import random
+
+from scripts.chatManager import ChatMemoryManager, Conversation
+
+from .harness import Runner
+from .bench_conversation import make_history
+
+
+class StubDatabase:
+    """Answers history loads instantly so only the cache and load machinery is measured."""
+
+    def __init__(self):
+        self.history = make_history(20)
+
+    async def get_chat_history(self, user_id, theme, limit=50, theme_prompt=None):
+        return list(self.history)
+
+
+async def run(bench: Runner, quick: bool) -> None:
+    history = make_history(20)
+    for size in ([1_000, 10_000] if quick else [1_000, 10_000, 100_000]):
+        manager = ChatMemoryManager(StubDatabase(), max_memory_conversations=size)
+        conversation = Conversation("template", history)
+        for i in range(size):
+            await manager.store.put((f"user{i}", "theme"), conversation)
+
+        keys = [(f"user{random.randrange(size)}", "theme") for _ in range(4096)]
+        cycle = itertools.cycle(keys)
+        await bench.run_async("memory.get_conversation_hit",
+                              lambda: manager.get_conversation(*next(cycle)), conversations=size)
+
+        # Every lookup is a new key: load, insert and evict the least recently used
+        fresh = (f"new{i}" for i in itertools.count())
+        await bench.run_async("memory.get_conversation_miss",
+                              lambda: manager.get_conversation(next(fresh), "theme"), conversations=size)
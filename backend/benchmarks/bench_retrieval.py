@@ -0,0 +1,38 @@
+"""
+TopicRetriever indexing and top-k lookups at growing lesson sizes.
+"""
+import itertools
+
+from scripts.topicRetrieval import HashingEmbedder, TopicRetriever
+
+from .harness import Runner
+from .bench_conversation import BOT_TURN, SYSTEM_PROMPT, USER_TURN
+
+PARAGRAPH = ("La variable independiente es la que el investigador modifica. La variable dependiente es la que se mide "
+             "para observar el efecto. Las variables controladas se mantienen constantes durante el experimento.")
+
+
+def make_lesson(paragraphs: int) -> str:
+    """A theme prompt followed by numbered paragraphs, so every chunk differs."""
+    return "\n\n".join([SYSTEM_PROMPT] + [f"Sección {i}. {PARAGRAPH} Ejemplo {i}." for i in range(paragraphs)])
+
+
+async def run(bench: Runner, quick: bool) -> None:
+    for paragraphs in ([20, 200] if quick else [20, 200, 2000]):
+        lesson = make_lesson(paragraphs)
+        retriever = TopicRetriever(embedder=HashingEmbedder(), min_tokens=1)
+
+        async def index():
+            # A new theme each time, so nothing is reused
+            await retriever.index_topic(f"theme{next(themes)}", lesson)
+            retriever._indexes.clear()
+
+        themes = itertools.count()
+        await bench.run_async("retrieval.index_topic", index, paragraphs=paragraphs)
+
+        await retriever.index_topic("theme", lesson)
+        questions = itertools.cycle([f"{USER_TURN} {i}" for i in range(100_000)])
+        await bench.run_async("retrieval.retrieve_miss",
+                              lambda: retriever.retrieve("theme", next(questions)), paragraphs=paragraphs)
+        await bench.run_async("retrieval.retrieve_hit",
+                              lambda: retriever.retrieve("theme", BOT_TURN), paragraphs=paragraphs)
@@ -0,0 +1,140 @@
+"""
+Timing and comparison helpers shared by the benchmark suites.
+"""
+import gc
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+def _summarize(samples: List[float], number: int) -> Dict[str, float]:
+    """Convert per-round durations into nanoseconds per operation."""
+    per_op = [sample / number * 1e9 for sample in samples]
+    return {
+        "min": min(per_op),
+        "median": statistics.median(per_op),
+        "mean": statistics.fmean(per_op),
+        "stdev": statistics.stdev(per_op) if len(per_op) > 1 else 0.0,
+    }
+
+
+class Runner:
+    """Runs benchmarks and collects their results.
+
+    Like timeit, each benchmark is first calibrated so one round lasts at
+    least min_time, then timed for several rounds with the garbage collector
+    paused. Results are reported in nanoseconds per operation.
+    """
+
+    def __init__(self, rounds: int = 5, min_time: float = 0.05, only: Optional[str] = None):
+        self.rounds = rounds
+        self.min_time = min_time
+        self.only = only
+        self.results: List[Dict[str, Any]] = []
+
+    def wanted(self, name: str) -> bool:
+        return self.only is None or self.only in name
+
+    def sync(self, name: str, fn: Callable[[], Any], **params: Any) -> None:
+        """Benchmark a plain function."""
+        if not self.wanted(name):
+            return
+
+        def timed(number: int) -> float:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            return time.perf_counter() - start
+
+        self._run(name, params, timed)
+
+    async def run_async(self, name: str, fn: Callable[[], Awaitable[Any]], **params: Any) -> None:
+        """Benchmark a coroutine function, awaited sequentially on the running loop."""
+        if not self.wanted(name):
+            return
+
+        async def timed(number: int) -> float:
+            start = time.perf_counter()
+            for _ in range(number):
+                await fn()
+            return time.perf_counter() - start
+
+        # Same procedure as _run, but awaiting each timed round
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            number = 1
+            while (elapsed := await timed(number)) < self.min_time and number < 10_000_000:
+                number = max(number * 2, int(number * self.min_time / max(elapsed, 1e-9)))
+            samples = [await timed(number) for _ in range(self.rounds)]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self._record(name, params, number, samples)
+
+    def _run(self, name: str, params: Dict[str, Any], timed: Callable[[int], float]) -> None:
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            number = 1
+            while (elapsed := timed(number)) < self.min_time and number < 10_000_000:
+                number = max(number * 2, int(number * self.min_time / max(elapsed, 1e-9)))
+            samples = [timed(number) for _ in range(self.rounds)]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self._record(name, params, number, samples)
+
+    def _record(self, name: str, params: Dict[str, Any], number: int, samples: List[float]) -> None:
+        result = {
+            "name": name,
+            "params": params,
+            "number": number,
+            "rounds": len(samples),
+            "ns_per_op": _summarize(samples, number),
+        }
+        self.results.append(result)
+        label = f"{name}[{format_params(params)}]" if params else name
+        print(f"{label:<60} {result['ns_per_op']['median']:>14,.0f} ns/op")
+
+
+def format_params(params: Dict[str, Any]) -> str:
+    return ",".join(f"{key}={value}" for key, value in sorted(params.items()))
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    """Identify a benchmark across runs by its name and parameters."""
+    return f"{result['name']}[{format_params(result['params'])}]"
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.10) -> int:
+    """
+    Print median changes between two result files.
+
+    Args:
+        baseline: Results of the reference run
+        current: Results of the run under test
+        threshold: Relative change reported as a regression or improvement
+
+    Returns:
+        Number of benchmarks that got slower by more than the threshold
+    """
+    before = {result_key(result): result for result in baseline["results"]}
+    regressions = 0
+    print(f"{'benchmark':<60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for result in current["results"]:
+        key = result_key(result)
+        now = result["ns_per_op"]["median"]
+        if key not in before:
+            print(f"{key:<60} {'-':>12} {now:>12,.0f} {'new':>8}")
+            continue
+        then = before[key]["ns_per_op"]["median"]
+        change = (now - then) / then if then else 0.0
+        verdict = ""
+        if change > threshold:
+            verdict = "  slower"
+            regressions += 1
+        elif change < -threshold:
+            verdict = "  faster"
+        print(f"{key:<60} {then:>12,.0f} {now:>12,.0f} {change:>+8.1%}{verdict}")
+    return regressions
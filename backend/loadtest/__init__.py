@@ -0,0 +1,3 @@
+"""
+End-to-end load testing against a local fake LLM; run with `python -m loadtest` from backend/.
+"""
@@ -0,0 +1,257 @@
+"""
+Load-test the chat backend end to end.
+
+    cd backend
+    # Sweep class sizes against a fresh backend and fake LLM started here
+    python -m loadtest classroom --students 10,30,60 --turns 5
+    # Replay a request log ten times faster
+    python -m loadtest replay ../requests.jsonl --speedup 10
+    # Four workers sharing conversations through a fake Redis
+    python -m loadtest classroom --students 60 --workers 4 --store redis
+    # Only run the fake LLM, e.g. for a backend started by hand
+    python -m loadtest fake-llm --port 8081
+    # Only run the fake Redis, e.g. for CONVERSATION_STORE=redis by hand
+    python -m loadtest fake-redis --port 6379
+
+Without --target, a fake LLM and uvicorn workers of main:app (one unless
+--workers is given) are started on free local ports with a temporary
+SQLite database; --store picks how the workers share conversations. Backend
+settings (ADMISSION_*, LLM_*, WRITE_BEHIND_*, ...) are passed through from
+the environment.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process serving {url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def wait_until_listening(port: int, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process for port {port} exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Port {port} did not open within {timeout:.0f}s")
+
+
+def start_process(args: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen([sys.executable, *args], cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def fake_llm_args(args) -> List[str]:
+    return [
+        "--first-token-median", str(args.first_token_median),
+        "--first-token-sigma", str(args.first_token_sigma),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--error-rate", str(args.error_rate),
+    ]
+
+
+@contextmanager
+def local_stack(args) -> Iterator[str]:
+    """Start the fake LLM and a backend worker, yielding the backend URL."""
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    llm_port, app_port, redis_port = free_port(), free_port(), free_port()
+    env = {
+        **os.environ,
+        "LLM_BACKEND": "huggingface",
+        "HF_API_URL": f"http://127.0.0.1:{llm_port}/",
+        "HUGGINGFACE_TOKEN": os.getenv("HUGGINGFACE_TOKEN", "loadtest"),
+        "DATABASE_URL": f"sqlite:///{workdir}/loadtest.db",
+        "WRITE_BEHIND_SPILL_PATH": f"{workdir}/pending_turns.jsonl",
+        "WRITE_BEHIND_DEAD_LETTER_PATH": f"{workdir}/dead_turns.jsonl",
+    }
+    if args.store:
+        env["CONVERSATION_STORE"] = args.store
+        env["CONVERSATION_SHM_PATH"] = f"{workdir}/conversations.shm"
+        env["REDIS_URL"] = f"redis://127.0.0.1:{redis_port}/0"
+    processes = []
+    try:
+        if args.store == "redis":
+            redis = start_process(["-m", "loadtest", "fake-redis", "--port", str(redis_port)],
+                                  env, f"{workdir}/fake-redis.log")
+            processes.append(redis)
+            wait_until_listening(redis_port, redis)
+        llm = start_process(["-m", "loadtest", "fake-llm", "--port", str(llm_port), *fake_llm_args(args)],
+                            env, f"{workdir}/fake-llm.log")
+        processes.append(llm)
+        wait_until_up(f"http://127.0.0.1:{llm_port}/stats", llm)
+        app = start_process(["-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning",
+                             "--workers", str(args.workers)],
+                            env, f"{workdir}/backend.log")
+        processes.append(app)
+        wait_until_up(f"http://127.0.0.1:{app_port}/", app)
+        print(f"Fake LLM on :{llm_port}, backend on :{app_port} ({args.workers} workers, "
+              f"{args.store or 'default'} conversation store), logs in {workdir}")
+        yield f"http://127.0.0.1:{app_port}"
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def print_backend_stats(base_url: str) -> None:
+    """Show the server's own view of the run: queueing and generation stats."""
+    try:
+        stats = httpx.get(f"{base_url}/chat/stats", timeout=10).json()
+    except Exception as e:
+        print(f"Could not fetch backend stats: {e}")
+        return
+    for key in ("admission", "llm_backend", "response_cache", "write_behind", "conversation_cache"):
+        if stats.get(key) is not None:
+            print(f"{key}: {json.dumps(stats[key])}")
+
+
+def run_fake_llm(args) -> None:
+    import uvicorn
+    from .fakeLlm import FakeLlm, create_app
+
+    llm = FakeLlm(
+        first_token_median=args.first_token_median,
+        first_token_sigma=args.first_token_sigma,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(llm), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def run_fake_redis(args) -> None:
+    from .fakeRedis import run_forever
+
+    print(f"Fake Redis on :{args.port}")
+    try:
+        asyncio.run(run_forever("127.0.0.1", args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_load(args) -> int:
+    from .loadGenerator import run_classroom, run_replay
+
+    @contextmanager
+    def target() -> Iterator[str]:
+        if args.target:
+            yield args.target.rstrip("/")
+        else:
+            with local_stack(args) as url:
+                yield url
+
+    results = []
+    with target() as base_url:
+        if args.command == "classroom":
+            for students in [int(n) for n in args.students.split(",")]:
+                report = asyncio.run(run_classroom(
+                    base_url, students, turns=args.turns, think_time=args.think_time,
+                    ramp_up=args.ramp_up, stream=not args.no_stream, seed=args.seed,
+                ))
+                report.print(f"{students} students")
+                results.append({"students": students, **report.summary()})
+        else:
+            report = asyncio.run(run_replay(base_url, args.log, speedup=args.speedup, interval=args.interval))
+            report.print(f"Replay of {args.log} at {args.speedup}x")
+            results.append({"log": args.log, "speedup": args.speedup, **report.summary()})
+        print()
+        print_backend_stats(base_url)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="End-to-end load tests for the chat backend")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_llm_options(command):
+        command.add_argument("--first-token-median", type=float, default=0.3, help="Median seconds to first token")
+        command.add_argument("--first-token-sigma", type=float, default=0.5, help="Log-normal spread of first-token latency")
+        command.add_argument("--tokens-per-second", type=float, default=30.0, help="Fake decoding speed")
+        command.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake LLM requests failing with 503")
+        command.add_argument("--seed", type=int, help="Random seed")
+
+    def add_run_options(command):
+        add_llm_options(command)
+        command.add_argument("--target", help="Use an already running backend instead of starting one")
+        command.add_argument("--workers", type=int, default=1, help="Backend worker processes to start")
+        command.add_argument("--store", choices=["local", "shm", "redis"],
+                             help="Conversation store of the started backend (CONVERSATION_STORE)")
+        command.add_argument("--output", help="Write JSON results to this file")
+
+    fake = commands.add_parser("fake-llm", help="Serve only the fake LLM")
+    fake.add_argument("--port", type=int, default=8081)
+    add_llm_options(fake)
+
+    classroom = commands.add_parser("classroom", help="Simulate students chatting about one topic")
+    classroom.add_argument("--students", default="30", help="Concurrent students; a comma list runs a sweep")
+    classroom.add_argument("--turns", type=int, default=5, help="Turns per student after the opening turn")
+    classroom.add_argument("--think-time", type=float, default=5.0, help="Mean seconds between a student's turns")
+    classroom.add_argument("--ramp-up", type=float, default=5.0, help="Seconds over which students join")
+    classroom.add_argument("--no-stream", action="store_true", help="Use /chat instead of /chat/stream")
+    add_run_options(classroom)
+
+    fake_redis = commands.add_parser("fake-redis", help="Serve only the in-memory Redis stand-in")
+    fake_redis.add_argument("--port", type=int, default=6379)
+
+    replay = commands.add_parser("replay", help="Replay a JSONL request log")
+    replay.add_argument("log", help="JSONL request log")
+    replay.add_argument("--speedup", type=float, default=1.0, help="Replay this many times faster than recorded")
+    replay.add_argument("--interval", type=float, default=1.0, help="Spacing of log lines without timestamps")
+    add_run_options(replay)
+
+    return parser.parse_args(argv)
+
+
+def main() -> int:
+    args = parse_args()
+    if args.command == "fake-llm":
+        run_fake_llm(args)
+        return 0
+    if args.command == "fake-redis":
+        run_fake_redis(args)
+        return 0
+    return run_load(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Stand-in for a text-generation-inference endpoint with configurable latency and token rate.
+"""
+import asyncio
+import itertools
+import json
+import random
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("La investigación empieza con una buena pregunta que delimita el tema y orienta "
+         "la búsqueda de fuentes confiables para aprender algo nuevo").split()
+
+
+class FakeLlm:
+    """Generates filler text with a log-normal time to first token and a fixed token rate.
+
+    The total time of a non-streaming request is the time to first token plus
+    one token interval per generated token, like a real decoder.
+    """
+
+    def __init__(
+        self,
+        first_token_median: float = 0.3,
+        first_token_sigma: float = 0.5,
+        tokens_per_second: float = 30.0,
+        min_tokens: int = 30,
+        max_tokens: int = 80,
+        error_rate: float = 0.0,
+        accept_batches: bool = True,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            first_token_median: Median seconds until the first token
+            first_token_sigma: Log-normal spread of the first-token latency
+            tokens_per_second: Decoding speed after the first token
+            min_tokens: Fewest tokens in a response
+            max_tokens: Most tokens in a response, further capped by max_new_tokens
+            error_rate: Fraction of requests answered with 503
+            accept_batches: Answer a list of inputs with a list of generations; TGI itself rejects them with 422
+            seed: Random seed for reproducible runs
+        """
+        self.first_token_median = first_token_median
+        self.first_token_sigma = first_token_sigma
+        self.tokens_per_second = tokens_per_second
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.error_rate = error_rate
+        self.accept_batches = accept_batches
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.in_flight = 0
+
+    def first_token_delay(self) -> float:
+        return self.first_token_median * self.random.lognormvariate(0, self.first_token_sigma)
+
+    def tokens(self, limit: int):
+        count = self.random.randint(self.min_tokens, max(self.min_tokens, min(self.max_tokens, limit)))
+        words = itertools.islice(itertools.cycle(WORDS), self.random.randrange(len(WORDS)), None)
+        text = [f" {next(words)}" for _ in range(count - 1)]
+        return text + [" ¿Qué opinas?"]
+
+    async def generate(self, limit: int) -> str:
+        tokens = self.tokens(limit)
+        await asyncio.sleep(self.first_token_delay() + len(tokens) / self.tokens_per_second)
+        return "".join(tokens).strip()
+
+    async def stream(self, limit: int):
+        tokens = self.tokens(limit)
+        await asyncio.sleep(self.first_token_delay())
+        for i, text in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield f"data: {json.dumps({'token': {'text': text, 'special': False}})}\n\n"
+        final = {"token": {"text": "<|eot_id|>", "special": True}, "generated_text": "".join(tokens).strip()}
+        yield f"data: {json.dumps(final)}\n\n"
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "in_flight": self.in_flight}
+
+
+def create_app(llm: FakeLlm) -> FastAPI:
+    """Serve the fake model with the request and response shapes of TGI."""
+    app = FastAPI(title="Fake LLM")
+
+    @app.post("/")
+    async def generate(request: Request):
+        payload = await request.json()
+        llm.requests += 1
+        if llm.random.random() < llm.error_rate:
+            return JSONResponse({"error": "Model overloaded"}, status_code=503)
+        limit = int(payload.get("parameters", {}).get("max_new_tokens", llm.max_tokens))
+        inputs = payload.get("inputs")
+
+        if payload.get("stream"):
+            async def events():
+                llm.in_flight += 1
+                try:
+                    async for event in llm.stream(limit):
+                        yield event
+                finally:
+                    llm.in_flight -= 1
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        if isinstance(inputs, list) and not llm.accept_batches:
+            return JSONResponse({"error": "Input validation error: `inputs` must be a string"}, status_code=422)
+
+        llm.in_flight += 1
+        try:
+            if isinstance(inputs, list):
+                texts = await asyncio.gather(*(llm.generate(limit) for _ in inputs))
+                return [{"generated_text": text} for text in texts]
+            return [{"generated_text": await llm.generate(limit)}]
+        finally:
+            llm.in_flight -= 1
+
+    @app.get("/stats")
+    async def stats():
+        return llm.get_stats()
+
+    return app
@@ -0,0 +1,170 @@
+"""
+In-memory stand-in for Redis, speaking enough of its protocol for the redis conversation store.
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class FakeRedis:
+    """Keys with expiry, plus WATCH/MULTI/EXEC with Redis' optimistic semantics.
+
+    Supports PING, SELECT, AUTH, GET, SET (with EX/PX), DEL, EXISTS, DBSIZE,
+    FLUSHDB, WATCH, UNWATCH, MULTI, EXEC and DISCARD. A transaction fails
+    (EXEC replies nil) when a watched key was written after WATCH.
+    """
+
+    def __init__(self):
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        # Bumped on every write so watchers can tell a key changed
+        self.revisions: Dict[bytes, int] = {}
+        self.commands = 0
+        self.aborted_transactions = 0
+
+    def _live(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def _touch(self, key: bytes) -> None:
+        self.revisions[key] = self.revisions.get(key, 0) + 1
+
+    def run(self, args: List[bytes]) -> Any:
+        """Execute one command, returning its reply or an Exception for an error reply."""
+        self.commands += 1
+        name = args[0].upper()
+        if name == b"PING":
+            return "PONG"
+        if name in (b"SELECT", b"AUTH"):
+            return "OK"
+        if name == b"GET":
+            return self._live(args[1])
+        if name == b"SET":
+            expires_at = None
+            options = [arg.upper() for arg in args[3:]]
+            if b"EX" in options:
+                expires_at = time.time() + int(args[3 + options.index(b"EX") + 1])
+            elif b"PX" in options:
+                expires_at = time.time() + int(args[3 + options.index(b"PX") + 1]) / 1000
+            self.data[args[1]] = (args[2], expires_at)
+            self._touch(args[1])
+            return "OK"
+        if name == b"DEL":
+            removed = 0
+            for key in args[1:]:
+                if self._live(key) is not None:
+                    del self.data[key]
+                    removed += 1
+                self._touch(key)
+            return removed
+        if name == b"EXISTS":
+            return sum(1 for key in args[1:] if self._live(key) is not None)
+        if name == b"DBSIZE":
+            return sum(1 for key in list(self.data) if self._live(key) is not None)
+        if name == b"FLUSHDB":
+            for key in self.data:
+                self._touch(key)
+            self.data.clear()
+            return "OK"
+        return Exception(f"ERR unknown command '{name.decode(errors='replace')}'")
+
+
+class _Session:
+    """Per-connection transaction state."""
+
+    def __init__(self):
+        self.watched: Dict[bytes, int] = {}
+        self.queued: Optional[List[List[bytes]]] = None
+
+
+def encode(reply: Any) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return b"-%s\r\n" % str(reply).encode()
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+    raise TypeError(f"Cannot encode {type(reply).__name__}")
+
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    """Read one RESP array of bulk strings; None when the client hung up."""
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, as typed into telnet or redis-cli --no-raw
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = await reader.readline()
+        length = int(header[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+def handle(redis: FakeRedis, session: _Session, args: List[bytes]) -> Any:
+    name = args[0].upper()
+    if name == b"WATCH":
+        for key in args[1:]:
+            session.watched[key] = redis.revisions.get(key, 0)
+        return "OK"
+    if name == b"UNWATCH":
+        session.watched.clear()
+        return "OK"
+    if name == b"MULTI":
+        session.queued = []
+        return "OK"
+    if name == b"DISCARD":
+        session.queued = None
+        session.watched.clear()
+        return "OK"
+    if name == b"EXEC":
+        queued, session.queued = session.queued, None
+        if queued is None:
+            return Exception("ERR EXEC without MULTI")
+        changed = any(redis.revisions.get(key, 0) != revision for key, revision in session.watched.items())
+        session.watched.clear()
+        if changed:
+            redis.aborted_transactions += 1
+            return None
+        return [redis.run(command) for command in queued]
+    if session.queued is not None:
+        session.queued.append(args)
+        return "QUEUED"
+    return redis.run(args)
+
+
+async def serve(redis: FakeRedis, host: str = "127.0.0.1", port: int = 6379) -> asyncio.AbstractServer:
+    """Start serving on host:port; every connection shares the same keyspace."""
+
+    async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = _Session()
+        try:
+            while (args := await read_command(reader)) is not None:
+                if args:
+                    writer.write(encode(handle(redis, session, args)))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(connection, host, port)
+
+
+async def run_forever(host: str, port: int) -> None:
+    server = await serve(FakeRedis(), host, port)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,289 @@
+"""
+Classroom traffic and request-log replay against a running chat backend, with per-endpoint latency reports.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+OPENING_PROMPT = (
+    "Eres un assistente de profesor de secundaria cuyo objetivo es ayudar a los alummnos a aprender. "
+    "Sé breve, sintetiza tu respuesta en 40 palabras o menos. En esta oportunidad, introduce el tema de {topic}."
+)
+STUDENT_MESSAGES = [
+    "No entiendo bien qué es una hipótesis, ¿me das un ejemplo?",
+    "¿Cómo sé si una fuente es confiable?",
+    "Creo que la pregunta de investigación debería ser más específica.",
+    "¿Qué diferencia hay entre observar y experimentar?",
+    "Me interesa investigar sobre el agua de mi barrio.",
+    "¿Cuántas fuentes necesito para empezar?",
+]
+
+
+def percentile(ordered: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LoadReport:
+    """Latencies and outcomes per endpoint over one run."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self.errors.setdefault(endpoint, 0)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def finish(self) -> None:
+        self.finished = time.perf_counter()
+
+    def summary(self) -> Dict[str, Any]:
+        """Throughput, error rate and p50/p95/p99 in milliseconds per endpoint."""
+        duration = (self.finished or time.perf_counter()) - self.started
+        endpoints = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / len(ordered),
+                "throughput_rps": len(ordered) / duration if duration else 0.0,
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+            }
+        total = sum(len(samples) for samples in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {
+            "duration_seconds": duration,
+            "requests": total,
+            "errors": errors,
+            "error_rate": errors / total if total else 0.0,
+            "throughput_rps": total / duration if duration else 0.0,
+            "endpoints": endpoints,
+        }
+
+    def print(self, title: str) -> None:
+        summary = self.summary()
+        print(f"\n{title}: {summary['requests']} requests in {summary['duration_seconds']:.1f}s, "
+              f"{summary['throughput_rps']:.1f} req/s, {summary['error_rate']:.1%} errors")
+        print(f"{'endpoint':<36} {'reqs':>6} {'err%':>6} {'rps':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for endpoint, stats in summary["endpoints"].items():
+            print(f"{endpoint:<36} {stats['requests']:>6} {stats['error_rate']:>6.1%} {stats['throughput_rps']:>7.2f} "
+                  f"{stats['p50_ms']:>9.0f} {stats['p95_ms']:>9.0f} {stats['p99_ms']:>9.0f}")
+
+
+async def timed_request(
+    client: httpx.AsyncClient,
+    report: LoadReport,
+    endpoint: str,
+    method: str,
+    path: str,
+    body: Optional[Dict[str, Any]] = None,
+) -> Optional[httpx.Response]:
+    """Send one request and record its latency under the endpoint label."""
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, path, json=body)
+    except httpx.HTTPError:
+        report.record(endpoint, time.perf_counter() - start, ok=False)
+        return None
+    report.record(endpoint, time.perf_counter() - start, ok=response.status_code < 400)
+    return response
+
+
+async def timed_stream(client: httpx.AsyncClient, report: LoadReport, body: Dict[str, Any]) -> None:
+    """Send a streaming chat turn, recording time to first token and to completion."""
+    start = time.perf_counter()
+    first_token = None
+    ok = False
+    try:
+        async with client.stream("POST", "/chat/stream", json=body) as response:
+            if response.status_code < 400:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:") and first_token is None and event is None:
+                        first_token = time.perf_counter() - start
+                    elif not line:
+                        if event in ("done", "error"):
+                            ok = event == "done"
+                        event = None
+    except httpx.HTTPError:
+        pass
+    report.record("POST /chat/stream", time.perf_counter() - start, ok)
+    if first_token is not None:
+        report.record("POST /chat/stream first token", first_token, True)
+
+
+async def create_topic(client: httpx.AsyncClient, report: LoadReport, topic: str) -> None:
+    """Create the lesson's topic the way a teacher would."""
+    await timed_request(client, report, "POST /topics/create", "POST", "/topics/create", {
+        "subject": "Ciencias",
+        "name": topic,
+        "instructions": "Introducir el método de investigación con preguntas abiertas.",
+        "content": f"Eres un tutor paciente. El tema de hoy es {topic}. Termina cada respuesta con una pregunta.",
+    })
+
+
+async def student_session(
+    client: httpx.AsyncClient,
+    report: LoadReport,
+    student: int,
+    topic: str,
+    turns: int,
+    think_time: float,
+    stream: bool,
+    rng: random.Random,
+) -> None:
+    """One student: register, open the topic, chat for a few turns, then reload history."""
+    user_id = f"student{student}"
+    await timed_request(client, report, "POST /user/register", "POST", "/user/register", {"user_id": user_id})
+    await timed_request(client, report, "GET /topics/overview", "GET", "/topics/overview")
+
+    messages = [OPENING_PROMPT.format(topic=topic)] + [rng.choice(STUDENT_MESSAGES) for _ in range(turns)]
+    for i, message in enumerate(messages):
+        if i:
+            # Students read and type between turns
+            await asyncio.sleep(rng.expovariate(1 / think_time) if think_time > 0 else 0)
+        body = {"user_id": user_id, "theme": topic, "message": message}
+        if stream:
+            await timed_stream(client, report, body)
+        else:
+            await timed_request(client, report, "POST /chat", "POST", "/chat", body)
+
+    await timed_request(client, report, "GET /chat/{user}/{theme}/history", "GET",
+                        f"/chat/{user_id}/{topic}/history?limit=20")
+
+
+async def run_classroom(
+    base_url: str,
+    students: int,
+    turns: int = 5,
+    think_time: float = 5.0,
+    ramp_up: float = 5.0,
+    stream: bool = True,
+    topic: str = "Introducción a la investigación",
+    seed: Optional[int] = None,
+) -> LoadReport:
+    """
+    Simulate a class of students chatting about one topic at the same time.
+
+    Args:
+        base_url: Backend URL
+        students: Concurrent students
+        turns: Chat turns per student after the opening turn
+        think_time: Mean seconds between a student's turns (exponential)
+        ramp_up: Seconds over which students join
+        stream: Use /chat/stream instead of /chat
+        topic: Topic created by the teacher and used by every student
+        seed: Random seed for reproducible runs
+    """
+    rng = random.Random(seed)
+    report = LoadReport()
+    limits = httpx.Limits(max_connections=students + 10, max_keepalive_connections=students + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        await create_topic(client, report, topic)
+
+        async def join(student: int):
+            await asyncio.sleep(ramp_up * student / students)
+            await student_session(client, report, student, topic, turns, think_time, stream,
+                                  random.Random(rng.random()))
+
+        await asyncio.gather(*(join(student) for student in range(students)))
+    report.finish()
+    return report
+
+
+def endpoint_label(method: str, path: str) -> str:
+    """Group history requests of different users and themes under one label."""
+    parts = path.split("?")[0].strip("/").split("/")
+    if len(parts) == 4 and parts[0] == "chat" and parts[3] == "history":
+        return f"{method} /chat/{{user}}/{{theme}}/history"
+    return f"{method} /{'/'.join(parts)}"
+
+
+def load_request_log(path: str, interval: float = 1.0) -> Iterator[Tuple[float, str, str, Optional[Dict[str, Any]]]]:
+    """
+    Read a JSONL request log as (offset seconds, method, path, body) tuples.
+
+    Lines may carry "method", "path", "body" and a "t" offset or "timestamp"
+    in seconds. Lines without a path, like backlog or message exports, are
+    replayed as /chat turns built from their "message", or "title" and
+    "body" text. Lines without timing are spaced `interval` seconds apart.
+    """
+    first = None
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            stamp = entry.get("t", entry.get("timestamp"))
+            if stamp is None:
+                offset = index * interval
+            else:
+                first = stamp if first is None else first
+                offset = stamp - first
+
+            if "path" in entry:
+                yield offset, entry.get("method", "GET").upper(), entry["path"], entry.get("body")
+                continue
+            message = entry.get("message") or " ".join(
+                str(entry[key]) for key in ("title", "body") if entry.get(key))
+            yield offset, "POST", "/chat", {
+                "user_id": str(entry.get("user_id") or entry.get("request_id") or "replay"),
+                "theme": entry.get("theme", "default"),
+                "message": message,
+            }
+
+
+async def run_replay(
+    base_url: str,
+    log_path: str,
+    speedup: float = 1.0,
+    interval: float = 1.0,
+    max_in_flight: int = 1000,
+) -> LoadReport:
+    """
+    Replay a request log open-loop, keeping the original spacing divided by speedup.
+
+    Args:
+        base_url: Backend URL
+        log_path: JSONL request log
+        speedup: Time compression; 10 replays ten minutes of traffic in one
+        interval: Spacing for log lines without timestamps, before speed-up
+        max_in_flight: Safety cap on concurrent requests
+    """
+    report = LoadReport()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+
+        async def fire(method: str, path: str, body: Optional[Dict[str, Any]]):
+            async with semaphore:
+                await timed_request(client, report, endpoint_label(method, path), method, path, body)
+
+        for offset, method, path, body in load_request_log(log_path, interval):
+            delay = start + offset / speedup - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(fire(method, path, body)))
+        await asyncio.gather(*tasks)
+    report.finish()
+    return report
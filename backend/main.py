@@ -1,8 +1,15 @@
-from fastapi import FastAPI, HTTPException, Depends
+from contextlib import aclosing, asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import json
 import time
 from dotenv import load_dotenv
 from scripts.server import ChatServer
+from scripts.admission import AdmissionRejected
+from scripts.metrics import metrics
 from utils.messages import (
     UserRegistration,
     ChatMessage,
@@ -13,13 +20,32 @@ from utils.messages import (
 # Load environment variables from .env file
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the chat server once per process and tear it down on exit"""
+    chat_server = ChatServer()
+    await chat_server.startup()
+    app.state.chat_server = chat_server
+    try:
+        yield
+    finally:
+        await chat_server.shutdown()
+
+def too_busy(error: AdmissionRejected) -> HTTPException:
+    """Map an admission rejection to 429 with a Retry-After hint"""
+    return HTTPException(
+        status_code=429,
+        detail=f"Server is busy ({error.reason}), please retry shortly",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 # Initialize components
-def get_chat_server():
-    """Dependency to get the chat server instance"""
-    return ChatServer()
+def get_chat_server(request: Request) -> ChatServer:
+    """Dependency to get the shared chat server instance"""
+    return request.app.state.chat_server
 
 # Create FastAPI app
-app = FastAPI(title="Chat Backend with Llama", version="1.0.0")
+app = FastAPI(title="Chat Backend with Llama", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -33,7 +59,12 @@ app.add_middleware(
 @app.get("/")
 async def root(chat_server: ChatServer = Depends(get_chat_server)):
     """Health check endpoint"""
-    return chat_server.get_health_status()
+    return await chat_server.get_health_status()
+
+@app.get("/health/live")
+async def liveness(chat_server: ChatServer = Depends(get_chat_server)):
+    """Liveness probe that does not touch the database"""
+    return await chat_server.get_health_status(live=True)
 
 @app.post("/user/register")
 async def register_user(
@@ -45,7 +76,7 @@ async def register_user(
     if not user.user_id.strip():
         raise HTTPException(status_code=400, detail="User ID cannot be empty")
     
-    chat_server.register_user(user.user_id)
+    await chat_server.register_user(user.user_id)
     return {"message": f"User '{user.user_id}' registered successfully"}
 
 @app.post("/chat", response_model=ChatResponse)
@@ -61,8 +92,13 @@ async def chat_endpoint(
         if not chat_message.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
         
-        # Process message through chat server
-        bot_response = await chat_server.process_message(chat_message)
+        # Wait for a fair share of the generation slots
+        ticket = await chat_server.admit(chat_message)
+        try:
+            # Process message through chat server
+            bot_response = await chat_server.process_message(chat_message)
+        finally:
+            ticket.release()
         
         # Calculate response time
         response_time = int((time.time() - start_time) * 1000)
@@ -73,9 +109,54 @@ async def chat_endpoint(
             response_time_ms=response_time
         )
     
+    except AdmissionRejected as e:
+        raise too_busy(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(
+    chat_message: ChatMessage,
+    chat_server: ChatServer = Depends(get_chat_server)
+):
+    """Chat endpoint streaming the Llama response as server-sent events"""
+    if not chat_message.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    # Reject before any bytes are sent so clients still get a proper 429
+    try:
+        ticket = await chat_server.admit(chat_message)
+    except AdmissionRejected as e:
+        raise too_busy(e)
+    
+    async def event_stream():
+        start_time = time.time()
+        try:
+            # Closed here rather than by the garbage collector, so a disconnect saves the turn right away
+            async with aclosing(chat_server.stream_message(chat_message)) as tokens:
+                async for token in tokens:
+                    yield f"data: {json.dumps({'token': token})}\n\n"
+            done = {
+                "timestamp": time.time(),
+                "response_time_ms": int((time.time() - start_time) * 1000)
+            }
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
+        except Exception as e:
+            error = {"detail": f"Error processing message: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+        finally:
+            ticket.release()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also frees the slot if the client disconnects before the stream starts
+        background=BackgroundTask(ticket.release)
+    )
+
 @app.post("/topics/create")
 async def topic_endpoint(
     topic_message: TopicMessage,
@@ -88,7 +169,7 @@ async def topic_endpoint(
         
         # Create topic in chat server
         print(f"Creating topic: {topic_message}")
-        chat_server.create_topic(topic_message)
+        await chat_server.create_topic(topic_message)
         return {"message": f"Topic '{topic_message.name}' created successfully"}
     
     except Exception as e:
@@ -98,27 +179,53 @@ async def topic_endpoint(
 async def get_topics(
     chat_server: ChatServer = Depends(get_chat_server)
 ):
-    return chat_server.get_topics()
+    return await chat_server.get_topics()
 
 @app.get("/chat/{user_id}/{theme}/history")
 async def get_chat_history(
     user_id: str,
     theme: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     chat_server: ChatServer = Depends(get_chat_server)
 ):
-    return chat_server.get_chat_history(user_id, theme)
+    """Page through chat history; pass next_cursor back to get older turns"""
+    try:
+        return await chat_server.get_chat_history(user_id, theme, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/chat/search")
+async def search_chat_history(
+    q: str,
+    theme: Optional[str] = None,
+    user_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    chat_server: ChatServer = Depends(get_chat_server)
+):
+    """Find the turns where students discussed a concept; pass next_offset back for more"""
+    try:
+        return await chat_server.search_chat_history(q, theme=theme, user_id=user_id, limit=limit, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/chat/history")
 async def clear_chat_history(
     chat_server: ChatServer = Depends(get_chat_server)
 ):
-    return chat_server.clear_chat_history()
+    return await chat_server.clear_chat_history()
 
 @app.get("/chat/stats")
 async def get_chat_stats(
     chat_server: ChatServer = Depends(get_chat_server)
 ):
-    return chat_server.get_chat_stats()
+    return await chat_server.get_chat_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-stage pipeline metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,183 @@
+"""
+Admission control for generations: a global concurrency cap with per-theme, per-user fair queues.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+from .resilience import LatencyTracker
+from .metrics import LLM_QUEUE_WAIT_SECONDS
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be queued or waited too long; maps to HTTP 429."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A granted slot. Releasing is idempotent so several cleanup paths may call it."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._acquired_at = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self._controller._release(time.monotonic() - self._acquired_at)
+
+
+class AdmissionController:
+    """Caps concurrent generations and hands free slots out fairly.
+
+    Waiting requests are queued per theme and, within a theme, per user.
+    Slots go round-robin across themes and then across users, so one user
+    (or one class) flooding the endpoint only ever delays itself. Requests
+    are rejected fast when a queue is full or after waiting too long.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        max_queue_per_user: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            max_concurrent: Generations running at once (ADMISSION_MAX_CONCURRENT)
+            max_queue: Requests waiting in total (ADMISSION_MAX_QUEUE)
+            max_queue_per_user: Requests waiting per user (ADMISSION_MAX_QUEUE_PER_USER)
+            queue_timeout: Seconds a request may wait for a slot (ADMISSION_QUEUE_TIMEOUT)
+        """
+        self.max_concurrent = max_concurrent or int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+        self.max_queue = max_queue or int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+        self.max_queue_per_user = max_queue_per_user or int(os.getenv("ADMISSION_MAX_QUEUE_PER_USER", "2"))
+        self.queue_timeout = queue_timeout or float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+        self.active = 0
+        self.queued = 0
+        # theme -> user -> waiting futures; dict order is the round-robin order
+        self._queues: "OrderedDict[str, OrderedDict[str, deque]]" = OrderedDict()
+        self.wait_times = LatencyTracker(window=500)
+        self._mean_hold = 1.0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "user_queue_full": 0, "queue_timeout": 0}
+
+    async def acquire(self, user_id: str, theme: str) -> AdmissionTicket:
+        """
+        Wait for a generation slot.
+
+        Returns:
+            Ticket to release when the generation is done
+
+        Raises:
+            AdmissionRejected: If the queues are full or the wait exceeds queue_timeout
+        """
+        if self.active < self.max_concurrent and not self.queued:
+            self.active += 1
+            return self._admit(0.0)
+
+        if self.queued >= self.max_queue:
+            self._reject("queue_full")
+        users = self._queues.setdefault(theme, OrderedDict())
+        waiters = users.setdefault(user_id, deque())
+        if len(waiters) >= self.max_queue_per_user:
+            self._reject("user_queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            # Not wait_for: it returns the result when cancelled after the slot was granted,
+            # so a request whose client already left would go on to generate
+            await asyncio.wait((future,), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # The client went away; give the slot back if it was granted meanwhile
+            if future.done() and not future.cancelled():
+                self._release(0.0)
+            else:
+                self._discard(theme, user_id, future)
+            raise
+        if not future.done():
+            self._discard(theme, user_id, future)
+            self._reject("queue_timeout")
+        return self._admit(time.monotonic() - start)
+
+    def retry_after(self) -> int:
+        """Seconds until a queued request would likely get a slot."""
+        return max(1, math.ceil(self._mean_hold * (self.queued + 1) / self.max_concurrent))
+
+    def _admit(self, waited: float) -> AdmissionTicket:
+        self.admitted += 1
+        self.wait_times.record(waited)
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, queue="admission")
+        return AdmissionTicket(self)
+
+    def _reject(self, reason: str) -> None:
+        self.rejected[reason] += 1
+        raise AdmissionRejected(reason, self.retry_after())
+
+    def _release(self, held: float) -> None:
+        """Free a slot and pass it to the next waiter in round-robin order."""
+        if held:
+            self._mean_hold = 0.9 * self._mean_hold + 0.1 * held
+        self.active -= 1
+        while self.active < self.max_concurrent and self.queued:
+            theme, users = next(iter(self._queues.items()))
+            user_id, waiters = next(iter(users.items()))
+            future = waiters.popleft()
+            self.queued -= 1
+            # Rotate: this user goes behind the others of the theme, the theme behind the other themes
+            if waiters:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            if users:
+                self._queues.move_to_end(theme)
+            else:
+                del self._queues[theme]
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def _discard(self, theme: str, user_id: str, future: asyncio.Future) -> None:
+        """Remove a waiter that gave up."""
+        users = self._queues.get(theme)
+        waiters = users.get(user_id) if users else None
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        self.queued -= 1
+        if not waiters:
+            del users[user_id]
+            if not users:
+                del self._queues[theme]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Report slot usage, queue depth per theme, wait times and rejections."""
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "queued_by_theme": {
+                theme: sum(len(waiters) for waiters in users.values())
+                for theme, users in self._queues.items()
+            },
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_p50_seconds": self.wait_times.percentile(50),
+            "wait_p95_seconds": self.wait_times.percentile(95),
+            "wait_p99_seconds": self.wait_times.percentile(99),
+            "retry_after_seconds": self.retry_after(),
+        }
@@ -0,0 +1,302 @@
+"""
+Text generation backends used by ChatBot, selected with LLM_BACKEND.
+"""
+import asyncio
+import os
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .llmClient import LlamaApiClient
+
+STOP_SEQUENCES = ["<|eot_id|>", "<|end_of_text|>"]
+
+
+class LLMBackend:
+    """Interface every generation backend implements.
+
+    Prompts are fully rendered chat-template strings; backends return only
+    the newly generated text.
+    """
+
+    name = "base"
+    supports_batching = False
+    # Whether cancelling a call stops the work behind it; false for in-process inference
+    cancellable = True
+
+    async def start(self) -> None:
+        """Acquire connections or load the model."""
+
+    async def close(self) -> None:
+        """Release whatever start() acquired."""
+
+    async def warmup(self) -> None:
+        """Run a throwaway generation so the first real request is not cold."""
+        await self.generate("<|start_header_id|>user<|end_header_id|>\nHi<|eot_id|>"
+                            "<|start_header_id|>assistant<|end_header_id|>\n", 1)
+
+    async def generate(self, prompt: str, max_tokens: int) -> str:
+        """
+        Generate a completion.
+
+        Args:
+            prompt: Rendered prompt
+            max_tokens: Maximum tokens to generate
+
+        Returns:
+            Generated text
+        """
+        raise NotImplementedError
+
+    async def stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        """Generate a completion piece by piece; defaults to a single piece."""
+        yield await self.generate(prompt, max_tokens)
+
+    async def generate_batch(self, prompts: List[str], max_tokens: int) -> List[str]:
+        """Generate completions for several prompts, in order."""
+        return list(await asyncio.gather(*(self.generate(prompt, max_tokens) for prompt in prompts)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class HuggingFaceBackend(LLMBackend):
+    """Remote Llama served by the Hugging Face Inference API (or any TGI endpoint)."""
+
+    name = "huggingface"
+
+    def __init__(self, api_url: Optional[str] = None, token: Optional[str] = None):
+        """
+        Args:
+            api_url: Inference endpoint URL (HF_API_URL)
+            token: Bearer token (HUGGINGFACE_TOKEN)
+        """
+        self.api_url = api_url or os.getenv(
+            "HF_API_URL", "https://api-inference.huggingface.co/models/meta-llama/Llama-3.1-8B-Instruct"
+        )
+        self.token = token or os.getenv("HUGGINGFACE_TOKEN")
+        self.client = LlamaApiClient(self.api_url, self.token)
+        # Batched requests need an endpoint accepting a list of inputs, which plain TGI
+        # /generate does not; start() checks before turning them on (LLM_BATCH_SIZE > 1)
+        self.batching_requested = int(os.getenv("LLM_BATCH_SIZE", "1")) > 1
+        self.supports_batching = False
+
+    async def start(self) -> None:
+        await self.client.start()
+        if self.batching_requested and not self.supports_batching:
+            self.supports_batching = await self._accepts_batches()
+
+    async def _accepts_batches(self) -> bool:
+        """Send a two-prompt batch of one token to find out whether the endpoint takes lists."""
+        prompt = "<|start_header_id|>user<|end_header_id|>\nHi<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n"
+        try:
+            await self.generate_batch([prompt, prompt], 1)
+        except Exception as e:
+            print(f"⚠️ {self.api_url} does not accept batched inputs, sending one prompt per request: {e}")
+            return False
+        print(f"✅ {self.api_url} accepts batched inputs")
+        return True
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def warmup(self) -> None:
+        """Remote endpoints warm up on their own side; a request here would only cost quota."""
+
+    async def generate(self, prompt: str, max_tokens: int) -> str:
+        result = await self.client.post(self._build_payload(prompt, max_tokens))
+        return self._extract_response_text(result)
+
+    async def stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        async for token in self.client.stream(self._build_payload(prompt, max_tokens)):
+            yield token
+
+    async def generate_batch(self, prompts: List[str], max_tokens: int) -> List[str]:
+        result = await self.client.post(self._build_payload(prompts, max_tokens))
+        if not isinstance(result, list) or len(result) != len(prompts):
+            raise Exception(f"Unexpected batch response format: {result}")
+        return [self._extract_response_text(item) for item in result]
+
+    def _build_payload(self, inputs, max_tokens: int) -> Dict[str, Any]:
+        """
+        Build the request body for the inference endpoint.
+
+        Args:
+            inputs: Rendered prompt, or a list of prompts for a batched request
+            max_tokens: Maximum tokens to generate
+
+        Returns:
+            JSON-serialisable payload
+        """
+        return {
+            "inputs": inputs,
+            "parameters": {
+                "max_new_tokens": max_tokens,
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "do_sample": True,
+                # Only the new text comes back, so nothing needs stripping
+                "return_full_text": False,
+                "stop": STOP_SEQUENCES
+            }
+        }
+
+    def _extract_response_text(self, result: Any) -> str:
+        """
+        Extract generated text from API response.
+
+        Raises:
+            Exception: If response format is unexpected
+        """
+        if isinstance(result, list) and len(result) > 0:
+            return self._extract_response_text(result[0])
+        elif isinstance(result, dict):
+            return result.get("generated_text", "")
+        else:
+            raise Exception(f"Unexpected response format: {result}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self.client.get_stats()}
+
+
+async def _hold_until_done(work: asyncio.Future) -> Any:
+    """
+    Wait for work running in a thread, even when the caller is cancelled meanwhile.
+
+    A thread cannot be interrupted, so returning early would release the
+    model to the next request while the thread still runs on it. The
+    cancellation is raised once the thread is done.
+    """
+    cancelled = False
+    while not work.done():
+        try:
+            await asyncio.wait([work])
+        except asyncio.CancelledError:
+            cancelled = True
+    if cancelled:
+        raise asyncio.CancelledError()
+    return work.result()
+
+
+class LlamaCppBackend(LLMBackend):
+    """In-process CPU inference of a GGUF model through llama-cpp-python.
+
+    The model is loaded once at startup and is not thread-safe, so
+    generations run one at a time in a worker thread while the event loop
+    keeps serving other requests. llama-cpp-python decodes one sequence per
+    call, so there is no batching here; concurrent students queue for the model.
+    """
+
+    name = "llamacpp"
+    cancellable = False
+
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        n_threads: Optional[int] = None,
+        n_ctx: Optional[int] = None,
+    ):
+        """
+        Args:
+            model_path: Path to the GGUF file (LLM_MODEL_PATH)
+            n_threads: CPU threads used for inference (LLM_THREADS, default: all cores)
+            n_ctx: Context window in tokens (LLM_CONTEXT_SIZE)
+        """
+        self.model_path = model_path or os.getenv("LLM_MODEL_PATH")
+        self.n_threads = n_threads or int(os.getenv("LLM_THREADS", str(os.cpu_count() or 1)))
+        self.n_ctx = n_ctx or int(os.getenv("LLM_CONTEXT_SIZE", "4096"))
+        self.model = None
+        self._lock = asyncio.Lock()
+        self.generations = 0
+
+    async def start(self) -> None:
+        if self.model is not None:
+            return
+        if not self.model_path:
+            raise Exception("LLM_MODEL_PATH is required for the llamacpp backend")
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise Exception("llama-cpp-python is not installed; pip install llama-cpp-python")
+        print(f"⏳ Loading local model {self.model_path} with {self.n_threads} threads")
+        self.model = await asyncio.to_thread(
+            Llama, model_path=self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads, verbose=False
+        )
+        print("✅ Local model loaded")
+
+    async def close(self) -> None:
+        self.model = None
+
+    async def generate(self, prompt: str, max_tokens: int) -> str:
+        async with self._lock:
+            result = await _hold_until_done(asyncio.ensure_future(asyncio.to_thread(
+                self.model.create_completion, prompt, max_tokens=max_tokens,
+                temperature=0.7, top_p=0.9, stop=STOP_SEQUENCES
+            )))
+        self.generations += 1
+        return result["choices"][0]["text"]
+
+    async def stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in self.model.create_completion(
+                    prompt, max_tokens=max_tokens, temperature=0.7, top_p=0.9,
+                    stop=STOP_SEQUENCES, stream=True
+                ):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk["choices"][0]["text"])
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        async with self._lock:
+            worker = loop.run_in_executor(None, produce)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                # Let the thread finish before the model is handed to another request
+                cancelled.set()
+                await _hold_until_done(worker)
+        self.generations += 1
+
+    async def generate_batch(self, prompts: List[str], max_tokens: int) -> List[str]:
+        return [await self.generate(prompt, max_tokens) for prompt in prompts]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "model_path": self.model_path,
+            "threads": self.n_threads,
+            "context_size": self.n_ctx,
+            "loaded": self.model is not None,
+            "generations": self.generations,
+        }
+
+
+def create_backend(name: Optional[str] = None) -> Optional[LLMBackend]:
+    """
+    Build the backend named by LLM_BACKEND.
+
+    Defaults to the Hugging Face API when HUGGINGFACE_TOKEN is set and to no
+    backend (fallback responses only) otherwise.
+    """
+    name = (name or os.getenv("LLM_BACKEND") or ("huggingface" if os.getenv("HUGGINGFACE_TOKEN") else "none")).lower()
+    if name == "huggingface":
+        return HuggingFaceBackend()
+    if name == "llamacpp":
+        return LlamaCppBackend()
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown LLM_BACKEND '{name}'")
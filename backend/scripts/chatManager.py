@@ -1,84 +1,259 @@
+import asyncio
+import json
 import time
+import zlib
 from typing import Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
+import os
 from utils.messages import SimpleChatMessage, ChatMessage
+from .contextWindow import RollingSummary, token_counter
+from .chatbot import PromptBuffer
+from .conversationStore import ConversationStore, VersionConflict, create_conversation_store
+from .metrics import (
+    CONVERSATION_CACHE, CONVERSATION_LOOKUP_SECONDS, HISTORY_LOAD_SECONDS,
+    PERSIST_FAILURES, PERSIST_SECONDS, PERSISTED_TURNS
+)
+
+# Prompt token budget per conversation (theme prompt + summary + recent turns)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "2048"))
 
 
 class Conversation:
-    def __init__(self, user_id: str, initial_messages: List[SimpleChatMessage] = None):
-        self._cache_dirty = True
-        self._cache = {}
+    def __init__(self, user_id: str, initial_messages: List[SimpleChatMessage] = None, max_tokens: int = None):
         self.user_id = user_id
-        self.messages: List[SimpleChatMessage] = initial_messages or []
         self.last_activity = time.time()
+        # Set by the conversation store; bumped on every stored turn
+        self.version = 0
         self.max_messages = 20  # Keep last 20 messages in memory
+        # Token budget for the whole context: theme prompt, summary and recent turns
+        self.max_tokens = max_tokens or CONTEXT_MAX_TOKENS
+        self.summary = RollingSummary(max_tokens=self.max_tokens // 4)
+        # Rendered prompt, extended turn by turn instead of rebuilt
+        self.prompt_buffer = PromptBuffer()
+        
+        # The theme prompt is kept apart so trimming never drops it
+        initial_messages = initial_messages or []
+        system = [msg for msg in initial_messages if msg.sender == "system"]
+        self.system_prompt = system[0].content if system else ""
+        self.system_tokens = token_counter.count(self.system_prompt)
+        self._system_entry = {"role": "system", "content": self.system_prompt} if self.system_prompt else None
+        self._summary_entry = None
+        
+        # Context entries are created once per message and reused on every turn
+        self.messages: List[SimpleChatMessage] = [msg for msg in initial_messages if msg.sender != "system"]
+        self._entries = [self._to_entry(msg) for msg in self.messages]
+        self._token_counts = [token_counter.count(msg.content) for msg in self.messages]
+        self._turn_tokens = sum(self._token_counts)
+        self._trim()
+    
+    @staticmethod
+    def _to_entry(msg: SimpleChatMessage) -> Dict[str, str]:
+        return {
+            "role": "assistant" if msg.sender == "bot" else msg.sender,
+            "content": msg.content
+        }
     
     def add_message(self, content: str, sender: str):
         """Add message to conversation and maintain size limit"""
         message = SimpleChatMessage(content, sender, time.time())
+        tokens = token_counter.count(content)
         self.messages.append(message)
-        self._cache_dirty = True
+        self._entries.append(self._to_entry(message))
+        self._token_counts.append(tokens)
+        self._turn_tokens += tokens
         self.last_activity = time.time()
-        
-        # Keep only recent messages in memory
+        self._trim()
+    
+    def count_tokens(self, text: str) -> int:
+        """Count tokens with the tokenizer used for context budgeting"""
+        return token_counter.count(text)
+    
+    def _trim(self):
+        """Keep only recent messages in memory; older ones go to the summary"""
         if len(self.messages) > self.max_messages:
-            self.messages = self.messages[-self.max_messages:]
+            # Fold down to half so the prompt prefix stays stable for several turns
+            self._fold(len(self.messages) - self.max_messages // 2)
+    
+    def _fold(self, count: int):
+        """Move the oldest messages into the rolling summary"""
+        self.summary.fold(self.messages[:count])
+        self._turn_tokens -= sum(self._token_counts[:count])
+        del self.messages[:count]
+        del self._entries[:count]
+        del self._token_counts[:count]
+        self._summary_entry = {"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary.text}"}
     
-    def get_context(self, max_messages: int = 10) -> List[Dict[str, str]]:
-        """Optimized context retrieval with caching"""
-        cache_key = f"context_{max_messages}"
+    def get_context(self, max_messages: int = None, reserve_tokens: int = 0,
+                    material: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """
+        Build the model context within the token budget.
         
-        if not self._cache_dirty and cache_key in self._cache:
-            return self._cache[cache_key]
+        The theme prompt always comes first, followed by the summary of older
+        turns and as many of the newest turns as fit. Turns that no longer fit
+        are folded into the summary. The returned entries are the same objects
+        from turn to turn, which lets the prompt buffer reuse their rendering.
         
-        if not self.messages or max_messages <= 0:
-            result = []
-        else:
-            recent_messages = self.messages[-max_messages:]
-            result = [
-                {
-                    "role": "assistant" if msg.sender == "bot" else msg.sender,
-                    "content": msg.content
-                }
-                for msg in recent_messages
-            ]
-
-        self._cache[cache_key] = result
-        self._cache_dirty = False
+        Args:
+            max_messages: Optional cap on the number of recent messages
+            reserve_tokens: Tokens to leave free, e.g. for the incoming user message
+            material: Topic chunks retrieved for this turn; sent last, after the
+                turns, so the rendered prefix stays reusable
+        """
+        material_entry = None
+        if material:
+            material_entry = {"role": "system", "content": "Lesson material for this question:\n" + "\n\n".join(material)}
+            reserve_tokens += token_counter.count(material_entry["content"])
+        # Budget the summary at its cap so folding cannot overflow the context
+        remaining = self.max_tokens - reserve_tokens - self.system_tokens - self.summary.max_tokens
+        fits = self._turn_tokens <= remaining and (max_messages is None or len(self.messages) <= max_messages)
+        if not fits:
+            # Refill to three quarters so the next few turns fit without folding again
+            remaining = remaining * 3 // 4
+            limit = len(self.messages) if max_messages is None else max_messages
+            start = len(self.messages)
+            while start > 0 and len(self.messages) - start < limit and self._token_counts[start - 1] <= remaining:
+                remaining -= self._token_counts[start - 1]
+                start -= 1
+            if start > 0:
+                self._fold(start)
         
+        result = []
+        if self._system_entry is not None:
+            result.append(self._system_entry)
+        if self._summary_entry is not None:
+            result.append(self._summary_entry)
+        result.extend(self._entries)
+        if material_entry is not None:
+            result.append(material_entry)
         return result
     
+    def get_context_tokens(self) -> int:
+        """Tokens currently held by the theme prompt, summary and in-memory turns"""
+        return self.system_tokens + self.summary.tokens + self._turn_tokens
+    
     def is_expired(self, timeout_seconds: int = 1800) -> bool:
         """Check if conversation has been inactive too long"""
         return time.time() - self.last_activity > timeout_seconds
+    
+    def to_bytes(self) -> bytes:
+        """Compact form for shared conversation stores: compressed JSON with token counts included"""
+        state = [
+            1, self.user_id, self.last_activity, self.max_tokens,
+            self.system_prompt, self.system_tokens,
+            self.summary.lines, self.summary.line_tokens,
+            [[msg.sender, msg.timestamp, msg.content, tokens] for msg, tokens in zip(self.messages, self._token_counts)],
+        ]
+        return zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 1)
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Conversation":
+        """Rebuild a conversation written by to_bytes() without recounting tokens"""
+        (_, user_id, last_activity, max_tokens, system_prompt, system_tokens,
+         summary_lines, summary_tokens, messages) = json.loads(zlib.decompress(data))
+        conversation = cls.__new__(cls)
+        conversation.user_id = user_id
+        conversation.last_activity = last_activity
+        conversation.version = 0
+        conversation.max_messages = 20
+        conversation.max_tokens = max_tokens
+        conversation.summary = RollingSummary(max_tokens=max_tokens // 4)
+        conversation.summary.restore(summary_lines, summary_tokens)
+        conversation.prompt_buffer = PromptBuffer()
+        conversation.system_prompt = system_prompt
+        conversation.system_tokens = system_tokens
+        conversation._system_entry = {"role": "system", "content": system_prompt} if system_prompt else None
+        conversation._summary_entry = (
+            {"role": "system", "content": f"Summary of the earlier conversation:\n{conversation.summary.text}"}
+            if summary_lines else None
+        )
+        conversation.messages = [SimpleChatMessage(content, sender, timestamp) for sender, timestamp, content, _ in messages]
+        conversation._entries = [cls._to_entry(msg) for msg in conversation.messages]
+        conversation._token_counts = [tokens for _, _, _, tokens in messages]
+        conversation._turn_tokens = sum(conversation._token_counts)
+        return conversation
 
 class ChatMemoryManager:
-    def __init__(self, database, max_memory_conversations: int = 1000):
+    def __init__(self, database, max_memory_conversations: int = 1000, writer=None, topics=None,
+                 store: Optional[ConversationStore] = None):
         self.database = database
-        self.active_conversations: Dict[Tuple[str, str], Conversation] = {}
+        self.writer = writer  # Optional WriteBehindQueue; saves inline when absent
+        self.topics = topics  # Optional TopicRegistry; prompts are read from the DB when absent
         self.max_memory_conversations = max_memory_conversations
         self.conversation_timeout = 1800  # 30 minutes
+        self.sweep_interval = 60
+        # In-process by default; CONVERSATION_STORE=shm or redis shares conversations between workers
+        # Stores are sized, so an empty one is falsy; compare with None
+        self.store = store if store is not None else create_conversation_store(
+            Conversation.from_bytes, max_memory_conversations, self.conversation_timeout)
+        self._sweeper: Optional[asyncio.Task] = None
+        # In-flight database loads, shared by concurrent misses on the same key
+        self._loading: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.coalesced_loads = 0
+        self.version_conflicts = 0
+        self.save_retries = 3
+    
+    async def start(self):
+        """Open the conversation store and start the background sweeper for expired conversations"""
+        await self.store.start()
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_periodically())
+    
+    async def stop(self):
+        """Stop the sweeper and close the conversation store"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        await self.store.close()
     
     async def get_conversation(self, user_id: str, theme: str) -> Conversation:
-        """Get or create conversation with database fallback"""
+        """Get or create conversation with database fallback, recording lookup metrics"""
+        with CONVERSATION_LOOKUP_SECONDS.time():
+            return await self._get_conversation(user_id, theme)
+    
+    async def _get_conversation(self, user_id: str, theme: str) -> Conversation:
         # Check if already in memory
-        if (user_id, theme) in self.active_conversations:
-            conversation = self.active_conversations[(user_id, theme)]
-            conversation.last_activity = time.time()  # Update activity
+        key = (user_id, theme)
+        conversation = await self.store.get(key)
+        if conversation is not None:
+            CONVERSATION_CACHE.inc(result="hit")
             return conversation
         
-        # Load from database
-        recent_messages = self.database.get_chat_history(user_id, theme, limit=20)
+        # Join a load already in flight for this key, or start one
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = asyncio.create_task(self._load_conversation(user_id, theme))
+            self._loading[key] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+            CONVERSATION_CACHE.inc(result="miss")
+        else:
+            self.coalesced_loads += 1
+            CONVERSATION_CACHE.inc(result="coalesced")
+        # Shielded so one cancelled caller does not abort the load for the others
+        return await asyncio.shield(loading)
+    
+    async def _load_conversation(self, user_id: str, theme: str) -> Conversation:
+        """Load a conversation from the database into memory"""
+        theme_prompt = self.topics.get_context_prompt(theme) if self.topics is not None else None
+        with HISTORY_LOAD_SECONDS.time():
+            recent_messages = await self.database.get_chat_history(user_id, theme, limit=20, theme_prompt=theme_prompt)
         conversation = Conversation(user_id, recent_messages)
         
-        # Add to memory (with cleanup if needed)
-        await self._add_to_memory(user_id, theme, conversation)
+        try:
+            await self.store.put((user_id, theme), conversation, expected_version=0)
+        except VersionConflict:
+            # Another worker loaded it meanwhile; its copy may already have newer turns
+            self.version_conflicts += 1
+            stored = await self.store.get((user_id, theme))
+            if stored is not None:
+                return stored
         return conversation
     
     async def save_and_cache_message(self, msg: ChatMessage, response: str, response_time_ms: int):
-        """Save message to database and update memory cache"""
+        """Queue message for the database and update memory cache"""
         
-        # Save to database first (WIP)
         message = {
             "user_id": msg.user_id or "anonymous",
             "theme": msg.theme or "default",
@@ -86,50 +261,66 @@ class ChatMemoryManager:
             "response": response,
             "response_time_ms": response_time_ms,
         }
-        await self.database.save_chat_message(message)
-        
-        # Update memory cache
-        conversation = await self.get_conversation(msg.user_id, msg.theme)
-        conversation.add_message(msg.message, "user")
-        conversation.add_message(response, "bot")
-    
-    async def _add_to_memory(self, user_id: str, theme: str, conversation: Conversation):
-        """Add conversation to memory with cleanup"""
-        
-        # Clean up expired conversations first
-        await self._cleanup_expired_conversations()
-        
-        # If still at limit, remove oldest conversation
-        if len(self.active_conversations) >= self.max_memory_conversations:
-            oldest_user = min(
-                self.active_conversations.keys(),
-                key=lambda u: self.active_conversations[u].last_activity
-            )
-            del self.active_conversations[oldest_user]
+        if self.writer is not None:
+            await self.writer.enqueue(message)
+        else:
+            try:
+                with PERSIST_SECONDS.time():
+                    await self.database.save_chat_message(message)
+            except Exception:
+                PERSIST_FAILURES.inc()
+                raise
+            PERSISTED_TURNS.inc()
         
-        self.active_conversations[(user_id, theme)] = conversation
+        # Update memory cache; the turn just looked it up, so this is not counted again.
+        # Another worker may store a turn for the same conversation in between, in which
+        # case the write conflicts and is redone on top of the newer copy.
+        key = (msg.user_id, msg.theme)
+        for _ in range(self.save_retries):
+            conversation = await self.store.get(key)
+            if conversation is None:
+                conversation = await self._get_conversation(msg.user_id, msg.theme)
+            conversation.add_message(msg.message, "user")
+            conversation.add_message(response, "bot")
+            try:
+                await self.store.put(key, conversation, expected_version=conversation.version)
+                return
+            except VersionConflict:
+                self.version_conflicts += 1
+        # Still contended: drop the shared copy so the next turn reloads it from the database
+        print(f"⚠️ Conversation {key} kept changing during save; it will be reloaded")
+        await self.store.delete(key)
     
-    async def _cleanup_expired_conversations(self):
-        """Remove expired conversations from memory"""
-        expired_users = [
-            user_id for user_id, conv in self.active_conversations.items()
-            if conv.is_expired(self.conversation_timeout)
-        ]
-        
-        for user_id in expired_users:
-            del self.active_conversations[user_id]
+    async def _sweep_periodically(self):
+        """Remove expired conversations in the background instead of on every miss"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.store.sweep()
+            if removed:
+                print(f"🧹 Swept {removed} expired conversations")
     
-    async def force_reload_from_db(self, user_id: str) -> Conversation:
+    async def force_reload_from_db(self, user_id: str, theme: str) -> Conversation:
         """Force reload conversation from database (useful for debugging)"""
-        if user_id in self.active_conversations:
-            del self.active_conversations[user_id]
-        return await self.get_conversation(user_id)
+        await self.store.delete((user_id, theme))
+        return await self.get_conversation(user_id, theme)
     
     def get_memory_stats(self) -> dict:
         """Get statistics about memory usage"""
+        store = self.store.get_stats()
+        cached = len(self.store)
+        lookups = store["hits"] + store["misses"]
         return {
-            "active_conversations": len(self.active_conversations),
+            "active_conversations": cached,
             "memory_limit": self.max_memory_conversations,
             "timeout_seconds": self.conversation_timeout,
-            "memory_usage_percent": (len(self.active_conversations) / self.max_memory_conversations) * 100
+            "memory_usage_percent": (cached / self.max_memory_conversations) * 100,
+            "hits": store["hits"],
+            "misses": store["misses"],
+            "hit_rate": store["hits"] / lookups if lookups else 0.0,
+            "evictions": store.get("evictions", 0),
+            "expirations": store.get("expirations", 0),
+            "loads_in_flight": len(self._loading),
+            "coalesced_loads": self.coalesced_loads,
+            "version_conflicts": self.version_conflicts,
+            "store": store
         }
@@ -0,0 +1,177 @@
+"""
+Full-text search over chat turns: SQLite FTS5 or PostgreSQL tsvector, with a LIKE scan elsewhere.
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import DateTime, text
+
+# PostgreSQL text search configuration; baked into the indexed column when it is first created
+SEARCH_TEXT_CONFIG = os.getenv("SEARCH_TEXT_CONFIG", "spanish")
+
+# Theme and student go into the index as one exact token each (their UTF-8 in hex), so
+# filters are part of the MATCH and only the turns in scope are ranked
+SQLITE_SCOPE = "'t' || hex(coalesce({row}theme, '')) || ' u' || hex(coalesce({row}user_id, ''))"
+
+SQLITE_INDEX = [
+    # External content needs every indexed column in its source, hence the view adding the scope
+    f"""CREATE VIEW IF NOT EXISTS chat_messages_search AS
+        SELECT id, message, response, {SQLITE_SCOPE.format(row='')} AS scope FROM chat_messages""",
+    # The index stores only tokens, chat_messages keeps the text
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+        message, response, scope, content='chat_messages_search', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(rowid, message, response, scope)
+        VALUES (new.id, new.message, new.response, {SQLITE_SCOPE.format(row='new.')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message, response, scope)
+        VALUES ('delete', old.id, old.message, old.response, {SQLITE_SCOPE.format(row='old.')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update
+        AFTER UPDATE OF message, response, theme, user_id ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message, response, scope)
+        VALUES ('delete', old.id, old.message, old.response, {SQLITE_SCOPE.format(row='old.')});
+        INSERT INTO chat_messages_fts(rowid, message, response, scope)
+        VALUES (new.id, new.message, new.response, {SQLITE_SCOPE.format(row='new.')});
+    END""",
+]
+
+POSTGRES_INDEX = [
+    # A generated column is maintained by every insert and update, like a trigger would
+    f"""ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(message, '') || ' ' || coalesce(response, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_chat_messages_search ON chat_messages USING GIN (search_vector)",
+]
+
+
+async def create_search_index(conn) -> None:
+    """Create the full-text index and its triggers; existing turns are indexed on first creation."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        existing = (await conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages_fts'"
+        ))).scalar()
+        for statement in SQLITE_INDEX:
+            await conn.execute(text(statement))
+        if existing is None:
+            await conn.execute(text("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for statement in POSTGRES_INDEX:
+            await conn.execute(text(statement))
+    else:
+        print(f"⚠️ No full-text index for {dialect}; chat search falls back to a LIKE scan")
+
+
+def fts5_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 query matching every word.
+
+    Words are quoted, so FTS5 operators typed by users are searched for
+    literally instead of raising syntax errors; a trailing * keeps prefix search.
+    """
+    terms = re.findall(r"\w+\*?", query)
+    return " ".join(f'"{term[:-1]}"*' if term.endswith("*") else f'"{term}"' for term in terms)
+
+
+def fts5_match(query: str, theme: Optional[str], user_id: Optional[str]) -> str:
+    """The full FTS5 expression: the words in the message or reply, and the scope tokens of the filters."""
+    terms = fts5_query(query)
+    if not terms:
+        return ""
+    clauses = [f"{{message response}} : ({terms})"]
+    if theme is not None:
+        clauses.append(f'scope : "t{theme.encode("utf-8").hex()}"')
+    if user_id is not None:
+        clauses.append(f'scope : "u{user_id.encode("utf-8").hex()}"')
+    return " AND ".join(clauses)
+
+
+def _filters(theme: Optional[str], user_id: Optional[str]) -> str:
+    clauses = []
+    if theme is not None:
+        clauses.append("AND m.theme = :theme")
+    if user_id is not None:
+        clauses.append("AND m.user_id = :user_id")
+    return " ".join(clauses)
+
+
+async def search_messages(
+    db,
+    query: str,
+    theme: Optional[str] = None,
+    user_id: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Rank chat turns matching query, best first.
+
+    Args:
+        db: Session to search with
+        query: Words to look for, all of which must appear in the student message or the reply
+        theme: Only search this theme
+        user_id: Only search this student's turns
+        limit: Maximum number of results
+        offset: Results to skip, for pagination
+
+    Returns:
+        Rows with id, user_id, theme, timestamp, message, response, snippet and rank
+    """
+    dialect = db.bind.dialect.name
+    params = {"theme": theme, "user_id": user_id, "limit": limit, "offset": offset}
+    if dialect == "sqlite":
+        params["query"] = fts5_match(query, theme, user_id)
+        if not params["query"]:
+            return []
+        # bm25() is lower for better matches; the scope column has no say in it. The snippet
+        # comes from the message if it has a hit (marked with \x02 to find out), else the reply.
+        # Turns are joined only for the page of hits.
+        statement = """
+            SELECT m.id, m.user_id, m.theme, m.timestamp, m.message, m.response, hits.snippet, hits.rank
+            FROM (
+                SELECT rowid,
+                       CASE WHEN instr(snippet(chat_messages_fts, 0, char(2), '', '', 1), char(2))
+                            THEN snippet(chat_messages_fts, 0, '[', ']', '…', 16)
+                            ELSE snippet(chat_messages_fts, 1, '[', ']', '…', 16) END AS snippet,
+                       -bm25(chat_messages_fts, 1.0, 1.0, 0.0) AS rank
+                FROM chat_messages_fts
+                WHERE chat_messages_fts MATCH :query
+                ORDER BY bm25(chat_messages_fts, 1.0, 1.0, 0.0), rowid DESC
+                LIMIT :limit OFFSET :offset
+            ) hits JOIN chat_messages m ON m.id = hits.rowid
+            ORDER BY hits.rank DESC, m.id DESC"""
+    elif dialect == "postgresql":
+        params["query"] = query
+        # Headlines are costly, so they are built only for the page of hits
+        statement = f"""
+            SELECT hits.*, ts_headline('{SEARCH_TEXT_CONFIG}', hits.message || ' ' || hits.response,
+                                       websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query),
+                                       'StartSel=[, StopSel=], MaxWords=24, MinWords=8') AS snippet
+            FROM (
+                SELECT m.id, m.user_id, m.theme, m.timestamp, m.message, m.response,
+                       ts_rank_cd(m.search_vector, websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query)) AS rank
+                FROM chat_messages m
+                WHERE m.search_vector @@ websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query) {_filters(theme, user_id)}
+                ORDER BY rank DESC, m.id DESC
+                LIMIT :limit OFFSET :offset
+            ) hits
+            ORDER BY hits.rank DESC, hits.id DESC"""
+    else:
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        conditions = []
+        for i, word in enumerate(words):
+            params[f"word{i}"] = f"%{word}%"
+            conditions.append(f"(m.message LIKE :word{i} OR m.response LIKE :word{i})")
+        statement = f"""
+            SELECT m.id, m.user_id, m.theme, m.timestamp, m.message, m.response, NULL AS snippet, 0 AS rank
+            FROM chat_messages m
+            WHERE {' AND '.join(conditions)} {_filters(theme, user_id)}
+            ORDER BY m.timestamp DESC, m.id DESC
+            LIMIT :limit OFFSET :offset"""
+    rows = await db.execute(text(statement).columns(timestamp=DateTime), params)
+    return [dict(row._mapping) for row in rows]
@@ -1,52 +1,197 @@
 """
-Chatbot module handling AI response generation using Llama via Hugging Face API.
+Chatbot module handling AI response generation using Llama through a pluggable backend.
 """
+import asyncio
 import os
-import requests
 import time
-from typing import List, Dict, Any
+import httpx
+from typing import List, Dict, Any, AsyncIterator
+from .backends import LLMBackend, create_backend
+from .resilience import ResilientBackend
+from .scheduler import BatchScheduler
+from .metrics import LLM_ERRORS, PROMPT_BUILD_SECONDS, record_generation
+
+# Canned replies used when the model cannot be reached
+FALLBACK_RESPONSES = {
+    ("hello", "hi", "hey"): "Hello! I'm having trouble connecting to my AI brain right now, but I'm here to chat!",
+    ("how are you", "how's it going"): "I'm doing well, thanks! Though I should mention I'm running on backup responses right now.",
+    ("bye", "goodbye", "see you"): "Goodbye! Hope to chat with you again soon!",
+    ("help",): "I'm here to help! I'm currently running on simple responses, but I can still try to assist you."
+}
+DEFAULT_FALLBACK_RESPONSE = "That's interesting! I'm currently having trouble with my main AI system, but I'm still here to chat with you."
+
+# Llama 3 chat template pieces
+ROLE_HEADERS = {
+    "system": "<|start_header_id|>system<|end_header_id|>\n",
+    "user": "<|start_header_id|>user<|end_header_id|>\n",
+    "assistant": "<|start_header_id|>assistant<|end_header_id|>\n",
+}
+END_OF_TURN = "<|eot_id|>"
+ASSISTANT_PROMPT = ROLE_HEADERS["assistant"]
+
+
+def render_message(msg: Dict[str, str]) -> str:
+    """Render one message with the Llama chat template; unknown roles render empty."""
+    header = ROLE_HEADERS.get(msg["role"])
+    return f"{header}{msg['content']}{END_OF_TURN}" if header else ""
+
+
+class PromptBuffer:
+    """Rendered prompt of one conversation, extended by the new messages only.
+
+    Contexts handed to render() are expected to grow at the end and to reuse
+    the same message dicts between turns, which Conversation.get_context
+    guarantees. Messages are compared by identity, so finding the reusable
+    prefix costs a couple of pointer comparisons; only the messages after it
+    are rendered again.
+    """
+
+    def __init__(self):
+        self._messages: List[Dict[str, str]] = []
+        self._parts: List[str] = []
+        self.rendered_messages = 0
+
+    def render(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Return the prompt for messages followed by the assistant header.
+        
+        Args:
+            messages: Conversation messages, oldest first
+            
+        Returns:
+            Formatted conversation string
+        """
+        keep = self._shared_prefix(messages)
+        del self._messages[keep:]
+        del self._parts[keep:]
+        for msg in messages[keep:]:
+            self._messages.append(msg)
+            self._parts.append(render_message(msg))
+        self.rendered_messages += len(messages) - keep
+        return "".join(self._parts) + ASSISTANT_PROMPT
+
+    def _shared_prefix(self, messages: List[Dict[str, str]]) -> int:
+        """Length of the leading messages already rendered."""
+        keep = min(len(self._messages), len(messages))
+        # Usually only the transient user message from the previous turn differs
+        while keep and messages[keep - 1] is not self._messages[keep - 1]:
+            keep -= 1
+        # Folding older turns shifts everything after the system entries
+        for i in range(min(keep, 2)):
+            if messages[i] is not self._messages[i]:
+                return i
+        return keep
 
 class ChatBot:
     """Handles AI response generation and fallback responses."""
     
-    def __init__(self, dummy=False):
-        """Initialize the chatbot with API configuration."""
+    def __init__(self, dummy=False, backend: LLMBackend = None):
+        """
+        Initialize the chatbot.
+        
+        Args:
+            dummy: Answer with canned test responses instead of a model
+            backend: Generation backend; defaults to the one selected by LLM_BACKEND
+        """
         self.dummy = dummy
-        self.hf_api_url = "https://api-inference.huggingface.co/models/meta-llama/Llama-3.1-8B-Instruct"
         self.hf_token = os.getenv("HUGGINGFACE_TOKEN")
         self.default_max_tokens = 200
-        
+        self.backend = backend if backend is not None or dummy else create_backend()
+        # Deadlines, circuit breaker, retries and hedging around the backend (LLM_RESILIENCE)
+        if self.backend is not None and os.getenv("LLM_RESILIENCE", "true").lower() == "true":
+            self.backend = ResilientBackend(self.backend)
+        self.warmup_enabled = os.getenv("LLM_WARMUP", "true").lower() == "true"
+        self.scheduler = None
+
+    async def start(self) -> None:
+        """Start the backend, loading and warming up the model if it is local."""
+        if self.backend is None:
+            return
+        await self.backend.start()
+        if self.warmup_enabled:
+            await self.backend.warmup()
+        # Batch concurrent prompts only when the backend can take several at once (LLM_BATCH_SIZE > 1);
+        # remote backends find out while starting
+        if self.scheduler is None and self.backend.supports_batching and int(os.getenv("LLM_BATCH_SIZE", "1")) > 1:
+            self.scheduler = BatchScheduler(self.backend.generate_batch)
+            await self.scheduler.start()
 
-    def generate_response(self, context: List[Dict[str, str]]) -> str:
+    async def close(self) -> None:
+        """Stop the backend."""
+        if self.scheduler is not None:
+            await self.scheduler.stop()
+        if self.backend is not None:
+            await self.backend.close()
+
+    async def generate_response(self, context: List[Dict[str, str]], prompt_buffer: PromptBuffer = None) -> str:
         """
         Generate a response to the user's message.
         
         Args:
-            message: The user's message
-            user_id: Unique identifier for the user
+            context: Conversation messages, oldest first
+            prompt_buffer: The conversation's rendered prompt, reused across turns
             
         Returns:
             Generated response string
         """
-        return self._generate_response(context)
+        return await self._generate_response(context, prompt_buffer)
         
-    def _generate_response(self, context: List[Dict[str, str]]) -> str:
+    async def _generate_response(self, context: List[Dict[str, str]], prompt_buffer: PromptBuffer = None) -> str:
         if self.dummy:
             # Dummy response for testing
             print(f"Generating response for context: {context}")
             return f"This is a dummy response. The AI prompt is: \n{context[0]['content']}\n"
-        if self.hf_token:
+        if self.backend is not None:
             try:
-                return self._generate_llama_response(context)
+                return await self._generate_llama_response(context, prompt_buffer)
             except Exception as e:
                 print(f"Error with Llama API: {e}")
-                return self._generate_fallback_response(context[-1]["message"])
+                LLM_ERRORS.inc()
+                return self._generate_fallback_response(context[-1]["content"])
         else:
-            return self._generate_fallback_response(context[-1]["message"])
+            return self._generate_fallback_response(context[-1]["content"])
     
-    def _generate_llama_response(self, context: List[Dict[str, Any]]) -> str:
+    async def stream_response(self, context: List[Dict[str, str]], prompt_buffer: PromptBuffer = None) -> AsyncIterator[str]:
         """
-        Generate response using Llama via Hugging Face API.
+        Generate a response token by token.
+        
+        Args:
+            context: Conversation messages, oldest first
+            prompt_buffer: The conversation's rendered prompt, reused across turns
+            
+        Yields:
+            Pieces of the response text as they become available
+            
+        Raises:
+            Exception: If the backend fails after part of the response was sent,
+                so callers do not take the partial text for a complete answer
+        """
+        if self.dummy:
+            for word in (await self._generate_response(context)).split(" "):
+                yield word + " "
+            return
+        if self.backend is None:
+            yield self._generate_fallback_response(context[-1]["content"])
+            return
+
+        prompt = self._render_prompt(context, prompt_buffer)
+        parts = []
+        start = time.perf_counter()
+        try:
+            async for token in self.backend.stream(prompt, self.default_max_tokens):
+                parts.append(token)
+                yield token
+            record_generation(time.perf_counter() - start, "".join(parts), "stream")
+        except Exception as e:
+            print(f"Error streaming from Llama API: {e}")
+            LLM_ERRORS.inc()
+            if parts:
+                raise
+            yield self._generate_fallback_response(context[-1]["content"])
+
+    async def _generate_llama_response(self, context: List[Dict[str, Any]], prompt_buffer: PromptBuffer = None) -> str:
+        """
+        Generate response using Llama through the configured backend.
         
         Args:
             message: The user's message
@@ -58,20 +203,18 @@ class ChatBot:
         Raises:
             Exception: If API call fails or response is invalid
         """
-        print(f"Querying Llama API with {len(context)} messages")
-        print(f"Recent messages: {context}")
-        
         # Query Llama API
-        response = self._query_llama_api(context)
+        response = await self._query_llama_api(context, prompt_buffer=prompt_buffer)
         return response
     
-    def _query_llama_api(self, messages: List[Dict[str, str]], max_tokens: int = None) -> str:
+    async def _query_llama_api(self, messages: List[Dict[str, str]], max_tokens: int = None, prompt_buffer: PromptBuffer = None) -> str:
         """
-        Query Llama model via Hugging Face Inference API.
+        Query the Llama model through the configured backend.
         
         Args:
             messages: List of conversation messages
             max_tokens: Maximum tokens to generate
+            prompt_buffer: The conversation's rendered prompt, reused across turns
             
         Returns:
             Generated response text
@@ -79,48 +222,29 @@ class ChatBot:
         Raises:
             Exception: If API request fails or returns invalid response
         """
-        if not self.hf_token:
-            raise Exception("Hugging Face token not configured")
+        if self.backend is None:
+            raise Exception("No LLM backend configured")
         
         max_tokens = max_tokens or self.default_max_tokens
         
-        headers = {
-            "Authorization": f"Bearer {self.hf_token}",
-            "Content-Type": "application/json"
-        }
-        
         # Format messages for Llama chat template
-        conversation = self._format_conversation(messages)
-        
-        payload = {
-            "inputs": conversation,
-            "parameters": {
-                "max_new_tokens": max_tokens,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "do_sample": True,
-                "stop": ["<|eot_id|>", "<|end_of_text|>"]
-            }
-        }
+        conversation = self._render_prompt(messages, prompt_buffer)
         
         try:
-            response = requests.post(
-                self.hf_api_url, 
-                headers=headers, 
-                json=payload, 
-                timeout=80
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            generated_text = self._extract_response_text(result)
+            if self.scheduler is not None:
+                # The scheduler records generation time per batch
+                generated_text = await self.scheduler.submit(conversation, max_tokens)
+            else:
+                start = time.perf_counter()
+                generated_text = await self.backend.generate(conversation, max_tokens)
+                record_generation(time.perf_counter() - start, generated_text, "direct")
             cleaned_response = self._clean_response(generated_text, conversation)
             
             return cleaned_response if cleaned_response else "I'm not sure how to respond to that."
         
-        except requests.exceptions.Timeout:
+        except (httpx.TimeoutException, asyncio.TimeoutError):
             raise Exception("Request timed out - the model might be loading")
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise Exception(f"API request failed: {str(e)}")
         except Exception as e:
             raise Exception(f"Error processing response: {str(e)}")
@@ -135,53 +259,41 @@ class ChatBot:
         Returns:
             Formatted conversation string
         """
-        conversation = ""
-        for msg in messages:
-            if msg["role"] == "user":
-                conversation += f"<|start_header_id|>user<|end_header_id|>\n{msg['content']}<|eot_id|>"
-            elif msg["role"] == "assistant":
-                conversation += f"<|start_header_id|>assistant<|end_header_id|>\n{msg['content']}<|eot_id|>"
-        
         # Add the assistant start token for the response
-        conversation += "<|start_header_id|>assistant<|end_header_id|>\n"
-        return conversation
+        return "".join(render_message(msg) for msg in messages) + ASSISTANT_PROMPT
     
-    def _extract_response_text(self, result: Any) -> str:
+    def _render_prompt(self, messages: List[Dict[str, str]], prompt_buffer: PromptBuffer = None) -> str:
         """
-        Extract generated text from API response.
+        Format messages, reusing the conversation's rendered prompt when there is one.
         
         Args:
-            result: API response JSON
+            messages: List of conversation messages
+            prompt_buffer: The conversation's rendered prompt
             
         Returns:
-            Generated text string
-            
-        Raises:
-            Exception: If response format is unexpected
+            Formatted conversation string
         """
-        if isinstance(result, list) and len(result) > 0:
-            return result[0].get("generated_text", "")
-        elif isinstance(result, dict):
-            return result.get("generated_text", "")
-        else:
-            raise Exception(f"Unexpected response format: {result}")
+        with PROMPT_BUILD_SECONDS.time(step="render"):
+            if prompt_buffer is None:
+                return self._format_conversation(messages)
+            return prompt_buffer.render(messages)
     
     def _clean_response(self, generated_text: str, conversation: str) -> str:
         """
-        Clean and extract the new response from generated text.
+        Clean the new response returned by the API.
         
         Args:
-            generated_text: Full generated text from API
+            generated_text: Generated text from API (new text only, see return_full_text)
             conversation: Original conversation context
             
         Returns:
             Cleaned response text
         """
-        # Extract only the new response (remove the input conversation)
-        if conversation in generated_text:
-            new_response = generated_text.replace(conversation, "").strip()
-        else:
-            new_response = generated_text.strip()
+        # Endpoints ignoring return_full_text echo the prompt first; startswith
+        # stops at the first differing character, so this is cheap otherwise
+        if generated_text.startswith(conversation):
+            generated_text = generated_text[len(conversation):]
+        new_response = generated_text.strip()
         
         # Clean up the response
         new_response = new_response.replace("<|eot_id|>", "").replace("<|end_of_text|>", "").strip()
@@ -219,18 +331,23 @@ class ChatBot:
         """
         message_lower = message.lower().strip()
         
-        fallback_responses = {
-            ("hello", "hi", "hey"): "Hello! I'm having trouble connecting to my AI brain right now, but I'm here to chat!",
-            ("how are you", "how's it going"): "I'm doing well, thanks! Though I should mention I'm running on backup responses right now.",
-            ("bye", "goodbye", "see you"): "Goodbye! Hope to chat with you again soon!",
-            ("help",): "I'm here to help! I'm currently running on simple responses, but I can still try to assist you."
-        }
-        
-        for keywords, response in fallback_responses.items():
+        for keywords, response in FALLBACK_RESPONSES.items():
             if any(word in message_lower for word in keywords):
                 return response
         
-        return "That's interesting! I'm currently having trouble with my main AI system, but I'm still here to chat with you."
+        return DEFAULT_FALLBACK_RESPONSE
+    
+    def is_fallback_response(self, response: str) -> bool:
+        """
+        Check whether a response came from the fallback path rather than the model.
+        
+        Args:
+            response: Response text
+            
+        Returns:
+            True for canned fallback responses
+        """
+        return response.strip() == DEFAULT_FALLBACK_RESPONSE or response.strip() in FALLBACK_RESPONSES.values()
     
     def get_stats(self) -> Dict[str, Any]:
         """
@@ -0,0 +1,97 @@
+"""
+Token accounting and rolling summaries for bounded model contexts.
+"""
+import os
+import re
+from typing import List, Optional
+
+from utils.messages import SimpleChatMessage
+
+# Word runs and single punctuation marks; long words cost several BPE tokens
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+class TokenCounter:
+    """Counts prompt tokens with the model's tokenizer when available, else estimates them.
+
+    Set LLM_TOKENIZER to a tokenizer.json path or a Hugging Face model name to
+    use the real tokenizer (requires the optional `tokenizers` package).
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        self.tokenizer = None
+        tokenizer_name = tokenizer_name or os.getenv("LLM_TOKENIZER")
+        if tokenizer_name:
+            try:
+                from tokenizers import Tokenizer
+                if os.path.exists(tokenizer_name):
+                    self.tokenizer = Tokenizer.from_file(tokenizer_name)
+                else:
+                    self.tokenizer = Tokenizer.from_pretrained(tokenizer_name)
+            except Exception as e:
+                print(f"⚠️ Tokenizer '{tokenizer_name}' unavailable, estimating token counts: {e}")
+
+    def count(self, text: str) -> int:
+        """Return the number of tokens in text."""
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return sum(1 + len(piece) // 6 for piece in _PIECES.findall(text))
+
+
+# Shared by all conversations; loading a tokenizer is expensive
+token_counter = TokenCounter()
+
+
+class RollingSummary:
+    """Extractive summary of turns that no longer fit in the context window.
+
+    Each folded message contributes one short line; the oldest lines are
+    dropped once the summary exceeds its token budget. Folding is incremental,
+    so each message is processed once.
+    """
+
+    def __init__(self, max_tokens: int, line_chars: int = 160):
+        self.max_tokens = max_tokens
+        self.line_chars = line_chars
+        self.lines: List[str] = []
+        self.line_tokens: List[int] = []
+        self.tokens = 0
+        self._text: Optional[str] = ""
+
+    def fold(self, messages: List[SimpleChatMessage]) -> None:
+        """Add messages to the summary, trimming the oldest lines to stay within budget."""
+        for message in messages:
+            speaker = "Student" if message.sender == "user" else "Tutor"
+            content = " ".join(message.content.split())
+            # The first sentence carries most of a short classroom turn
+            first = re.split(r"(?<=[.!?])\s", content, maxsplit=1)[0]
+            if len(first) > self.line_chars:
+                first = first[:self.line_chars].rstrip() + "…"
+            line = f"{speaker}: {first}"
+            tokens = token_counter.count(line)
+            self.lines.append(line)
+            self.line_tokens.append(tokens)
+            self.tokens += tokens
+        while self.lines and self.tokens > self.max_tokens:
+            self.lines.pop(0)
+            self.tokens -= self.line_tokens.pop(0)
+        self._text = None
+
+    def restore(self, lines: List[str], line_tokens: List[int]) -> None:
+        """Reinstate lines folded earlier, e.g. by another worker, without recounting them."""
+        self.lines = list(lines)
+        self.line_tokens = list(line_tokens)
+        self.tokens = sum(self.line_tokens)
+        self._text = None
+
+    @property
+    def text(self) -> str:
+        """Summary text, rebuilt only after a fold."""
+        if self._text is None:
+            self._text = "\n".join(self.lines)
+        return self._text
+
+    def __bool__(self) -> bool:
+        return bool(self.lines)
@@ -0,0 +1,103 @@
+"""
+Background archiving of idle conversations into compressed blobs.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+
+class ConversationArchiver:
+    """Keeps chat_messages down to the conversations that are still in use.
+
+    Conversations without a turn for `idle_days` are moved, a batch at a
+    time, into archived_conversations as one compressed blob each.
+    DatabaseManager reads archived turns back transparently, so the only
+    visible effect is a smaller hot table with indexes that stay in cache.
+    """
+
+    def __init__(
+        self,
+        database,
+        idle_days: Optional[float] = None,
+        interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+    ):
+        """
+        Args:
+            database: DatabaseManager owning both tables
+            idle_days: Days without turns before a conversation is archived, 0 to disable (ARCHIVE_AFTER_DAYS)
+            interval: Seconds between archiving passes (ARCHIVE_INTERVAL)
+            batch_size: Conversations archived per batch (ARCHIVE_BATCH_SIZE)
+        """
+        self.database = database
+        self.idle_days = idle_days if idle_days is not None else float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+        self.interval = interval or float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+        self.batch_size = batch_size or int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+        self._task: Optional[asyncio.Task] = None
+        self.passes = 0
+        self.archived_conversations = 0
+        self.archived_messages = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.last_pass_seconds: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle_days > 0
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def archive_now(self) -> int:
+        """Archive every conversation idle beyond the threshold; returns how many were moved."""
+        start = time.perf_counter()
+        idle_before = datetime.utcnow() - timedelta(days=self.idle_days)
+        archived = 0
+        while True:
+            batch = await self.database.archive_idle_conversations(idle_before, limit=self.batch_size)
+            archived += batch["conversations"]
+            self.archived_conversations += batch["conversations"]
+            self.archived_messages += batch["messages"]
+            self.raw_bytes += batch["raw_bytes"]
+            self.stored_bytes += batch["stored_bytes"]
+            if batch["conversations"] < self.batch_size:
+                break
+            # Let request handling use the database between batches
+            await asyncio.sleep(0)
+        self.passes += 1
+        self.last_pass_seconds = time.perf_counter() - start
+        if archived:
+            print(f"🧹 Archived {archived} idle conversations")
+        return archived
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.archive_now()
+            except Exception as e:
+                print(f"❌ Archiving idle conversations failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "idle_days": self.idle_days,
+            "interval_seconds": self.interval,
+            "passes": self.passes,
+            "archived_conversations": self.archived_conversations,
+            "archived_messages": self.archived_messages,
+            "compression_ratio": self.raw_bytes / self.stored_bytes if self.stored_bytes else None,
+            "last_pass_seconds": self.last_pass_seconds,
+        }
@@ -0,0 +1,609 @@
+"""
+Conversation stores: in-process, shared memory for workers on one host, and Redis for several hosts.
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+Key = Tuple[str, str]
+
+# Serialized entries are a big-endian version number followed by the conversation bytes
+_VERSION = struct.Struct(">Q")
+
+
+class VersionConflict(Exception):
+    """Raised by put() when the stored conversation changed since it was read."""
+
+
+class ConversationCache:
+    """LRU of conversations with idle-time expiry; every operation is O(1)."""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # Least recently used first, so expired entries collect at the front
+        self._entries: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Tuple[str, str]):
+        """Return a live conversation and mark it most recently used"""
+        conversation = self._entries.get(key)
+        if conversation is None:
+            self.misses += 1
+            return None
+        if conversation.is_expired(self.ttl_seconds):
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        conversation.last_activity = time.time()
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return conversation
+
+    def peek(self, key: Tuple[str, str]):
+        """Return a conversation without touching recency or counters"""
+        return self._entries.get(key)
+
+    def put(self, key: Tuple[str, str], conversation):
+        """Insert or replace a conversation, evicting the least recently used one when full"""
+        self._entries[key] = conversation
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Tuple[str, str]):
+        """Remove a conversation if present"""
+        return self._entries.pop(key, None)
+
+    def sweep(self) -> int:
+        """Drop expired conversations from the cold end; stops at the first live one"""
+        removed = 0
+        while self._entries:
+            key, conversation = next(iter(self._entries.items()))
+            if not conversation.is_expired(self.ttl_seconds):
+                break
+            del self._entries[key]
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    def clear(self):
+        self._entries.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ConversationStore:
+    """Where ChatMemoryManager keeps live conversations between turns.
+
+    Every stored conversation carries a version number. put() takes the
+    version the caller read and fails with VersionConflict if someone else
+    stored a newer one in between, so concurrent turns on different workers
+    cannot silently overwrite each other.
+    """
+
+    name = "base"
+
+    async def start(self) -> None:
+        """Open connections or shared files."""
+
+    async def close(self) -> None:
+        """Release what start() opened; shared data is left for other workers."""
+
+    async def get(self, key: Key):
+        """Return the live conversation for key, with its `version` set, or None."""
+        raise NotImplementedError
+
+    async def put(self, key: Key, conversation, expected_version: Optional[int] = None) -> int:
+        """
+        Store a conversation.
+
+        Args:
+            key: (user_id, theme)
+            conversation: Conversation to store
+            expected_version: Version the caller read; 0 means "must not exist yet", None skips the check
+
+        Returns:
+            The new version, also set on conversation.version
+
+        Raises:
+            VersionConflict: If the stored version is not the expected one
+        """
+        raise NotImplementedError
+
+    async def delete(self, key: Key) -> None:
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """Drop expired conversations held by this process; returns how many."""
+        return 0
+
+    def __len__(self) -> int:
+        """Conversations held by this process."""
+        return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class LocalConversationStore(ConversationStore):
+    """The per-process LRU: live objects, no serialization, only for a single worker."""
+
+    name = "local"
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.cache = ConversationCache(max_entries, ttl_seconds)
+        self.conflicts = 0
+
+    async def close(self) -> None:
+        self.cache.clear()
+
+    async def get(self, key: Key):
+        return self.cache.get(key)
+
+    async def put(self, key: Key, conversation, expected_version: Optional[int] = None) -> int:
+        current = self.cache.peek(key)
+        current_version = current.version if current is not None else 0
+        if expected_version is not None and current_version != expected_version:
+            self.conflicts += 1
+            raise VersionConflict(f"{key} is at version {current_version}, not {expected_version}")
+        conversation.version = current_version + 1
+        self.cache.put(key, conversation)
+        return conversation.version
+
+    async def delete(self, key: Key) -> None:
+        self.cache.pop(key)
+
+    def sweep(self) -> int:
+        return self.cache.sweep()
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def get_stats(self) -> Dict[str, Any]:
+        cache = self.cache
+        return {
+            "store": self.name,
+            "entries": len(cache),
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "evictions": cache.evictions,
+            "expirations": cache.expirations,
+            "conflicts": self.conflicts,
+        }
+
+
+class _SerializingStore(ConversationStore):
+    """Base for stores holding serialized conversations outside the process.
+
+    Decoded conversations are kept in a local near-cache together with their
+    version. When the stored version has not moved, the same object is
+    returned, so its rendered prompt keeps being reused turn after turn; only
+    turns written by another worker cost a decode.
+    """
+
+    def __init__(self, decode: Callable[[bytes], Any], max_entries: int, ttl_seconds: int):
+        self.decode = decode
+        self.ttl_seconds = ttl_seconds
+        self.near = ConversationCache(max_entries, ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+        self.decodes = 0
+        self.conflicts = 0
+
+    def _from_entry(self, key: Key, version: int, payload: bytes):
+        """Reuse the near-cached object for this version or decode the payload."""
+        conversation = self.near.peek(key)
+        if conversation is not None and conversation.version == version:
+            self.near.get(key)
+        else:
+            conversation = self.decode(payload)
+            conversation.version = version
+            self.near.put(key, conversation)
+            self.decodes += 1
+        self.hits += 1
+        return conversation
+
+    def _stored(self, key: Key, conversation, version: int) -> int:
+        conversation.version = version
+        self.near.put(key, conversation)
+        return version
+
+    def _conflict(self, key: Key, detail: str) -> VersionConflict:
+        self.conflicts += 1
+        # The near-cached object may carry unsaved changes; make the next get() decode
+        self.near.pop(key)
+        return VersionConflict(f"{key} {detail}")
+
+    def sweep(self) -> int:
+        return self.near.sweep()
+
+    def __len__(self) -> int:
+        return len(self.near)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "store": self.name,
+            "near_cache_entries": len(self.near),
+            "hits": self.hits,
+            "misses": self.misses,
+            "decodes": self.decodes,
+            "conflicts": self.conflicts,
+        }
+
+
+class SharedMemoryConversationStore(_SerializingStore):
+    """Conversations in a memory-mapped file shared by the workers of one host.
+
+    The file is a fixed table of equal slots. A key hashes to a window of
+    `probe` neighbouring slots, which is locked with fcntl for every read or
+    write, so workers never see half-written entries. Full windows evict
+    the entry closest to expiry. Conversations larger than a slot are not
+    shared; other workers then reload them from the database.
+    """
+
+    name = "shm"
+    _HEADER = struct.Struct(">8sII")
+    _MAGIC = b"CONVSHM1"
+    # key hash, version, expires_at, payload length, key length
+    _SLOT = struct.Struct(">QQdIH")
+
+    def __init__(
+        self,
+        decode: Callable[[bytes], Any],
+        max_entries: int,
+        ttl_seconds: int,
+        path: Optional[str] = None,
+        slots: Optional[int] = None,
+        slot_size: Optional[int] = None,
+        probe: int = 8,
+    ):
+        """
+        Args:
+            decode: Builds a conversation from its serialized bytes
+            max_entries: Size of the per-process near-cache
+            ttl_seconds: Idle time after which a conversation expires
+            path: Shared file (CONVERSATION_SHM_PATH, default under /dev/shm)
+            slots: Number of slots (CONVERSATION_SHM_SLOTS)
+            slot_size: Bytes per slot, which caps a conversation's size (CONVERSATION_SHM_SLOT_SIZE)
+            probe: Slots a key may occupy
+        """
+        super().__init__(decode, max_entries, ttl_seconds)
+        shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.path = path or os.getenv("CONVERSATION_SHM_PATH", os.path.join(shm_dir, "chat-conversations"))
+        self.slots = slots or int(os.getenv("CONVERSATION_SHM_SLOTS", "4096"))
+        self.slot_size = slot_size or int(os.getenv("CONVERSATION_SHM_SLOT_SIZE", "16384"))
+        self.probe = min(probe, self.slots)
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self.evictions = 0
+        self.oversized = 0
+
+    async def start(self) -> None:
+        if self._map is not None:
+            return
+        try:
+            import fcntl
+        except ImportError:
+            raise Exception("The shm conversation store needs fcntl (Linux or macOS)")
+        self._fcntl = fcntl
+        size = self._HEADER.size + self.slots * self.slot_size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked(0, self._HEADER.size):
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, self._HEADER.pack(self._MAGIC, self.slots, self.slot_size), 0)
+            magic, slots, slot_size = self._HEADER.unpack(os.pread(self._fd, self._HEADER.size, 0))
+            if (magic, slots, slot_size) != (self._MAGIC, self.slots, self.slot_size):
+                os.close(self._fd)
+                self._fd = None
+                raise Exception(f"{self.path} has a different layout; remove it or match "
+                                f"CONVERSATION_SHM_SLOTS={slots} and CONVERSATION_SHM_SLOT_SIZE={slot_size}")
+        self._map = mmap.mmap(self._fd, size)
+
+    async def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+            self._fd = None
+        self.near.clear()
+
+    @contextmanager
+    def _locked(self, offset: int, length: int, exclusive: bool = True):
+        self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX if exclusive else self._fcntl.LOCK_SH, length, offset)
+        try:
+            yield
+        finally:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, length, offset)
+
+    def _window(self, key: Key) -> Tuple[bytes, int, int]:
+        """Key bytes, a non-zero 64-bit hash and the first slot of the key's window."""
+        raw = f"{key[0]}\x1f{key[1]}".encode("utf-8")
+        key_hash = int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "big") or 1
+        return raw, key_hash, key_hash % (self.slots - self.probe + 1)
+
+    def _offset(self, slot: int) -> int:
+        return self._HEADER.size + slot * self.slot_size
+
+    def _find(self, raw: bytes, key_hash: int, first: int):
+        """Return (slot, version, expires_at, payload_length) of the key in its window, or None."""
+        for slot in range(first, first + self.probe):
+            offset = self._offset(slot)
+            slot_hash, version, expires_at, length, key_length = self._SLOT.unpack_from(self._map, offset)
+            if slot_hash != key_hash or key_length != len(raw):
+                continue
+            key_start = offset + self._SLOT.size
+            if self._map[key_start:key_start + key_length] == raw:
+                return slot, version, expires_at, length
+        return None
+
+    async def get(self, key: Key):
+        raw, key_hash, first = self._window(key)
+        window = (self._offset(first), self.probe * self.slot_size)
+        with self._locked(*window, exclusive=False):
+            found = self._find(raw, key_hash, first)
+            if found is None or found[2] < time.time():
+                self.misses += 1
+                return None
+            slot, version, _, length = found
+            start = self._offset(slot) + self._SLOT.size + len(raw)
+            conversation = self.near.peek(key)
+            # Same version as the near-cached object: no need to copy the payload out
+            payload = b"" if conversation is not None and conversation.version == version else self._map[start:start + length]
+        return self._from_entry(key, version, payload)
+
+    async def put(self, key: Key, conversation, expected_version: Optional[int] = None) -> int:
+        raw, key_hash, first = self._window(key)
+        payload = conversation.to_bytes()
+        if self._SLOT.size + len(raw) + len(payload) > self.slot_size:
+            # Too big to share: make other workers reload it instead of reading a stale copy
+            self.oversized += 1
+            await self.delete(key)
+            return self._stored(key, conversation, conversation.version + 1)
+
+        now = time.time()
+        with self._locked(self._offset(first), self.probe * self.slot_size):
+            found = self._find(raw, key_hash, first)
+            current = found[1] if found is not None and found[2] >= now else 0
+            if expected_version is not None and current != expected_version:
+                raise self._conflict(key, f"is at version {current}, not {expected_version}")
+            if found is not None:
+                slot = found[0]
+            else:
+                slot = self._free_slot(first, now)
+            offset = self._offset(slot)
+            self._SLOT.pack_into(self._map, offset, key_hash, current + 1, now + self.ttl_seconds, len(payload), len(raw))
+            start = offset + self._SLOT.size
+            self._map[start:start + len(raw)] = raw
+            self._map[start + len(raw):start + len(raw) + len(payload)] = payload
+        return self._stored(key, conversation, current + 1)
+
+    def _free_slot(self, first: int, now: float) -> int:
+        """An empty or expired slot of the window, else the one closest to expiry."""
+        victim, victim_expiry = first, float("inf")
+        for slot in range(first, first + self.probe):
+            slot_hash, _, expires_at, _, _ = self._SLOT.unpack_from(self._map, self._offset(slot))
+            if slot_hash == 0 or expires_at < now:
+                return slot
+            if expires_at < victim_expiry:
+                victim, victim_expiry = slot, expires_at
+        self.evictions += 1
+        return victim
+
+    async def delete(self, key: Key) -> None:
+        raw, key_hash, first = self._window(key)
+        self.near.pop(key)
+        with self._locked(self._offset(first), self.probe * self.slot_size):
+            found = self._find(raw, key_hash, first)
+            if found is not None:
+                self._SLOT.pack_into(self._map, self._offset(found[0]), 0, 0, 0.0, 0, 0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **super().get_stats(),
+            "path": self.path,
+            "slots": self.slots,
+            "slot_size": self.slot_size,
+            "evictions": self.evictions,
+            "oversized": self.oversized,
+        }
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+class _RespConnection:
+    """One connection speaking RESP2; commands are sent one at a time."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def execute(self, *args) -> Any:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.writer.write(b"".join(parts))
+        await self.writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RespError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            return None if length < 0 else (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            count = int(body)
+            return None if count < 0 else [await self._read_reply() for _ in range(count)]
+        raise RespError(f"Unexpected reply: {line!r}")
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RespClient:
+    """Minimal pooled Redis-protocol client, enough for GET/SET/DEL and WATCH transactions."""
+
+    def __init__(self, url: str, max_connections: int = 16):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._idle: List[_RespConnection] = []
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+    async def _connect(self) -> _RespConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = _RespConnection(reader, writer)
+        if self.password:
+            await connection.execute("AUTH", self.password)
+        if self.db:
+            await connection.execute("SELECT", self.db)
+        return connection
+
+    @asynccontextmanager
+    async def connection(self):
+        """Check a connection out of the pool; it is dropped if the caller fails."""
+        async with self._semaphore:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self._idle.append(connection)
+
+    async def execute(self, *args) -> Any:
+        async with self.connection() as connection:
+            return await connection.execute(*args)
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop().close()
+
+
+class RedisConversationStore(_SerializingStore):
+    """Conversations in Redis (or anything speaking its protocol), shared across hosts.
+
+    Each conversation is one key holding its version and serialized bytes,
+    expiring after the idle timeout. Writes are WATCH/MULTI/EXEC
+    transactions, so a conflicting write from another worker aborts them.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        decode: Callable[[bytes], Any],
+        max_entries: int,
+        ttl_seconds: int,
+        url: Optional[str] = None,
+        prefix: Optional[str] = None,
+    ):
+        """
+        Args:
+            decode: Builds a conversation from its serialized bytes
+            max_entries: Size of the per-process near-cache
+            ttl_seconds: Idle time after which a conversation expires
+            url: redis://[:password@]host:port/db (REDIS_URL)
+            prefix: Key prefix (CONVERSATION_KEY_PREFIX)
+        """
+        super().__init__(decode, max_entries, ttl_seconds)
+        self.url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.prefix = prefix or os.getenv("CONVERSATION_KEY_PREFIX", "conversation")
+        self.client = RespClient(self.url)
+
+    async def start(self) -> None:
+        await self.client.execute("PING")
+
+    async def close(self) -> None:
+        await self.client.close()
+        self.near.clear()
+
+    def _key(self, key: Key) -> bytes:
+        return f"{self.prefix}:{key[0]}\x1f{key[1]}".encode("utf-8")
+
+    async def get(self, key: Key):
+        value = await self.client.execute("GET", self._key(key))
+        if value is None:
+            self.misses += 1
+            return None
+        (version,) = _VERSION.unpack_from(value)
+        return self._from_entry(key, version, value[_VERSION.size:])
+
+    async def put(self, key: Key, conversation, expected_version: Optional[int] = None) -> int:
+        name = self._key(key)
+        payload = conversation.to_bytes()
+        async with self.client.connection() as connection:
+            await connection.execute("WATCH", name)
+            value = await connection.execute("GET", name)
+            current = _VERSION.unpack_from(value)[0] if value is not None else 0
+            if expected_version is not None and current != expected_version:
+                await connection.execute("UNWATCH")
+                raise self._conflict(key, f"is at version {current}, not {expected_version}")
+            await connection.execute("MULTI")
+            await connection.execute("SET", name, _VERSION.pack(current + 1) + payload, "EX", int(self.ttl_seconds))
+            if await connection.execute("EXEC") is None:
+                raise self._conflict(key, f"was written by another worker after version {current}")
+        return self._stored(key, conversation, current + 1)
+
+    async def delete(self, key: Key) -> None:
+        self.near.pop(key)
+        await self.client.execute("DEL", self._key(key))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**super().get_stats(), "url": f"redis://{self.client.host}:{self.client.port}/{self.client.db}"}
+
+
+def create_conversation_store(
+    decode: Callable[[bytes], Any],
+    max_entries: int,
+    ttl_seconds: int,
+    name: Optional[str] = None,
+) -> ConversationStore:
+    """
+    Build the store named by CONVERSATION_STORE: local (default), shm or redis.
+
+    Args:
+        decode: Builds a conversation from its serialized bytes
+        max_entries: Conversations kept per process
+        ttl_seconds: Idle time after which a conversation expires
+    """
+    name = (name or os.getenv("CONVERSATION_STORE", "local")).lower()
+    if name == "local":
+        return LocalConversationStore(max_entries, ttl_seconds)
+    if name == "shm":
+        return SharedMemoryConversationStore(decode, max_entries, ttl_seconds)
+    if name == "redis":
+        return RedisConversationStore(decode, max_entries, ttl_seconds)
+    raise ValueError(f"Unknown CONVERSATION_STORE '{name}'")
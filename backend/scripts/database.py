@@ -1,22 +1,98 @@
 # scripts/database.py
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Integer, String, DateTime, Index, LargeBinary, select, func, delete, insert, update, and_, or_, true, text, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
 from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import base64
+import itertools
+import json
 import os
+import zlib
 from utils.messages import SimpleChatMessage
+from .chatSearch import create_search_index, search_messages
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat_app.db")
+# Comma-separated read replicas; history, topic and stats reads are spread over them
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Reconnect before server-side idle timeouts or failovers close pooled connections
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
-# Create engine
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+# Async drivers for the synchronous URL schemes people usually configure
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def to_async_url(url: str) -> str:
+    """Rewrite a database URL to use an asyncio driver"""
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    """Let readers run alongside the single writer instead of waiting for its commits"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # WAL keeps commits durable against crashes of the process with NORMAL
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def create_engine_for(url: str):
+    """Create an async engine with a pool sized for concurrent requests"""
+    url = to_async_url(url)
+    if url.startswith("sqlite"):
+        # SQLite serialises writers anyway; the default pool is fine
+        engine = create_async_engine(url, connect_args={"check_same_thread": False})
+        if ":memory:" not in url and "mode=memory" not in url:
+            event.listen(engine.sync_engine, "connect", _enable_sqlite_wal)
+        return engine
+    return create_async_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+# Create engines: writes always go to the primary
+engine = create_engine_for(DATABASE_URL)
+replica_engines = [create_engine_for(url) for url in DATABASE_REPLICA_URLS]
+
+# Create session factories
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+_replica_sessions = [async_sessionmaker(replica, autoflush=False, expire_on_commit=False) for replica in replica_engines]
+_next_replica = itertools.count()
+
+def ReadSession():
+    """
+    Open a session for a read that may lag slightly behind the primary.
+    
+    Replicas take turns; without replicas this is the primary, so reads and
+    writes share one pool as before.
+    """
+    if not _replica_sessions:
+        return SessionLocal()
+    return _replica_sessions[next(_next_replica) % len(_replica_sessions)]()
+
+def pool_status(engine) -> Dict[str, Any]:
+    """Connections of an engine's pool, for the stats endpoint"""
+    pool = engine.pool
+    status = {"url": engine.url.render_as_string(hide_password=True), "pool": type(pool).__name__}
+    if hasattr(pool, "checkedout"):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return status
 
 # Base class for database models
 Base = declarative_base()
@@ -30,6 +106,29 @@ class LearningJourney(Base):
     objectives = Column(String, default="")
     prompt = Column(String, default="")
 
+class RegistryVersion(Base):
+    __tablename__ = "registry_versions"
+    
+    name = Column(String, primary_key=True)
+    version = Column(Integer, default=0)
+
+class TopicIndexRecord(Base):
+    """Chunked and embedded topic prompt, shared by the workers so each topic is embedded once"""
+    __tablename__ = "topic_indexes"
+    
+    theme = Column(String, primary_key=True)
+    embedder = Column(String)
+    content_hash = Column(String)
+    chunks = Column(String)  # JSON list of chunk texts
+    dim = Column(Integer)
+    matrix = Column(LargeBinary)  # float16, one row per chunk
+
+class StatCounter(Base):
+    __tablename__ = "stat_counters"
+    
+    name = Column(String, primary_key=True)
+    value = Column(Integer, default=0)
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     
@@ -41,6 +140,37 @@ class ChatMessage(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     response_time_ms = Column(Integer)
 
+    # Serves the per-conversation history query and its keyset pagination
+    __table_args__ = (
+        Index("ix_chat_messages_user_theme_ts", "user_id", "theme", "timestamp", "id"),
+    )
+
+class ArchivedConversation(Base):
+    """Turns of an idle conversation, moved out of chat_messages as one compressed blob"""
+    __tablename__ = "archived_conversations"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String)
+    theme = Column(String)
+    first_timestamp = Column(DateTime)
+    last_timestamp = Column(DateTime)
+    message_count = Column(Integer)
+    # zlib-compressed JSON rows: [id, ISO timestamp, message, response, response_time_ms]
+    data = Column(LargeBinary)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_archived_conversations_user_theme_ts", "user_id", "theme", "last_timestamp"),
+    )
+
+class ArchivedTurn(NamedTuple):
+    """A chat_messages row read back from the archive"""
+    id: int
+    timestamp: datetime
+    message: str
+    response: str
+    response_time_ms: Optional[int]
+
 class User(Base):
     __tablename__ = "users"
     
@@ -51,130 +181,285 @@ class User(Base):
     message_count = Column(Integer, default=0)
 
 # Create all tables
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # create_all skips indexes on tables that already exist
+        for index in [*ChatMessage.__table__.indexes, *ArchivedConversation.__table__.indexes]:
+            await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+        await create_search_index(conn)
 
-# Dependency to get database session
-def get_db():
-    db = SessionLocal()
+# Keyset pagination cursors for chat history
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    """Encode the position of the oldest returned message"""
+    raw = f"{timestamp.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str):
+    """Decode a history cursor into (timestamp, id); raises ValueError if malformed"""
     try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except Exception:
+        raise ValueError(f"Invalid history cursor: {cursor}")
+
+def unpack_turns(data: bytes) -> List[ArchivedTurn]:
+    """Decode an archive blob into its turns, oldest first"""
+    return [
+        ArchivedTurn(message_id, datetime.fromisoformat(timestamp), message, response, response_time_ms)
+        for message_id, timestamp, message, response, response_time_ms in json.loads(zlib.decompress(data))
+    ]
+
+# Dependency to get database session
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# Running totals kept in stat_counters instead of counting rows on every request
+STAT_COUNTERS = ("total_messages", "total_users")
 
 # Database operations class
 class DatabaseManager:
     def __init__(self):
-        create_tables()
-
-    def register_theme(self, theme_name: str, objectives: str = "", prompt: str = ""):
-        """Register a new theme in the database"""
-        db = SessionLocal()
-        try:
-            # Check if theme already exists
-            existing_theme = db.query(LearningJourney).filter(LearningJourney.theme == theme_name).first()
-            if not existing_theme:
-                new_theme = LearningJourney(theme=theme_name, objectives=objectives, prompt=prompt)
-                db.add(new_theme)
-                db.commit()
-            return existing_theme or new_theme
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
-
-    def get_topics(self):
+        # In-memory copy of stat_counters, updated after every committed write
+        self.counters: Dict[str, int] = {}
+
+    async def initialize(self):
+        """Create the schema; called once at application startup"""
+        await create_tables()
+        counters = await self.load_counters()
+        if any(name not in counters for name in STAT_COUNTERS):
+            # First start on this database: seed the counters from the tables once
+            await self.reconcile_counters()
+
+    async def close(self):
+        """Dispose of pooled connections; called once at application shutdown"""
+        await engine.dispose()
+        for replica in replica_engines:
+            await replica.dispose()
+
+    async def register_theme(self, theme_name: str, objectives: str = "", prompt: str = ""):
+        """Register a new theme, or update the objectives and prompt of an existing one"""
+        async with SessionLocal() as db:
+            try:
+                theme = await db.scalar(
+                    select(LearningJourney).where(LearningJourney.theme == theme_name)
+                )
+                if theme is None:
+                    theme = LearningJourney(theme=theme_name, objectives=objectives, prompt=prompt)
+                    db.add(theme)
+                elif (theme.objectives, theme.prompt) != (objectives, prompt):
+                    theme.objectives = objectives
+                    theme.prompt = prompt
+                else:
+                    return theme
+                # Other workers reload their registries when the version moves
+                await self._bump_version(db, "topics")
+                await db.commit()
+                return theme
+            except Exception as e:
+                await db.rollback()
+                raise e
+
+    async def _bump_version(self, db, name: str):
+        """Increment a registry version counter inside the caller's transaction"""
+        result = await db.execute(
+            update(RegistryVersion).where(RegistryVersion.name == name).values(version=RegistryVersion.version + 1)
+        )
+        if not result.rowcount:
+            db.add(RegistryVersion(name=name, version=1))
+
+    async def get_topics_version(self) -> int:
+        """Get the version counter bumped on every topic change"""
+        async with ReadSession() as db:
+            version = await db.scalar(select(RegistryVersion.version).where(RegistryVersion.name == "topics"))
+            return version or 0
+
+    async def get_topics(self):
         """Get all registered themes from the database"""
-        db = SessionLocal()
-        try:
-            themes = db.query(LearningJourney).all()
-            return [theme.theme for theme in themes]
-        finally:
-            db.close()
-
-    def register_user(self, user_id: str):
+        async with ReadSession() as db:
+            themes = await db.scalars(select(LearningJourney.theme))
+            return list(themes)
+
+    async def get_topic_details(self):
+        """Get theme, objectives and prompt of every registered theme"""
+        async with ReadSession() as db:
+            rows = await db.execute(select(LearningJourney.theme, LearningJourney.objectives, LearningJourney.prompt))
+            return [
+                {"theme": row.theme, "objectives": row.objectives or "", "prompt": row.prompt or ""}
+                for row in rows
+            ]
+
+    async def get_topic_index(self, theme: str):
+        """Get the stored retrieval index of a topic, or None"""
+        async with ReadSession() as db:
+            record = await db.get(TopicIndexRecord, theme)
+            if record is None:
+                return None
+            return {
+                "embedder": record.embedder,
+                "content_hash": record.content_hash,
+                "chunks": json.loads(record.chunks),
+                "dim": record.dim,
+                "matrix": record.matrix,
+            }
+
+    async def save_topic_index(self, theme: str, index: dict):
+        """Store or replace the retrieval index of a topic"""
+        async with SessionLocal() as db:
+            try:
+                await db.merge(TopicIndexRecord(
+                    theme=theme, embedder=index["embedder"], content_hash=index["content_hash"],
+                    chunks=json.dumps(index["chunks"], ensure_ascii=False), dim=index["dim"], matrix=index["matrix"],
+                ))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                raise e
+
+    async def register_user(self, user_id: str):
         """Register a new user in the database"""
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.user_id == user_id).first()
-            if not user:
-                user = User(user_id=user_id, message_count=0)
-                db.add(user)
-                db.commit()
-            return user
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
+        async with SessionLocal() as db:
+            try:
+                user = await db.scalar(select(User).where(User.user_id == user_id))
+                if not user:
+                    user = User(user_id=user_id, message_count=0)
+                    db.add(user)
+                    await self._increment_counters(db, {"total_users": 1})
+                    await db.commit()
+                    self._apply_counters({"total_users": 1})
+                return user
+            except Exception as e:
+                await db.rollback()
+                raise e
     
     async def save_chat_message(self, msg: dict):
         """Save a chat message to the database"""
-        db = SessionLocal()
-        try:
-            message = ChatMessage(
-                user_id=msg.get("user_id", "anonymous"),
-                theme=msg.get("theme", "default"),
-                message=msg["message"],
-                response=msg.get("response", ""),
-                response_time_ms=msg.get("response_time_ms", 0),
-                timestamp=datetime.utcnow()
-            )
-            print(f"Saving chat message: {message}")
-            db.add(message)
-            
-            # Update or create user
-            user = db.query(User).filter(User.user_id == message.user_id).first()
-            if user:
-                user.last_seen = datetime.utcnow()
-                user.message_count += 1
-            else:
-                user = User(user_id=message.user_id, message_count=1)
-                db.add(user)
-            db.commit()
-            return True
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
-    
-    def get_learning_journey_prompt(self, theme_name: str):
+        return await self.save_chat_messages([msg])
+
+    async def save_chat_messages(self, msgs: list):
+        """Save a batch of chat messages and their user counters in one transaction"""
+        now = datetime.utcnow()
+        rows = [
+            {
+                "user_id": msg.get("user_id", "anonymous"),
+                "theme": msg.get("theme", "default"),
+                "message": msg["message"],
+                "response": msg.get("response", ""),
+                "response_time_ms": msg.get("response_time_ms", 0),
+                "timestamp": msg.get("timestamp", now),
+            }
+            for msg in msgs
+        ]
+        counts = {}
+        last_seen = {}
+        for row in rows:
+            counts[row["user_id"]] = counts.get(row["user_id"], 0) + 1
+            last_seen[row["user_id"]] = max(last_seen.get(row["user_id"], row["timestamp"]), row["timestamp"])
+
+        async with SessionLocal() as db:
+            try:
+                await db.execute(insert(ChatMessage), rows)
+                
+                # Update or create users
+                users = await db.scalars(select(User).where(User.user_id.in_(counts)))
+                existing = {user.user_id: user for user in users}
+                for user_id, count in counts.items():
+                    user = existing.get(user_id)
+                    if user:
+                        user.last_seen = last_seen[user_id]
+                        user.message_count += count
+                    else:
+                        db.add(User(user_id=user_id, message_count=count, last_seen=last_seen[user_id]))
+                deltas = {"total_messages": len(rows), "total_users": len(counts) - len(existing)}
+                await self._increment_counters(db, deltas)
+                await db.commit()
+                self._apply_counters(deltas)
+                return True
+            except Exception as e:
+                await db.rollback()
+                raise e
+    
+    async def get_learning_journey_prompt(self, theme_name: str):
         """Get the prompt for a specific learning journey theme"""
-        db = SessionLocal()
-        try:
-            theme = db.query(LearningJourney).filter(LearningJourney.theme == theme_name).first()
-            if not theme:
-                return ""
-            return theme.prompt
-        finally:
-            db.close()
-
-    def get_chat_history(self, user_id: str, theme: str, limit: int = 50):
+        async with ReadSession() as db:
+            prompt = await db.scalar(
+                select(LearningJourney.prompt).where(LearningJourney.theme == theme_name)
+            )
+            return prompt or ""
+
+    async def get_chat_history(self, user_id: str, theme: str, limit: int = 50, theme_prompt: str = None):
         """Get chat history from database"""
-        db = SessionLocal()
-        try:
-            query = db.query(ChatMessage)
-            query = query.filter(ChatMessage.user_id == user_id, ChatMessage.theme == theme)
-
-            if not query.count():
-                print(f"No chat history found for user {user_id} with theme {theme}. Returning learning journey prompt.")
-                return [SimpleChatMessage(content=self.get_learning_journey_prompt(theme), sender="system", timestamp=datetime.utcnow().timestamp())]
-            
-            messages = query.order_by(ChatMessage.timestamp.desc()).limit(limit).all()
-            return self._format_chat_history(messages, theme)
-        finally:
-            db.close()
+        history, _ = await self.get_chat_history_page(user_id, theme, limit=limit, theme_prompt=theme_prompt)
+        return history
+
+    async def get_chat_history_page(self, user_id: str, theme: str, limit: int = 50, cursor: str = None, theme_prompt: str = None):
+        """
+        Get one page of chat history, newest turns first, in a single query.
+        
+        The theme prompt is prepended as the system message on the first page.
+        Callers holding it in memory pass it as theme_prompt; otherwise it is
+        fetched by the same statement. Pass the returned cursor to get the
+        next (older) page; it is None when there are no older turns. Turns
+        of archived conversations are read from the archive once the hot
+        table has no older ones, so callers never see the tiers. Whether the
+        conversation has archived turns at all comes back with the page, so
+        conversations that were never archived cost one statement.
+        """
+        page = select(
+            ChatMessage.id, ChatMessage.message, ChatMessage.response, ChatMessage.timestamp
+        ).where(ChatMessage.user_id == user_id, ChatMessage.theme == theme)
+        if cursor:
+            before_ts, before_id = decode_cursor(cursor)
+            page = page.where(or_(
+                ChatMessage.timestamp < before_ts,
+                and_(ChatMessage.timestamp == before_ts, ChatMessage.id < before_id)
+            ))
+        # One extra row tells us whether an older page exists
+        page = page.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit + 1).subquery()
+        
+        # Served by the archive's (user_id, theme, last_timestamp) index
+        flags = [select(ArchivedConversation.id).where(
+            ArchivedConversation.user_id == user_id, ArchivedConversation.theme == theme
+        ).exists().label("archived")]
+        if theme_prompt is None:
+            flags.append(select(LearningJourney.prompt).where(LearningJourney.theme == theme).scalar_subquery().label("prompt"))
+        flags_row = select(*flags).subquery()
+        # Left join onto the one-row select so the flags and prompt come back even without turns
+        query = (
+            select(flags_row, page)
+            .select_from(flags_row.outerjoin(page, true()))
+            .order_by(page.c.timestamp.desc(), page.c.id.desc())
+        )
+        async with ReadSession() as db:
+            rows = (await db.execute(query)).all()
+            messages = [row for row in rows if row.id is not None]
+            if len(messages) <= limit and rows[0].archived:
+                # The hot table ran out and older turns were archived
+                before = (messages[-1].timestamp, messages[-1].id) if messages else (decode_cursor(cursor) if cursor else None)
+                messages += await self._archived_turns(db, user_id, theme, before, limit + 1 - len(messages))
+        
+        if theme_prompt is None:
+            theme_prompt = (rows[0].prompt if rows else None) or ""
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = encode_cursor(messages[-1].timestamp, messages[-1].id)
+        
+        if not messages and not cursor:
+            print(f"No chat history found for user {user_id} with theme {theme}. Returning learning journey prompt.")
+            return [SimpleChatMessage(content=theme_prompt, sender="system", timestamp=datetime.utcnow().timestamp())], None
+        return self._format_chat_history(messages, theme_prompt if not cursor else None), next_cursor
     
-    def _format_chat_history(self, messages, theme: str):
-        """Format chat messages into a list of dictionaries"""
+    def _format_chat_history(self, messages, theme_prompt: str = None):
+        """Format chat messages, newest first, into chronological SimpleChatMessages"""
         formatted = []
-        formatted.append(SimpleChatMessage(
-            content=self.get_learning_journey_prompt(theme), 
-            sender="system", 
-            timestamp=""
-        ))
+        if theme_prompt is not None:
+            formatted.append(SimpleChatMessage(
+                content=theme_prompt, 
+                sender="system", 
+                timestamp=""
+            ))
         for msg in reversed(messages):
             formatted.append(SimpleChatMessage(
                 content=msg.message, 
@@ -188,11 +473,103 @@ class DatabaseManager:
             ))
         return formatted
 
-    def get_user_stats(self, user_id: str):
+    async def search_chat_messages(self, query: str, theme: str = None, user_id: str = None,
+                                   limit: int = 20, offset: int = 0):
+        """
+        Find chat turns mentioning every word of query, best matches first.
+        
+        Only turns still in chat_messages are indexed; archived conversations
+        are not searched.
+        
+        Returns:
+            (results, next_offset), next_offset being None on the last page
+        """
+        async with ReadSession() as db:
+            # One extra row tells us whether another page exists
+            results = await search_messages(db, query, theme=theme, user_id=user_id, limit=limit + 1, offset=offset)
+        next_offset = offset + limit if len(results) > limit else None
+        return results[:limit], next_offset
+    
+    async def _archived_turns(self, db, user_id: str, theme: str, before: Optional[Tuple[datetime, int]], count: int) -> List[ArchivedTurn]:
+        """Up to count archived turns older than before=(timestamp, id), newest first"""
+        query = select(ArchivedConversation.data).where(
+            ArchivedConversation.user_id == user_id, ArchivedConversation.theme == theme
+        ).order_by(ArchivedConversation.last_timestamp.desc())
+        if before is not None:
+            query = query.where(ArchivedConversation.first_timestamp <= before[0])
+        turns = []
+        for data in await db.scalars(query):
+            for turn in reversed(unpack_turns(data)):
+                if before is None or (turn.timestamp, turn.id) < before:
+                    turns.append(turn)
+                    if len(turns) >= count:
+                        return turns
+        return turns
+    
+    async def archive_idle_conversations(self, idle_before: datetime, limit: int = 100) -> Dict[str, int]:
+        """
+        Move conversations without turns since idle_before into the archive.
+        
+        Args:
+            idle_before: Conversations whose newest turn is older than this are archived
+            limit: Conversations handled per call, to keep each pass short
+        
+        Returns:
+            Conversations and messages archived, with their raw and compressed sizes
+        """
+        async with SessionLocal() as db:
+            idle = await db.execute(
+                select(ChatMessage.user_id, ChatMessage.theme)
+                .group_by(ChatMessage.user_id, ChatMessage.theme)
+                .having(func.max(ChatMessage.timestamp) < idle_before)
+                .limit(limit)
+            )
+            keys = idle.all()
+        
+        totals = {"conversations": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+        for user_id, theme in keys:
+            archived = await self._archive_conversation(user_id, theme, idle_before)
+            if archived is not None:
+                totals["conversations"] += 1
+                for key, value in archived.items():
+                    totals[key] += value
+        return totals
+    
+    async def _archive_conversation(self, user_id: str, theme: str, idle_before: datetime) -> Optional[Dict[str, int]]:
+        """Move one conversation's turns into an archive blob, unless it became active again"""
+        async with SessionLocal() as db:
+            try:
+                # Locks the rows where supported, so two workers cannot archive the same turns
+                rows = (await db.execute(
+                    select(ChatMessage.id, ChatMessage.timestamp, ChatMessage.message,
+                           ChatMessage.response, ChatMessage.response_time_ms)
+                    .where(ChatMessage.user_id == user_id, ChatMessage.theme == theme)
+                    .order_by(ChatMessage.timestamp, ChatMessage.id)
+                    .with_for_update()
+                )).all()
+                if not rows or max(row.timestamp for row in rows) >= idle_before:
+                    await db.rollback()
+                    return None
+                raw = json.dumps(
+                    [[row.id, row.timestamp.isoformat(), row.message, row.response, row.response_time_ms] for row in rows],
+                    ensure_ascii=False, separators=(",", ":")
+                ).encode("utf-8")
+                data = zlib.compress(raw, 6)
+                db.add(ArchivedConversation(
+                    user_id=user_id, theme=theme, message_count=len(rows), data=data,
+                    first_timestamp=rows[0].timestamp, last_timestamp=rows[-1].timestamp,
+                ))
+                await db.execute(delete(ChatMessage).where(ChatMessage.id.in_([row.id for row in rows])))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                raise e
+        return {"messages": len(rows), "raw_bytes": len(raw), "stored_bytes": len(data)}
+
+    async def get_user_stats(self, user_id: str):
         """Get statistics for a specific user"""
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.user_id == user_id).first()
+        async with ReadSession() as db:
+            user = await db.scalar(select(User).where(User.user_id == user_id))
             if not user:
                 return None
             
@@ -202,29 +579,86 @@ class DatabaseManager:
                 "last_seen": user.last_seen,
                 "message_count": user.message_count
             }
-        finally:
-            db.close()
-    
-    def get_overall_stats(self):
-        """Get overall chat statistics"""
-        db = SessionLocal()
-        try:
-            total_messages = db.query(ChatMessage).count()
-            total_users = db.query(User).count()
-            
-            return {
-                "total_messages": total_messages,
-                "total_users": total_users
-            }
-        finally:
-            db.close()
     
-    def clear_all_data(self):
+    async def get_overall_stats(self):
+        """Get overall chat statistics from the running counters, without scanning any table"""
+        if not self.counters:
+            await self.load_counters()
+        return {name: self.counters.get(name, 0) for name in STAT_COUNTERS}
+    
+    async def _increment_counters(self, db, deltas: Dict[str, int]):
+        """Add to the persisted counters inside the caller's transaction"""
+        for name, delta in deltas.items():
+            if not delta:
+                continue
+            result = await db.execute(
+                update(StatCounter).where(StatCounter.name == name).values(value=StatCounter.value + delta)
+            )
+            if not result.rowcount:
+                db.add(StatCounter(name=name, value=delta))
+    
+    def _apply_counters(self, deltas: Dict[str, int]):
+        """Mirror a committed increment in memory"""
+        for name, delta in deltas.items():
+            if name in self.counters:
+                self.counters[name] += delta
+    
+    async def load_counters(self) -> Dict[str, int]:
+        """Replace the in-memory counters with the persisted ones, which include other workers' writes"""
+        async with SessionLocal() as db:
+            rows = await db.execute(select(StatCounter.name, StatCounter.value))
+            self.counters = {row.name: row.value or 0 for row in rows}
+            return dict(self.counters)
+    
+    async def reconcile_counters(self) -> Dict[str, int]:
+        """
+        Recount the tables and correct the persisted counters.
+        
+        This is the only place that scans the tables; it repairs drift from
+        writes made outside this class.
+        
+        Returns:
+            Difference between the recount and the previous counter values
+        """
+        async with SessionLocal() as db:
+            try:
+                actual = {
+                    "total_messages": await db.scalar(select(func.count()).select_from(ChatMessage))
+                                      + (await db.scalar(select(func.sum(ArchivedConversation.message_count))) or 0),
+                    "total_users": await db.scalar(select(func.count()).select_from(User)),
+                }
+                stored = dict((await db.execute(select(StatCounter.name, StatCounter.value))).tuples().all())
+                for name, value in actual.items():
+                    if name in stored:
+                        await db.execute(update(StatCounter).where(StatCounter.name == name).values(value=value))
+                    else:
+                        db.add(StatCounter(name=name, value=value))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                raise e
+        self.counters = dict(actual)
+        return {name: value - (stored.get(name) or 0) for name, value in actual.items()}
+    
+    async def ping(self):
+        """Run a trivial query to check that the primary and every replica answer"""
+        for sessions in [SessionLocal, *_replica_sessions]:
+            async with sessions() as db:
+                await db.execute(text("SELECT 1"))
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Pool usage of the primary and the read replicas"""
+        return {
+            "primary": pool_status(engine),
+            "replicas": [pool_status(replica) for replica in replica_engines],
+        }
+    
+    async def clear_all_data(self):
         """Clear all data from database"""
-        db = SessionLocal()
-        try:
-            db.query(ChatMessage).delete()
-            db.query(User).delete()
-            db.commit()
-        finally:
-            db.close()
\ No newline at end of file
+        async with SessionLocal() as db:
+            await db.execute(delete(ChatMessage))
+            await db.execute(delete(ArchivedConversation))
+            await db.execute(delete(User))
+            await db.execute(update(StatCounter).values(value=0))
+            await db.commit()
+        self.counters = {name: 0 for name in STAT_COUNTERS}
@@ -0,0 +1,130 @@
+"""
+Async HTTP client for the Llama inference endpoint.
+"""
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+
+class LlamaApiClient:
+    """Pooled, keep-alive HTTP client with a bound on in-flight generations."""
+
+    def __init__(
+        self,
+        api_url: str,
+        token: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        max_connections: Optional[int] = None,
+    ):
+        """
+        Configure the client. Unset values are read from the environment.
+
+        Args:
+            api_url: Inference endpoint URL
+            token: Bearer token for the endpoint
+            connect_timeout: Seconds allowed to open a connection (LLM_CONNECT_TIMEOUT)
+            read_timeout: Seconds allowed for a generation to return (LLM_READ_TIMEOUT)
+            max_concurrency: Maximum generations in flight at once (LLM_MAX_CONCURRENCY)
+            max_connections: Size of the keep-alive connection pool (LLM_MAX_CONNECTIONS)
+        """
+        self.api_url = api_url
+        self.token = token
+        self.connect_timeout = connect_timeout or float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = read_timeout or float(os.getenv("LLM_READ_TIMEOUT", "80"))
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+        self.max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._in_flight = 0
+
+    async def start(self) -> None:
+        """Open the shared connection pool."""
+        if self._client is not None:
+            return
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        self._client = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        )
+
+    async def close(self) -> None:
+        """Close the connection pool."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def post(self, payload: Dict[str, Any]) -> Any:
+        """
+        Send a generation request and return the decoded JSON body.
+
+        Args:
+            payload: Request body for the inference endpoint
+
+        Returns:
+            Parsed JSON response
+
+        Raises:
+            httpx.HTTPError: If the request fails or times out
+        """
+        await self.start()
+        async with self._semaphore:
+            self._in_flight += 1
+            try:
+                response = await self._client.post(self.api_url, json=payload)
+                response.raise_for_status()
+                return response.json()
+            finally:
+                self._in_flight -= 1
+
+    async def stream(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Send a streaming generation request and yield tokens as they arrive.
+
+        The endpoint answers with server-sent events carrying one token each
+        (text-generation-inference format). Special tokens are skipped.
+
+        Args:
+            payload: Request body for the inference endpoint
+
+        Yields:
+            Generated token text
+
+        Raises:
+            httpx.HTTPError: If the request fails or times out
+        """
+        await self.start()
+        async with self._semaphore:
+            self._in_flight += 1
+            try:
+                async with self._client.stream("POST", self.api_url, json={**payload, "stream": True}) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        event = json.loads(line[len("data:"):])
+                        token = event.get("token") or {}
+                        if token.get("special"):
+                            continue
+                        if token.get("text"):
+                            yield token["text"]
+            finally:
+                self._in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Report pool configuration and current load."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "max_connections": self.max_connections,
+        }
@@ -0,0 +1,232 @@
+"""
+Per-stage pipeline metrics published in the Prometheus text format on /metrics.
+"""
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .contextWindow import token_counter
+
+# Seconds; covers in-memory lookups up to full remote generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200, 500)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """A metric family: one series per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Current value read from a callback when the metrics are rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [] if value is None else [f"{self.name} {_format_value(value)}"]
+
+
+class _HistogramSeries:
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets))
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series.counts[index] += 1
+        series.sum += value
+        series.count += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the with-block in seconds, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series.count if series else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series.count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metric families rendered together; registering a name again replaces it."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], Optional[float]]) -> Gauge:
+        return self.register(Gauge(name, documentation, read))
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Shared by the whole process, like the token counter
+metrics = MetricsRegistry()
+
+REQUEST_SECONDS = metrics.histogram(
+    "chat_request_seconds", "End-to-end time to answer a chat message", ["endpoint"])
+CONVERSATION_LOOKUP_SECONDS = metrics.histogram(
+    "chat_conversation_lookup_seconds", "Time to get a conversation, loads from the database included")
+CONVERSATION_CACHE = metrics.counter(
+    "chat_conversation_cache_total", "Conversation cache lookups by result", ["result"])
+HISTORY_LOAD_SECONDS = metrics.histogram(
+    "chat_history_load_seconds", "Time to load a conversation's history from the database")
+PROMPT_BUILD_SECONDS = metrics.histogram(
+    "chat_prompt_build_seconds", "Time to build the model context and render the prompt", ["step"])
+RESPONSE_CACHE = metrics.counter(
+    "chat_response_cache_total", "Opening-turn response cache lookups by result", ["result"])
+LLM_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "chat_llm_queue_wait_seconds", "Time waiting for a generation slot or batch", ["queue"])
+LLM_GENERATION_SECONDS = metrics.histogram(
+    "chat_llm_generation_seconds", "Time spent in the LLM backend", ["mode"])
+LLM_TOKENS = metrics.counter(
+    "chat_llm_generated_tokens_total", "Tokens generated by the LLM backend")
+LLM_TOKENS_PER_SECOND = metrics.histogram(
+    "chat_llm_tokens_per_second", "Generation speed per response", buckets=TOKEN_RATE_BUCKETS)
+LLM_ERRORS = metrics.counter(
+    "chat_llm_errors_total", "Generations that failed and fell back to a canned response")
+PERSIST_SECONDS = metrics.histogram(
+    "chat_persist_seconds", "Time to write a batch of chat turns to the database")
+PERSISTED_TURNS = metrics.counter(
+    "chat_persisted_turns_total", "Chat turns written to the database")
+PERSIST_FAILURES = metrics.counter(
+    "chat_persist_failures_total", "Failed chat turn writes")
+
+
+def record_generation(seconds: float, text: str, mode: str) -> None:
+    """Record one completed generation's duration, token count and speed."""
+    LLM_GENERATION_SECONDS.observe(seconds, mode=mode)
+    tokens = token_counter.count(text)
+    LLM_TOKENS.inc(tokens)
+    if seconds > 0 and tokens:
+        LLM_TOKENS_PER_SECOND.observe(tokens / seconds)
@@ -0,0 +1,314 @@
+"""
+Resilience layer for LLM backends: adaptive deadlines, circuit breaking, retries and hedging.
+"""
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from .backends import LLMBackend
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend that is currently considered unhealthy."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Client errors other than timeouts and rate limits will fail again; everything else may not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return not (400 <= status < 500) or status in (408, 429)
+    return True
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies with percentile lookups."""
+
+    def __init__(self, window: int = 200):
+        self.samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Return the p-th percentile (0-100), or None without samples."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open breaker counting consecutive failures."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejections = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Whether a call may go to the backend now."""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            # Let exactly one probe through to test recovery
+            self._probe_in_flight = True
+            return True
+        self.rejections += 1
+        return False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class ResilientBackend(LLMBackend):
+    """Wraps a backend with latency-derived deadlines, a circuit breaker,
+    jittered retries and optional hedged requests.
+
+    Deadlines start at the backend's configured maximum and tighten to a
+    multiple of the observed p99 once enough samples exist. The maximum is
+    also the budget of the whole request: retries and hedges share it, and
+    no retry starts with less than min_timeout of it left. A hedge is a
+    duplicate request started when the first one passes the observed p95;
+    whichever finishes first wins.
+
+    Backends that cannot abort a call (cancellable = False, e.g. in-process
+    inference) would only queue another full generation behind the one that
+    timed out, so they are never hedged and a timeout is not retried: the
+    caller gets the timeout while the abandoned call finishes unobserved.
+    """
+
+    def __init__(
+        self,
+        backend: LLMBackend,
+        max_timeout: Optional[float] = None,
+        min_timeout: Optional[float] = None,
+        timeout_multiplier: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        hedge: Optional[bool] = None,
+        failure_threshold: Optional[int] = None,
+        reset_timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            backend: Backend to protect
+            max_timeout: Seconds a whole request may take, retries included, and the initial per-attempt deadline (LLM_READ_TIMEOUT)
+            min_timeout: Lower bound on adaptive deadlines (LLM_MIN_TIMEOUT)
+            timeout_multiplier: Deadline as a multiple of observed p99 (LLM_TIMEOUT_MULTIPLIER)
+            max_retries: Retries after the first attempt (LLM_MAX_RETRIES)
+            hedge: Send a duplicate request past p95 (LLM_HEDGE)
+            failure_threshold: Consecutive failures that open the circuit (LLM_BREAKER_FAILURES)
+            reset_timeout: Seconds before an open circuit lets a probe through (LLM_BREAKER_RESET)
+        """
+        self.backend = backend
+        self.name = backend.name
+        self.max_timeout = max_timeout or float(os.getenv("LLM_READ_TIMEOUT", "80"))
+        self.min_timeout = min_timeout or float(os.getenv("LLM_MIN_TIMEOUT", "5"))
+        self.timeout_multiplier = timeout_multiplier or float(os.getenv("LLM_TIMEOUT_MULTIPLIER", "2"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "2"))
+        self.hedge = hedge if hedge is not None else os.getenv("LLM_HEDGE", "false").lower() == "true"
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(
+            failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_timeout or float(os.getenv("LLM_BREAKER_RESET", "30")),
+        )
+        self.min_samples = 20
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.abandoned = 0
+        self._abandoned: set = set()
+
+    @property
+    def supports_batching(self) -> bool:
+        # The wrapped backend may only find out while starting
+        return self.backend.supports_batching
+
+    @property
+    def cancellable(self) -> bool:
+        return self.backend.cancellable
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    async def warmup(self) -> None:
+        await self.backend.warmup()
+
+    def current_timeout(self) -> float:
+        """Deadline for the next attempt, derived from observed latency."""
+        if len(self.latency.samples) < self.min_samples:
+            return self.max_timeout
+        p99 = self.latency.percentile(99)
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    async def generate(self, prompt: str, max_tokens: int) -> str:
+        return await self._call(lambda: self.backend.generate(prompt, max_tokens), hedgeable=True)
+
+    async def generate_batch(self, prompts: List[str], max_tokens: int) -> List[str]:
+        return await self._call(lambda: self.backend.generate_batch(prompts, max_tokens), hedgeable=False)
+
+    async def stream(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        """Stream with the breaker and deadlines on every token and on the whole response; no retries."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM backend circuit is open")
+        deadline = time.monotonic() + self.max_timeout
+        stream = self.backend.stream(prompt, max_tokens)
+        started = False
+        try:
+            while True:
+                # A stalled stream fails after the adaptive deadline, a slow one at max_timeout
+                timeout = min(self.current_timeout(), deadline - time.monotonic())
+                try:
+                    token = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    self.breaker.record_failure()
+                    raise
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                if not started:
+                    # Time to first token is not comparable with full generations, so it is not recorded
+                    self.breaker.record_success()
+                    started = True
+                yield token
+            if not started:
+                self.breaker.record_success()
+        finally:
+            await stream.aclose()
+
+    async def _call(self, make_call: Callable[[], Awaitable[Any]], hedgeable: bool) -> Any:
+        """Run a call with breaker, per-attempt and overall deadlines, bounded jittered retries and optional hedge."""
+        last_error: Optional[Exception] = None
+        deadline = time.monotonic() + self.max_timeout
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError("LLM backend circuit is open") from last_error
+            if attempt:
+                spare = deadline - time.monotonic() - self.min_timeout
+                if spare < 0:
+                    # Too little of the budget is left for an attempt that could succeed
+                    break
+                self.retries += 1
+                # Full jitter keeps retrying clients from synchronising
+                await asyncio.sleep(random.uniform(0, min(2.0, 0.1 * 2 ** attempt, spare)))
+            timeout = min(self.current_timeout(), deadline - time.monotonic())
+            start = time.monotonic()
+            try:
+                if not self.backend.cancellable:
+                    result = await self._abandon_on_timeout(make_call(), timeout)
+                elif hedgeable and self.hedge and len(self.latency.samples) >= self.min_samples:
+                    result = await self._hedged(make_call, timeout)
+                else:
+                    result = await asyncio.wait_for(make_call(), timeout)
+            except asyncio.TimeoutError as e:
+                self.timeouts += 1
+                self.breaker.record_failure()
+                last_error = e
+                if not self.backend.cancellable:
+                    # The timed-out call still occupies the backend; a retry would queue behind it
+                    break
+                continue
+            except Exception as e:
+                if not is_retryable(e):
+                    # The backend answered, so it is healthy; the request itself is bad
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                last_error = e
+                continue
+            self.breaker.record_success()
+            self.latency.record(time.monotonic() - start)
+            return result
+        raise last_error
+
+    async def _abandon_on_timeout(self, call: Awaitable[Any], timeout: float) -> Any:
+        """Wait up to timeout for a call that cannot be aborted, then leave it to finish on its own."""
+        task = asyncio.ensure_future(call)
+        try:
+            done, _ = await asyncio.wait([task], timeout=timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if not done:
+            self.abandoned += 1
+            # Cancelling only discards the result; the backend keeps itself busy until the work is done
+            task.cancel()
+            self._abandoned.add(task)
+            task.add_done_callback(self._abandoned.discard)
+            raise asyncio.TimeoutError()
+        return task.result()
+
+    async def _hedged(self, make_call: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+        """Start a second identical request if the first exceeds p95; return the first to finish."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        primary = asyncio.ensure_future(make_call())
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=min(self.latency.percentile(95), timeout))
+            if not done:
+                self.hedges += 1
+                tasks.append(asyncio.ensure_future(make_call()))
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    tasks.remove(task)
+                if not tasks:
+                    raise done.pop().exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.backend.get_stats(),
+            "circuit_state": self.breaker.state,
+            "circuit_rejections": self.breaker.rejections,
+            "timeout_seconds": round(self.current_timeout(), 3),
+            "p50_seconds": self.latency.percentile(50),
+            "p95_seconds": self.latency.percentile(95),
+            "p99_seconds": self.latency.percentile(99),
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "abandoned_calls": self.abandoned,
+        }
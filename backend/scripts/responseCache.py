@@ -0,0 +1,239 @@
+"""
+Response cache for opening turns, which are identical for every student of a theme.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from .metrics import RESPONSE_CACHE
+
+
+class _CacheEntry:
+    """Stored response variants for one context."""
+
+    def __init__(self, theme: str):
+        self.theme = theme
+        self.responses: List[str] = []
+        self.created_at = time.time()
+
+
+class ResponseCache:
+    """LRU/TTL cache of generated responses keyed by a normalised hash of the context.
+
+    Up to `variants` different responses are generated per key to keep some
+    diversity; once they exist, requests are served from them at random.
+    Concurrent misses beyond that number wait for a generation already in
+    flight instead of starting another one.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        variants: Optional[int] = None,
+    ):
+        """
+        Args:
+            max_entries: Maximum cached contexts (RESPONSE_CACHE_SIZE)
+            ttl_seconds: Lifetime of a cached context (RESPONSE_CACHE_TTL)
+            variants: Responses generated per context before serving from cache (RESPONSE_CACHE_VARIANTS)
+        """
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self.variants = variants or int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._by_theme: Dict[str, Set[str]] = {}
+        self._in_flight: Dict[str, List[asyncio.Future]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def is_cacheable(context: List[Dict[str, str]]) -> bool:
+        """Only opening turns, the theme prompt (and its retrieved material) plus one user message, are shared between students."""
+        roles = [msg["role"] for msg in context]
+        return roles in (["user"], ["system", "user"], ["system", "system", "user"])
+
+    @staticmethod
+    def make_key(theme: str, context: List[Dict[str, str]]) -> str:
+        """Hash the theme and context, ignoring case and whitespace differences."""
+        normalized = [
+            [msg["role"], " ".join(msg["content"].split()).casefold()]
+            for msg in context
+        ]
+        raw = json.dumps([theme, normalized], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached variant once all variants for the key exist."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created_at > self.ttl_seconds:
+            self._remove(key)
+            return None
+        if len(entry.responses) < self.variants:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        RESPONSE_CACHE.inc(result="hit")
+        return random.choice(entry.responses)
+
+    def needs_variant(self, key: str) -> bool:
+        """True while stored plus in-flight responses are fewer than the variant count."""
+        entry = self._entries.get(key)
+        stored = len(entry.responses) if entry else 0
+        return stored + len(self._in_flight.get(key, [])) < self.variants
+
+    async def wait(self, key: str) -> Optional[str]:
+        """Wait for one of the in-flight generations; None if it failed."""
+        pending = self._in_flight.get(key)
+        if not pending:
+            return None
+        self.coalesced += 1
+        RESPONSE_CACHE.inc(result="coalesced")
+        return await asyncio.shield(random.choice(pending))
+
+    def begin(self, key: str) -> asyncio.Future:
+        """Register a generation in flight for the key."""
+        self.misses += 1
+        RESPONSE_CACHE.inc(result="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight.setdefault(key, []).append(future)
+        return future
+
+    def complete(self, key: str, theme: str, future: asyncio.Future, response: Optional[str]) -> None:
+        """Finish an in-flight generation, storing the response unless it is None."""
+        pending = self._in_flight.get(key, [])
+        if future in pending:
+            pending.remove(future)
+        if not pending:
+            self._in_flight.pop(key, None)
+        if response is not None:
+            self._store(key, theme, response)
+        if not future.done():
+            future.set_result(response)
+
+    async def get_or_generate(
+        self,
+        theme: str,
+        context: List[Dict[str, str]],
+        generate: Callable[[], Awaitable[str]],
+        accept: Callable[[str], bool] = lambda response: True,
+    ) -> str:
+        """
+        Serve a response from cache or generate one.
+
+        Args:
+            theme: Theme the context belongs to, used for invalidation
+            context: Model context of the turn
+            generate: Coroutine factory producing a fresh response
+            accept: Predicate deciding whether a fresh response may be cached
+
+        Returns:
+            Response text
+        """
+        key = self.make_key(theme, context)
+        response = self.get(key)
+        if response is None and not self.needs_variant(key):
+            response = await self.wait(key)
+        if response is not None:
+            return response
+
+        future = self.begin(key)
+        response = None
+        try:
+            response = await generate()
+            return response
+        finally:
+            self.complete(key, theme, future, response if response is not None and accept(response) else None)
+
+    async def stream_or_generate(
+        self,
+        theme: str,
+        context: List[Dict[str, str]],
+        stream: Callable[[], AsyncIterator[str]],
+        accept: Callable[[str], bool] = lambda response: True,
+    ) -> AsyncIterator[str]:
+        """
+        Streaming counterpart of get_or_generate.
+
+        Cached responses are yielded in one piece; fresh ones are streamed and
+        stored once complete.
+        """
+        key = self.make_key(theme, context)
+        response = self.get(key)
+        if response is None and not self.needs_variant(key):
+            response = await self.wait(key)
+        if response is not None:
+            yield response
+            return
+
+        future = self.begin(key)
+        parts = []
+        response = None
+        try:
+            async for token in stream():
+                parts.append(token)
+                yield token
+            response = "".join(parts).strip()
+        finally:
+            self.complete(key, theme, future, response if response is not None and accept(response) else None)
+
+    def invalidate_theme(self, theme: str) -> int:
+        """
+        Drop every cached response of a theme.
+
+        Returns:
+            Number of contexts removed
+        """
+        keys = self._by_theme.pop(theme, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def _store(self, key: str, theme: str, response: str) -> None:
+        """Add a response variant, evicting the least recently used context when full."""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _CacheEntry(theme)
+            self._entries[key] = entry
+            self._by_theme.setdefault(theme, set()).add(key)
+        if len(entry.responses) < self.variants:
+            entry.responses.append(response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            oldest, _ = next(iter(self._entries.items()))
+            self._remove(oldest)
+
+    def _remove(self, key: str) -> None:
+        """Remove one context from the cache and the theme index."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_theme.get(entry.theme)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_theme[entry.theme]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Report cache size and hit counters."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "variants": self.variants,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,175 @@
+"""
+Micro-batching scheduler collecting concurrent generation requests into batched backend calls.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .metrics import LLM_QUEUE_WAIT_SECONDS, record_generation
+
+
+class GenerationRequest:
+    """One prompt waiting to be batched."""
+
+    def __init__(self, prompt: str, max_tokens: int, deadline: float, future: asyncio.Future, enqueued_at: float):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+
+class BatchScheduler:
+    """Groups generation requests arriving within a short window into one batched call.
+
+    The backend is any coroutine function taking a list of prompts and a token
+    limit and returning one generated text per prompt, in order.
+    """
+
+    def __init__(
+        self,
+        generate_batch: Callable[[List[str], int], Awaitable[List[str]]],
+        max_batch_size: Optional[int] = None,
+        batch_window_ms: Optional[float] = None,
+        default_timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            generate_batch: Batched backend call
+            max_batch_size: Prompts per backend call (LLM_BATCH_SIZE)
+            batch_window_ms: How long to wait for more requests after the first (LLM_BATCH_WINDOW_MS)
+            default_timeout: Per-request deadline in seconds, queueing included (LLM_READ_TIMEOUT)
+        """
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size or int(os.getenv("LLM_BATCH_SIZE", "8"))
+        self.batch_window = (batch_window_ms or float(os.getenv("LLM_BATCH_WINDOW_MS", "20"))) / 1000
+        self.default_timeout = default_timeout or float(os.getenv("LLM_READ_TIMEOUT", "80"))
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._dispatches: set = set()
+        self.batches = 0
+        self.batched_requests = 0
+        self.expired = 0
+
+    async def start(self) -> None:
+        """Start collecting requests."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop collecting, cancel the batches in flight and fail whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._dispatches):
+            task.cancel()
+        await asyncio.gather(*self._dispatches, return_exceptions=True)
+        while self._queue is not None and not self._queue.empty():
+            request = self._queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Scheduler stopped"))
+
+    async def submit(self, prompt: str, max_tokens: int, timeout: Optional[float] = None) -> str:
+        """
+        Queue a prompt and wait for its generated text.
+
+        Args:
+            prompt: Formatted prompt
+            max_tokens: Maximum tokens to generate
+            timeout: Seconds until the request's deadline; defaults to default_timeout
+
+        Returns:
+            Generated text for the prompt
+
+        Raises:
+            asyncio.TimeoutError: If the deadline passes first
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        timeout = timeout or self.default_timeout
+        now = loop.time()
+        request = GenerationRequest(prompt, max_tokens, now + timeout, loop.create_future(), now)
+        self._queue.put_nowait(request)
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Tell the dispatcher nobody is waiting for this one any more
+            request.future.cancel()
+            raise
+
+    async def _run(self) -> None:
+        """Collect a batch per window and hand it to a dispatch task."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            window_end = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = window_end - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            now = loop.time()
+            live = []
+            for request in batch:
+                if request.future.done():
+                    continue
+                if request.deadline <= now:
+                    self.expired += 1
+                    request.future.set_exception(asyncio.TimeoutError())
+                    continue
+                live.append(request)
+            if live:
+                # Dispatch concurrently so the next window starts collecting right away
+                task = asyncio.create_task(self._dispatch(live))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[GenerationRequest]) -> None:
+        """Run one batched backend call and fan the results out."""
+        self.batches += 1
+        self.batched_requests += len(batch)
+        max_tokens = max(request.max_tokens for request in batch)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for request in batch:
+            LLM_QUEUE_WAIT_SECONDS.observe(start - request.enqueued_at, queue="batch")
+        try:
+            results = await self.generate_batch([request.prompt for request in batch], max_tokens)
+            if len(results) != len(batch):
+                raise Exception(f"Backend returned {len(results)} results for {len(batch)} prompts")
+        except asyncio.CancelledError:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(RuntimeError("Scheduler stopped"))
+            raise
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        elapsed = loop.time() - start
+        for request, result in zip(batch, results):
+            record_generation(elapsed, result, "batch")
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def get_stats(self) -> Dict[str, float]:
+        """Report batch counts and the mean batch size."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "batch_window_ms": self.batch_window * 1000,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "batched_requests": self.batched_requests,
+            "mean_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+            "expired": self.expired,
+        }
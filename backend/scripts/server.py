@@ -1,13 +1,26 @@
 """
 Server module handling chat operations, history management, and statistics.
 """
+import asyncio
+import re
 import time
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator
 from scripts.chatbot import ChatBot
 from utils.messages import UserRegistration, TopicMessage, ChatMessage, ChatResponse
-from .database import DatabaseManager
+from .database import DatabaseManager, decode_cursor
 from .chatManager import ChatMemoryManager
+from .writeBehind import WriteBehindQueue
+from .topicRegistry import TopicRegistry
+from .topicRetrieval import TopicRetriever
+from .statsCounters import StatsCounters
+from .conversationArchiver import ConversationArchiver
+from .responseCache import ResponseCache
+from .admission import AdmissionController, AdmissionTicket
+from .metrics import metrics, PROMPT_BUILD_SECONDS, REQUEST_SECONDS
+
+# Appended to streamed responses cut short by an error or a client disconnect
+TRUNCATED_MARKER = " […]"
 
 class ChatServer:
     """Manages chat sessions, history, and server operations."""
@@ -15,18 +28,67 @@ class ChatServer:
     def __init__(self, use_database: bool = True):
         """Initialize the chat server with empty history."""
         self.use_database = use_database
-        self.topics = []
         self.hf_token = os.getenv("HUGGINGFACE_TOKEN")
         self.chatBot = ChatBot()
+        self.response_cache = ResponseCache()
+        self.admission = AdmissionController()
+        # Saves of streamed turns that outlive their request
+        self._pending_saves = set()
 
         if self.use_database:
             self.db_manager = DatabaseManager()
-            self.memory_manager = ChatMemoryManager(self.db_manager)
-            print("✅ Database initialized successfully")
+            self.writer = WriteBehindQueue(self.db_manager)
+            self.topic_registry = TopicRegistry(self.db_manager, retriever=TopicRetriever(self.db_manager))
+            self.stats_counters = StatsCounters(self.db_manager)
+            self.archiver = ConversationArchiver(self.db_manager)
+            self.memory_manager = ChatMemoryManager(self.db_manager, writer=self.writer, topics=self.topic_registry)
         else:
             print("⚠️ Using in-memory storage (data will be lost on restart)")
+        self._register_gauges()
+
+    def _register_gauges(self) -> None:
+        """Publish current queue depths and cache sizes alongside the stage metrics."""
+        metrics.gauge("chat_admission_active", "Generations currently running", lambda: self.admission.active)
+        metrics.gauge("chat_admission_queued", "Requests waiting for a generation slot", lambda: self.admission.queued)
+        metrics.gauge("chat_response_cache_entries", "Cached opening-turn contexts", lambda: len(self.response_cache))
+        if self.use_database:
+            metrics.gauge("chat_write_behind_pending", "Chat turns waiting to be written", lambda: len(self.writer))
+            metrics.gauge("chat_conversations_cached", "Conversations held in memory",
+                          lambda: len(self.memory_manager.store))
 
-    def register_user(self, user_id: str) -> None:
+    async def startup(self) -> None:
+        """
+        Prepare long-lived resources once per process.
+        
+        Schema creation happens here instead of on every request.
+        """
+        if self.use_database:
+            await self.db_manager.initialize()
+            await self.topic_registry.start()
+            await self.writer.start()
+            await self.memory_manager.start()
+            await self.stats_counters.start()
+            await self.archiver.start()
+            print("✅ Database initialized successfully")
+        await self.chatBot.start()
+
+    async def shutdown(self) -> None:
+        """
+        Release resources held by the server.
+        """
+        await self.chatBot.close()
+        if self._pending_saves:
+            await asyncio.gather(*self._pending_saves, return_exceptions=True)
+        if self.use_database:
+            await self.writer.stop()
+            await self.stats_counters.stop()
+            await self.archiver.stop()
+            await self.memory_manager.stop()
+            await self.topic_registry.stop()
+            await self.db_manager.close()
+            print("👋 Chat server shut down")
+
+    async def register_user(self, user_id: str) -> None:
         """
         Register a new user in the chat system.
         
@@ -38,32 +100,44 @@ class ChatServer:
         
         if self.use_database:
             try:
-                self.db_manager.register_user(user_id=user_id)
+                await self.db_manager.register_user(user_id=user_id)
                 print(f"User '{user_id}' registered successfully in the database")
             except Exception as e:
                 print(f"❌ Database registration failed: {e}")
                 return
         
-    def create_topic(self, topic: TopicMessage) -> None:
+    async def create_topic(self, topic: TopicMessage) -> None:
         """
         Create a new topic for the chatbot.
         
         Args:
             topic_name: Name of the topic to create
         """
-        self.topics.append(topic)
-        self.db_manager.register_theme(
-            theme_name=topic.name,
+        await self.topic_registry.register(
+            theme=topic.name,
             objectives=topic.instructions,
             prompt=topic.content
         )
-        print(f"Topic '{topic.name}' created (not implemented in this example).")
+        self.response_cache.invalidate_theme(topic.name)
+        print(f"Topic '{topic.name}' created.")
 
-    def get_topics(self) -> TopicMessage:
+    async def admit(self, message: ChatMessage) -> AdmissionTicket:
         """
-        Retrieve all topics available in the chat system.
+        Wait for a generation slot for the message, queued fairly per theme and user.
+        
+        Returns:
+            Ticket to release once the response is complete
+            
+        Raises:
+            AdmissionRejected: If the queues are full or the wait times out
         """
-        return self.db_manager.get_topics()
+        return await self.admission.acquire(message.user_id, message.theme)
+
+    async def get_topics(self) -> List[str]:
+        """
+        Retrieve all topics available in the chat system, served from the topic registry.
+        """
+        return self.topic_registry.get_topics()
 
     async def process_message(self, message: ChatMessage) -> str:
         """
@@ -79,15 +153,21 @@ class ChatServer:
         """
         start_time = time.time()
         
-        # Get conversation context from memory
-        conversation = await self.memory_manager.get_conversation(message.user_id, message.theme)
-        conversation.add_message(message.message, sender="user")
-        context = conversation.get_context()
-        # Generate response (your AI logic here)
-        response = self.chatBot.generate_response(context)
+        conversation, context = await self._build_context(message)
+        # Opening turns are the same for every student of a theme
+        if self.response_cache.is_cacheable(context):
+            response = await self.response_cache.get_or_generate(
+                message.theme, context,
+                lambda: self.chatBot.generate_response(context, conversation.prompt_buffer),
+                accept=lambda text: not self.chatBot.is_fallback_response(text)
+            )
+        else:
+            response = await self.chatBot.generate_response(context, conversation.prompt_buffer)
         
         # Save message 
-        await self.memory_manager.save_and_cache_message(message, response, time.time() - start_time)
+        elapsed = time.time() - start_time
+        REQUEST_SECONDS.observe(elapsed, endpoint="chat")
+        await self.memory_manager.save_and_cache_message(message, response, int(elapsed * 1000))
         
         return response
         
@@ -122,30 +202,134 @@ class ChatServer:
 
         return bot_response
     
-    def _get_recent_history_from_db(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    async def stream_message(self, message: ChatMessage) -> AsyncIterator[str]:
+        """
+        Process a user message and stream the response as it is generated.
+        
+        The response is saved once the stream ends, including when the client
+        disconnects or the model fails part way; such responses end with
+        TRUNCATED_MARKER. Nothing is saved if no text was sent.
+        
+        Args:
+            message: The user's message
+            
+        Yields:
+            Pieces of the response text
+        """
+        start_time = time.time()
+        
+        conversation, context = await self._build_context(message)
+        if self.response_cache.is_cacheable(context):
+            tokens = self.response_cache.stream_or_generate(
+                message.theme, context,
+                lambda: self.chatBot.stream_response(context, conversation.prompt_buffer),
+                accept=lambda text: not self.chatBot.is_fallback_response(text)
+            )
+        else:
+            tokens = self.chatBot.stream_response(context, conversation.prompt_buffer)
+        parts = []
+        finished = False
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield token
+            finished = True
+        finally:
+            elapsed = time.time() - start_time
+            REQUEST_SECONDS.observe(elapsed, endpoint="stream")
+            if parts:
+                response = "".join(parts).strip()
+                if not finished:
+                    response += TRUNCATED_MARKER
+                save = asyncio.ensure_future(
+                    self.memory_manager.save_and_cache_message(message, response, int(elapsed * 1000))
+                )
+                self._pending_saves.add(save)
+                save.add_done_callback(self._pending_saves.discard)
+                # A disconnect cancels this request; the save carries on without it
+                await asyncio.shield(save)
+
+    async def _build_context(self, message: ChatMessage):
+        """
+        Build the model context for a new user message.
+        
+        The message itself is only added to the cached conversation once the
+        turn is saved, so it is appended to a copy of the context here, after
+        the topic material retrieved for it.
+        
+        Returns:
+            The conversation and the context to send to the model
+        """
+        conversation = await self.memory_manager.get_conversation(message.user_id, message.theme)
+        material = None
+        if self.use_database:
+            with PROMPT_BUILD_SECONDS.time(step="retrieval"):
+                material = await self.topic_registry.get_material(message.theme, message.message)
+        with PROMPT_BUILD_SECONDS.time(step="context"):
+            context = conversation.get_context(reserve_tokens=conversation.count_tokens(message.message), material=material)
+        return conversation, context + [{"role": "user", "content": message.message}]
+    
+    async def _get_recent_history_from_db(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Get recent chat history from database for a specific user"""
         try:
-            return self.db_manager.get_chat_history(limit=limit, user_id=user_id)
+            return await self.db_manager.get_chat_history(limit=limit, user_id=user_id)
         except Exception as e:
             print(f"❌ Failed to get history from database: {e}")
             return []
 
-    def get_chat_history(self, user_id: str, theme: str, limit: int = 50) -> Dict[str, Any]:
+    async def search_chat_history(self, query: str, theme: str = None, user_id: str = None,
+                                  limit: int = 20, offset: int = 0) -> Dict[str, Any]:
         """
-        Get recent chat history.
+        Search chat turns by content, best matches first.
         
         Args:
-            limit: Maximum number of messages to return
+            query: Words that must all appear in the student message or the reply
+            theme: Only search this theme
+            user_id: Only search this student's turns
+            limit: Maximum number of results
+            offset: Results to skip; pass the returned next_offset for the next page
             
         Returns:
-            Dictionary containing history and total message count
+            Dictionary containing the results and the offset of the next page
+            
+        Raises:
+            ValueError: If the query has no words to search for
+        """
+        if not re.search(r"\w", query or ""):
+            raise ValueError("Search query must contain at least one word")
+        if not self.use_database:
+            return {"results": [], "next_offset": None, "source": "memory"}
+        results, next_offset = await self.db_manager.search_chat_messages(
+            query, theme=theme, user_id=user_id, limit=limit, offset=offset
+        )
+        return {"results": results, "next_offset": next_offset, "source": "database"}
+
+    async def get_chat_history(self, user_id: str, theme: str, limit: int = 50, cursor: str = None) -> Dict[str, Any]:
+        """
+        Get one page of chat history, newest turns first.
+        
+        Args:
+            limit: Maximum number of turns to return
+            cursor: Cursor returned with the previous page, or None for the newest turns
+            
+        Returns:
+            Dictionary containing history, its message count and the cursor of the next page
+            
+        Raises:
+            ValueError: If the cursor is malformed
         """
+        if cursor:
+            decode_cursor(cursor)
         if self.use_database:
             try:
-                history = self.db_manager.get_chat_history(user_id=user_id, theme=theme, limit=limit)
+                history, next_cursor = await self.db_manager.get_chat_history_page(
+                    user_id=user_id, theme=theme, limit=limit, cursor=cursor,
+                    theme_prompt=self.topic_registry.get_prompt(theme)
+                )
                 return {
                     "history": history,
                     "total_messages": len(history),
+                    "next_cursor": next_cursor,
                     "source": "database"
                 }
             except Exception as e:
@@ -161,7 +345,7 @@ class ChatServer:
             "total_messages": 0
         }
     
-    def clear_chat_history(self, user_id: str = "anonymus") -> Dict[str, str]:
+    async def clear_chat_history(self, user_id: str = "anonymus") -> Dict[str, str]:
         """
         Clear all chat history.
         
@@ -170,7 +354,7 @@ class ChatServer:
         """
         if self.use_database:
             try:
-                self.db_manager.clear_all_data()
+                await self.db_manager.clear_all_data()
                 return {
                     "message": "Database chat history cleared successfully",
                     "source": "database"
@@ -183,7 +367,7 @@ class ChatServer:
         self.chatbotsDict.get(user_id, ChatBot()).clear_chat_history()
         return {"message": "Chat history cleared"}
     
-    def get_chat_stats(self, user_id: str = "anonymus") -> Dict[str, Any]:
+    async def get_chat_stats(self, user_id: str = "anonymus") -> Dict[str, Any]:
         """
         Get comprehensive chat statistics.
         
@@ -192,12 +376,22 @@ class ChatServer:
         """
         if self.use_database:
             try:
-                db_stats = self.db_manager.get_overall_stats()
+                db_stats = await self.db_manager.get_overall_stats()
                 return {
                     "total_messages": db_stats["total_messages"],
                     "total_users": db_stats["total_users"],
                     "llama_api_configured": self.hf_token is not None,
                     "database_enabled": True,
+                    "write_behind": self.writer.get_stats(),
+                    "conversation_cache": self.memory_manager.get_memory_stats(),
+                    "topic_registry": self.topic_registry.get_stats(),
+                    "response_cache": self.response_cache.get_stats(),
+                    "llm_backend": self.chatBot.backend.get_stats() if self.chatBot.backend else None,
+                    "batch_scheduler": self.chatBot.scheduler.get_stats() if self.chatBot.scheduler else None,
+                    "admission": self.admission.get_stats(),
+                    "stats_counters": self.stats_counters.get_stats(),
+                    "database_pools": self.db_manager.get_pool_stats(),
+                    "archive": self.archiver.get_stats(),
                     "source": "database"
                 }
             except Exception as e:
@@ -210,27 +404,32 @@ class ChatServer:
                 }
         return self.chatbotsDict.get(user_id, ChatBot()).get_stats()
     
-    def get_health_status(self) -> Dict[str, str]:
+    async def get_health_status(self, live: bool = False) -> Dict[str, str]:
         """
         Get server health status.
         
+        Args:
+            live: Liveness only; answer from memory without touching the database
+            
         Returns:
             Health status information
         """
         api_status = "configured" if self.hf_token else "not configured"
+        backend = self.chatBot.backend
         database_status = "enabled" if self.use_database else "disabled"
         
         status_info = {
             "message": "Chat backend with Llama is running!", 
             "status": "healthy",
             "huggingface_api": api_status,
+            "llm_backend": backend.name if backend else "none",
             "database": database_status
         }
         
-        # Test database connection if enabled
-        if self.use_database:
+        # Test database connection if enabled; a trivial query, not a table scan
+        if self.use_database and not live:
             try:
-                self.db_manager.get_overall_stats()
+                await self.db_manager.ping()
                 status_info["database_connection"] = "healthy"
             except Exception as e:
                 status_info["database_connection"] = f"error: {e}"
@@ -0,0 +1,82 @@
+"""
+Background upkeep of the running stats counters kept by DatabaseManager.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class StatsCounters:
+    """Keeps DatabaseManager's in-memory counters in step with the stat_counters table.
+
+    Each write already increments both copies. A frequent cheap refresh picks
+    up increments made by other workers, and a rare full recount repairs
+    drift from writes that bypassed DatabaseManager.
+    """
+
+    def __init__(
+        self,
+        database,
+        refresh_interval: Optional[float] = None,
+        reconcile_interval: Optional[float] = None,
+    ):
+        """
+        Args:
+            database: DatabaseManager maintaining the counters
+            refresh_interval: Seconds between reloads of the persisted counters (STATS_REFRESH_INTERVAL)
+            reconcile_interval: Seconds between full recounts, 0 to disable (STATS_RECONCILE_INTERVAL)
+        """
+        self.database = database
+        self.refresh_interval = refresh_interval or float(os.getenv("STATS_REFRESH_INTERVAL", "30"))
+        self.reconcile_interval = (reconcile_interval if reconcile_interval is not None
+                                   else float(os.getenv("STATS_RECONCILE_INTERVAL", "3600")))
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.reconciles = 0
+        self.last_drift: Dict[str, int] = {}
+        self._last_reconcile = time.monotonic()
+
+    async def start(self) -> None:
+        """Start the refresh loop; the counters themselves are seeded by DatabaseManager.initialize."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def reconcile(self) -> Dict[str, int]:
+        """Recount the tables now and return the drift that was corrected."""
+        self.last_drift = await self.database.reconcile_counters()
+        self.reconciles += 1
+        self._last_reconcile = time.monotonic()
+        if any(self.last_drift.values()):
+            print(f"⚠️ Stats counters drifted and were corrected: {self.last_drift}")
+        return self.last_drift
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if self.reconcile_interval and time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+                    await self.reconcile()
+                else:
+                    await self.database.load_counters()
+                    self.refreshes += 1
+            except Exception as e:
+                print(f"❌ Stats counter refresh failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "refresh_interval_seconds": self.refresh_interval,
+            "reconcile_interval_seconds": self.reconcile_interval,
+            "refreshes": self.refreshes,
+            "reconciles": self.reconciles,
+            "last_drift": self.last_drift,
+        }
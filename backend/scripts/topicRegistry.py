@@ -0,0 +1,137 @@
+"""
+In-process registry of learning journey topics, served from memory.
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+
+class TopicRegistry:
+    """Caches topic prompts and detects changes made by other workers through a version counter."""
+
+    def __init__(self, database, refresh_interval: Optional[float] = None, retriever=None):
+        """
+        Args:
+            database: DatabaseManager holding the learning_journeys table
+            refresh_interval: Seconds between version checks (TOPIC_REFRESH_INTERVAL)
+            retriever: Optional TopicRetriever indexing long prompts; prompts are sent whole without it
+        """
+        self.database = database
+        self.retriever = retriever
+        self.refresh_interval = refresh_interval or float(os.getenv("TOPIC_REFRESH_INTERVAL", "30"))
+        self._topics: Dict[str, Dict[str, str]] = {}
+        self.version = 0
+        self.reloads = 0
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Load all topics and start watching for changes."""
+        await self.load()
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self) -> None:
+        """Stop watching for changes."""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    async def load(self) -> None:
+        """Replace the registry contents with the current database state."""
+        version = await self.database.get_topics_version()
+        topics = await self.database.get_topic_details()
+        self._topics = {
+            topic["theme"]: {"objectives": topic["objectives"], "prompt": topic["prompt"]}
+            for topic in topics
+        }
+        self.version = version
+        self.reloads += 1
+        if self.retriever is not None:
+            for theme, topic in self._topics.items():
+                await self._index(theme, topic["prompt"])
+
+    async def refresh_if_stale(self) -> bool:
+        """
+        Reload if another worker has changed the topics.
+
+        Returns:
+            True if the registry was reloaded
+        """
+        if await self.database.get_topics_version() == self.version:
+            return False
+        await self.load()
+        return True
+
+    async def register(self, theme: str, objectives: str = "", prompt: str = "") -> None:
+        """
+        Write a topic through to the database and the registry, replacing an existing one.
+
+        Args:
+            theme: Topic name
+            objectives: Learning objectives / instructions
+            prompt: System prompt used for the topic's conversations
+        """
+        await self.database.register_theme(theme_name=theme, objectives=objectives, prompt=prompt)
+        topic = {"objectives": objectives, "prompt": prompt}
+        if self._topics.get(theme) != topic:
+            self._topics[theme] = topic
+            if self.retriever is not None:
+                await self._index(theme, prompt)
+        # Pick up our own bump and anything else written in the meantime
+        await self.refresh_if_stale()
+
+    def get_prompt(self, theme: str) -> str:
+        """Return the system prompt for a theme, or an empty string if unknown."""
+        topic = self._topics.get(theme)
+        return topic["prompt"] if topic else ""
+
+    def get_context_prompt(self, theme: str) -> str:
+        """Return the part of the prompt always sent to the model: the lead of indexed topics, else all of it."""
+        if self.retriever is not None:
+            lead = self.retriever.lead(theme)
+            if lead is not None:
+                return lead
+        return self.get_prompt(theme)
+
+    async def get_material(self, theme: str, question: str) -> List[str]:
+        """Return the chunks of an indexed topic relevant to a student's message."""
+        if self.retriever is None:
+            return []
+        return await self.retriever.retrieve(theme, question)
+
+    async def _index(self, theme: str, prompt: str) -> None:
+        try:
+            await self.retriever.index_topic(theme, prompt)
+        except Exception as e:
+            # Without an index the prompt is simply sent whole
+            print(f"⚠️ Could not index topic '{theme}' for retrieval: {e}")
+
+    def get_topics(self) -> List[str]:
+        """Return the names of all registered topics."""
+        return list(self._topics)
+
+    def __contains__(self, theme: str) -> bool:
+        return theme in self._topics
+
+    async def _refresh_periodically(self) -> None:
+        """Poll the version counter so changes made by other workers show up."""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if await self.refresh_if_stale():
+                    print(f"🔄 Topic registry reloaded at version {self.version}")
+            except Exception as e:
+                print(f"❌ Topic registry refresh failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Report registry size, version, reload count and retrieval stats."""
+        return {
+            "topics": len(self._topics),
+            "version": self.version,
+            "reloads": self.reloads,
+            "retrieval": self.retriever.get_stats() if self.retriever is not None else None,
+        }
@@ -0,0 +1,274 @@
+"""
+Retrieval of the topic material relevant to a student turn, instead of sending the whole topic every time.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .contextWindow import token_counter
+
+
+def chunk_text(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into chunks of whole sentences of at most about max_tokens.
+
+    Paragraph breaks always end a chunk, so a chunk never mixes sections of
+    the lesson. A single sentence longer than max_tokens becomes its own chunk.
+    """
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        current, current_tokens = [], 0
+        for sentence in re.split(r"(?<=[.!?])\s+", " ".join(paragraph.split())):
+            if not sentence:
+                continue
+            tokens = token_counter.count(sentence)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(sentence)
+            current_tokens += tokens
+        if current:
+            chunks.append(" ".join(current))
+    return chunks
+
+
+# Frequent Spanish words of three letters or more that say nothing about the subject
+STOPWORDS = frozenset("""
+    que por para con una uno unos unas los las del como mas pero sus este esta esto estos estas
+    ese esa eso esos esas son hay muy cual cuales donde cuando porque tambien sin sobre entre
+    ser estar tiene tienen puede pueden hace hacer
+""".split())
+
+
+class HashingEmbedder:
+    """Dependency-free embeddings: signed hashed counts of words and word pairs.
+
+    Accents and case are ignored, and words under three letters and common
+    Spanish function words are dropped. Good enough to find the paragraph a
+    question is about, and identical on every worker.
+    """
+
+    # Microseconds per text; a thread hop would cost more than the embedding
+    blocking = False
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def _words(text: str) -> List[str]:
+        text = unicodedata.normalize("NFKD", text.casefold())
+        text = "".join(char for char in text if not unicodedata.combining(char))
+        return [word for word in re.findall(r"\w+", text) if len(word) > 2 and word not in STOPWORDS]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = self._words(text)
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        # Dampen repeated words, then normalize so a dot product is the cosine
+        np.copysign(np.log1p(np.abs(matrix)), matrix, out=matrix)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """A local sentence-transformers model, loaded once and run on the CPU."""
+
+    # Model inference holds the CPU for milliseconds; run it off the event loop
+    blocking = True
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise Exception("sentence-transformers is not installed; pip install sentence-transformers")
+        print(f"⏳ Loading embedding model {model_name}")
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = model_name
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def create_embedder():
+    """A sentence-transformers model if TOPIC_EMBEDDING_MODEL names one, else hashed word features."""
+    model_name = os.getenv("TOPIC_EMBEDDING_MODEL")
+    if model_name:
+        return SentenceTransformerEmbedder(model_name)
+    return HashingEmbedder(int(os.getenv("TOPIC_EMBEDDING_DIM", "1024")))
+
+
+class TopicIndex:
+    """Chunks of one topic and their embeddings as a single matrix, one row per chunk.
+
+    The first chunk, which usually sets up the tutor's role, is the lead and
+    is always sent; only the other chunks are retrieved.
+    """
+
+    def __init__(self, embedder_name: str, content_hash: str, chunks: List[str], matrix: np.ndarray):
+        self.embedder_name = embedder_name
+        self.content_hash = content_hash
+        self.chunks = chunks
+        self.matrix = matrix.astype(np.float32)
+
+    @property
+    def lead(self) -> str:
+        return self.chunks[0]
+
+    def top_k(self, query: np.ndarray, k: int, min_score: float) -> Tuple[int, ...]:
+        """Indices of the k material chunks most similar to query, in lesson order."""
+        scores = self.matrix[1:] @ query
+        k = min(k, len(scores))
+        if k <= 0:
+            return ()
+        best = np.argpartition(-scores, k - 1)[:k]
+        # Keep the lesson's own order so the injected material reads naturally
+        return tuple(int(i) + 1 for i in sorted(best) if scores[i] >= min_score)
+
+    def to_record(self) -> Dict[str, Any]:
+        """Row for the topic_indexes table; float16 halves the stored size at no cost in ranking."""
+        return {
+            "embedder": self.embedder_name,
+            "content_hash": self.content_hash,
+            "chunks": self.chunks,
+            "dim": self.matrix.shape[1],
+            "matrix": self.matrix.astype(np.float16).tobytes(),
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "TopicIndex":
+        matrix = np.frombuffer(record["matrix"], dtype=np.float16).reshape(len(record["chunks"]), record["dim"])
+        return cls(record["embedder"], record["content_hash"], record["chunks"], matrix)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TopicRetriever:
+    """Indexes long topic prompts and picks the chunks relevant to each student turn.
+
+    Topics shorter than min_tokens are left alone and sent whole, as before.
+    Retrievals are cached per theme and normalized question, so the opening
+    turns of a class, which repeat the same prompt, cost one matrix product.
+    """
+
+    def __init__(
+        self,
+        database=None,
+        embedder=None,
+        top_k: Optional[int] = None,
+        chunk_tokens: Optional[int] = None,
+        min_tokens: Optional[int] = None,
+        min_score: Optional[float] = None,
+        cache_size: Optional[int] = None,
+    ):
+        """
+        Args:
+            database: DatabaseManager storing indexes for other workers; None keeps them in memory only
+            embedder: Text embedder; defaults to the one selected by TOPIC_EMBEDDING_MODEL
+            top_k: Material chunks sent per turn (TOPIC_RETRIEVAL_TOP_K)
+            chunk_tokens: Target chunk size (TOPIC_CHUNK_TOKENS)
+            min_tokens: Topics at least this long use retrieval (TOPIC_RETRIEVAL_MIN_TOKENS)
+            min_score: Chunks less similar than this are not sent (TOPIC_RETRIEVAL_MIN_SCORE)
+            cache_size: Cached retrievals (TOPIC_RETRIEVAL_CACHE_SIZE)
+        """
+        self.database = database
+        self.embedder = embedder or create_embedder()
+        self.top_k = top_k or int(os.getenv("TOPIC_RETRIEVAL_TOP_K", "3"))
+        self.chunk_tokens = chunk_tokens or int(os.getenv("TOPIC_CHUNK_TOKENS", "120"))
+        self.min_tokens = min_tokens or int(os.getenv("TOPIC_RETRIEVAL_MIN_TOKENS", "400"))
+        self.min_score = min_score if min_score is not None else float(os.getenv("TOPIC_RETRIEVAL_MIN_SCORE", "0.1"))
+        self.cache_size = cache_size or int(os.getenv("TOPIC_RETRIEVAL_CACHE_SIZE", "2048"))
+        self._indexes: Dict[str, TopicIndex] = {}
+        self._cache: "OrderedDict[Tuple[str, str], List[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.indexed = 0
+
+    async def index_topic(self, theme: str, text: str) -> Optional[TopicIndex]:
+        """
+        Chunk and embed a topic's prompt, reusing a stored index of the same text.
+
+        Returns:
+            The index, or None if the prompt is short enough to send whole
+        """
+        digest = content_hash(text)
+        current = self._indexes.get(theme)
+        if current is not None and current.content_hash == digest:
+            return current
+        self._forget(theme)
+        if token_counter.count(text) < self.min_tokens:
+            return None
+
+        index = None
+        if self.database is not None:
+            record = await self.database.get_topic_index(theme)
+            if record and record["content_hash"] == digest and record["embedder"] == self.embedder.name:
+                index = TopicIndex.from_record(record)
+        if index is None:
+            chunks = chunk_text(text, self.chunk_tokens)
+            matrix = await self._embed(chunks)
+            index = TopicIndex(self.embedder.name, digest, chunks, matrix)
+            self.indexed += 1
+            if self.database is not None:
+                await self.database.save_topic_index(theme, index.to_record())
+        self._indexes[theme] = index
+        return index
+
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, in a thread for embedders that would stall the event loop."""
+        # Embedders without the flag are assumed to be models
+        if getattr(self.embedder, "blocking", True):
+            return await asyncio.to_thread(self.embedder.embed, texts)
+        return self.embedder.embed(texts)
+
+    def _forget(self, theme: str) -> None:
+        if self._indexes.pop(theme, None) is not None:
+            for key in [key for key in self._cache if key[0] == theme]:
+                del self._cache[key]
+
+    def lead(self, theme: str) -> Optional[str]:
+        """The part of an indexed topic always sent as the system prompt, or None if it is sent whole."""
+        index = self._indexes.get(theme)
+        return index.lead if index is not None else None
+
+    async def retrieve(self, theme: str, question: str) -> List[str]:
+        """Material chunks of the theme relevant to a student's message, empty if the theme is not indexed."""
+        index = self._indexes.get(theme)
+        if index is None:
+            return []
+        key = (theme, " ".join(question.split()).casefold())
+        chunks = self._cache.get(key)
+        if chunks is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return chunks
+        self.misses += 1
+        query = (await self._embed([question]))[0]
+        chunks = [index.chunks[i] for i in index.top_k(query, self.top_k, self.min_score)]
+        self._cache[key] = chunks
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return chunks
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "embedder": self.embedder.name,
+            "indexed_topics": len(self._indexes),
+            "chunks": sum(len(index.chunks) for index in self._indexes.values()),
+            "indexes_built": self.indexed,
+            "cache_entries": len(self._cache),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
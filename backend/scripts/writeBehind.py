@@ -0,0 +1,244 @@
+"""
+Write-behind queue batching chat turns into multi-row database transactions.
+"""
+import asyncio
+import glob
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .metrics import PERSIST_FAILURES, PERSIST_SECONDS, PERSISTED_TURNS
+
+
+class WriteBehindQueue:
+    """Buffers finished chat turns and flushes them to the database in batches."""
+
+    def __init__(
+        self,
+        database,
+        max_batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        spill_path: Optional[str] = None,
+        max_pending: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        dead_letter_path: Optional[str] = None,
+    ):
+        """
+        Configure the queue. Unset values are read from the environment.
+
+        Args:
+            database: DatabaseManager providing save_chat_messages
+            max_batch_size: Turns per transaction; reaching it triggers a flush (WRITE_BEHIND_BATCH_SIZE)
+            flush_interval: Seconds between time-based flushes (WRITE_BEHIND_FLUSH_INTERVAL)
+            spill_path: File receiving turns that could not be written at shutdown, suffixed
+                with the process id so workers never share one (WRITE_BEHIND_SPILL_PATH)
+            max_pending: Queued turns beyond which enqueue waits for a flush (WRITE_BEHIND_MAX_PENDING)
+            max_attempts: Consecutive failures of a batch before its turns are written one by one
+                and the failing ones set aside (WRITE_BEHIND_MAX_ATTEMPTS)
+            dead_letter_path: File receiving turns the database keeps rejecting, suffixed with the
+                process id (WRITE_BEHIND_DEAD_LETTER_PATH)
+        """
+        self.database = database
+        self.max_batch_size = max_batch_size or int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+        self.flush_interval = flush_interval or float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))
+        self.spill_path = spill_path or os.getenv("WRITE_BEHIND_SPILL_PATH", "./pending_turns.jsonl")
+        self.max_pending = max_pending or int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+        self.max_attempts = max_attempts or int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+        self.dead_letter_path = dead_letter_path or os.getenv("WRITE_BEHIND_DEAD_LETTER_PATH", "./dead_turns.jsonl")
+        self._pending: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._consecutive_failures = 0
+        self.flushed_turns = 0
+        self.flushed_batches = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        self.backpressure_waits = 0
+
+    async def start(self) -> None:
+        """Recover spilled turns and start the background flusher."""
+        self._pending.extend(self._load_spill())
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher, write out everything pending and spill what cannot be written."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._pending:
+            self._spill()
+            self._room.set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def enqueue(self, message: Dict[str, Any]) -> None:
+        """
+        Accept a finished turn without waiting for the database, unless the queue is full.
+
+        While max_pending turns are queued, callers wait for a flush to make
+        room instead of letting the queue grow for as long as the database is down.
+
+        Args:
+            message: Turn fields as accepted by DatabaseManager.save_chat_messages
+        """
+        message.setdefault("timestamp", datetime.utcnow())
+        if len(self._pending) >= self.max_pending:
+            self.backpressure_waits += 1
+            while len(self._pending) >= self.max_pending:
+                self._room.clear()
+                await self._room.wait()
+        self._pending.append(message)
+        if len(self._pending) >= self.max_batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """
+        Write all pending turns in batches of at most max_batch_size.
+
+        A failed batch is put back at the front of the queue so no turn is lost.
+        Once it has failed max_attempts times in a row while the database still
+        answers, its turns are written one by one and those rejected again are
+        moved to the dead-letter file, so one bad turn cannot hold up the rest.
+
+        Returns:
+            Number of turns written
+        """
+        written = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:len(batch)]
+                try:
+                    with PERSIST_SECONDS.time():
+                        await self.database.save_chat_messages(batch)
+                except Exception as e:
+                    PERSIST_FAILURES.inc(len(batch))
+                    self._consecutive_failures += 1
+                    self.failed_flushes += 1
+                    print(f"❌ Write-behind flush of {len(batch)} turns failed: {e}")
+                    if self._consecutive_failures >= self.max_attempts and await self._database_answers():
+                        written += await self._write_one_by_one(batch)
+                        self._consecutive_failures = 0
+                        continue
+                    self._pending[:0] = batch
+                    break
+                self._consecutive_failures = 0
+                self._written(len(batch))
+                written += len(batch)
+            if len(self._pending) < self.max_pending:
+                self._room.set()
+        return written
+
+    def _written(self, count: int) -> None:
+        self.flushed_batches += 1
+        self.flushed_turns += count
+        PERSISTED_TURNS.inc(count)
+
+    async def _database_answers(self) -> bool:
+        """Whether the database is reachable, telling an outage from turns it rejects."""
+        try:
+            await self.database.ping()
+        except Exception:
+            return False
+        return True
+
+    async def _write_one_by_one(self, batch: List[Dict[str, Any]]) -> int:
+        """Write turns individually, dead-lettering those that still fail."""
+        written = 0
+        for message in batch:
+            try:
+                await self.database.save_chat_messages([message])
+            except Exception as e:
+                PERSIST_FAILURES.inc()
+                self._dead_letter(message, e)
+                continue
+            self._written(1)
+            written += 1
+        return written
+
+    def _dead_letter(self, message: Dict[str, Any], error: Exception) -> None:
+        """Append a turn the database rejects, with the error, to this process's dead-letter file."""
+        path = self._process_path(self.dead_letter_path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**_serializable(message), "error": str(error)}) + "\n")
+        self.dead_lettered += 1
+        print(f"☠️ Turn of {message.get('user_id', 'anonymous')} rejected by the database, moved to {path}: {error}")
+
+    async def _run(self) -> None:
+        """Flush whenever the batch fills up or the interval elapses."""
+        while True:
+            # Back off while the database keeps failing
+            timeout = self.flush_interval * (2 ** min(self._consecutive_failures, 6))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    @staticmethod
+    def _process_path(path: str, unique: str = "") -> str:
+        """path with this process's id (and an optional tag) before the extension."""
+        root, ext = os.path.splitext(path)
+        return f"{root}.{os.getpid()}{unique}{ext}"
+
+    def _spill(self) -> None:
+        """Write unwritten turns to a new spill file of this process."""
+        path = self._process_path(self.spill_path, f"-{time.time_ns()}")
+        # Written aside and renamed, so a worker starting meanwhile never recovers half a file
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for message in self._pending:
+                f.write(json.dumps(_serializable(message)) + "\n")
+        os.replace(path + ".tmp", path)
+        print(f"⚠️ Spilled {len(self._pending)} unsaved turns to {path}")
+        self._pending = []
+
+    def _load_spill(self) -> List[Dict[str, Any]]:
+        """Read and remove turns spilled by previous shutdowns of any worker."""
+        root, ext = os.path.splitext(self.spill_path)
+        messages = []
+        for path in [self.spill_path, *sorted(glob.glob(f"{glob.escape(root)}.*{ext}"))]:
+            # Renaming claims the file; a worker starting at the same time gets FileNotFoundError
+            claimed = f"{path}.{os.getpid()}.recovering"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                recovered = [json.loads(line) for line in f if line.strip()]
+            os.remove(claimed)
+            for message in recovered:
+                message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+            print(f"♻️ Recovered {len(recovered)} spilled turns from {path}")
+            messages.extend(recovered)
+        return messages
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Report queue depth and flush counters."""
+        return {
+            "pending_turns": len(self._pending),
+            "flushed_turns": self.flushed_turns,
+            "flushed_batches": self.flushed_batches,
+            "failed_flushes": self.failed_flushes,
+            "dead_lettered_turns": self.dead_lettered,
+            "backpressure_waits": self.backpressure_waits,
+            "max_pending": self.max_pending,
+            "max_batch_size": self.max_batch_size,
+            "flush_interval_seconds": self.flush_interval,
+        }
+
+
+def _serializable(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {**message, "timestamp": message["timestamp"].isoformat()}
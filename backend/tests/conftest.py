@@ -0,0 +1,95 @@
+"""
+Shared test setup: the backend on sys.path and a throwaway SQLite database.
+
+Tests are plain functions driving coroutines with asyncio.run, so no pytest
+plugin is needed.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# scripts.database creates its engines on import, so the URL has to be set first
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='chat-tests-')}/chat.db"
+os.environ.pop("DATABASE_REPLICA_URLS", None)
+os.environ["LLM_BACKEND"] = "none"
+
+
+@pytest.fixture
+def with_database():
+    """Run scenario(database) against an emptied database in a fresh event loop."""
+    from scripts.database import DatabaseManager
+
+    def run(scenario):
+        async def main():
+            database = DatabaseManager()
+            await database.initialize()
+            await database.clear_all_data()
+            try:
+                return await scenario(database)
+            finally:
+                # Pooled connections belong to this event loop
+                await database.close()
+
+        return asyncio.run(main())
+
+    return run
+
+
+class FakeModel:
+    """Sleeps like a decoder and records how many calls overlap."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.running = 0
+        self.max_running = 0
+        self.calls = 0
+        self._guard = threading.Lock()
+
+    def _enter(self):
+        with self._guard:
+            self.calls += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+    def _leave(self):
+        with self._guard:
+            self.running -= 1
+
+    def create_completion(self, prompt, stream=False, **kwargs):
+        if stream:
+            return self._stream()
+        self._enter()
+        try:
+            time.sleep(self.seconds)
+            return {"choices": [{"text": f"re: {prompt}"}]}
+        finally:
+            self._leave()
+
+    def _stream(self):
+        self._enter()
+        try:
+            for word in ["uno", " dos", " tres"]:
+                time.sleep(self.seconds / 3)
+                yield {"choices": [{"text": word}]}
+        finally:
+            self._leave()
+
+
+@pytest.fixture
+def local_backend():
+    """Build a LlamaCppBackend on a FakeModel taking the given seconds per generation."""
+    from scripts.backends import LlamaCppBackend
+
+    def build(seconds):
+        backend = LlamaCppBackend(model_path="fake.gguf", n_threads=1)
+        backend.model = FakeModel(seconds)
+        return backend
+
+    return build
@@ -0,0 +1,129 @@
+"""
+AdmissionController fairness, rejections and cleanup, and the 429 the endpoints answer with.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from main import app
+from scripts.admission import AdmissionController, AdmissionRejected
+
+
+async def waiting(controller, order, user_id, theme):
+    """Queue a request that records its admission and finishes straight away."""
+    ticket = await controller.acquire(user_id, theme)
+    order.append((theme, user_id))
+    ticket.release()
+
+
+def test_slots_go_round_robin_across_themes_then_users():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue_per_user=2)
+        holder = await controller.acquire("profe", "fisica")
+        order = []
+        arrivals = [("ana", "fisica"), ("ana", "fisica"), ("luis", "fisica"), ("eva", "quimica")]
+        tasks = [asyncio.create_task(waiting(controller, order, user, theme)) for user, theme in arrivals]
+        await asyncio.sleep(0)
+        assert controller.queued == 4
+
+        holder.release()
+        await asyncio.gather(*tasks)
+        # Arrival order would have served both of ana's requests before anyone else
+        assert order == [("fisica", "ana"), ("quimica", "eva"), ("fisica", "luis"), ("fisica", "ana")]
+        assert controller.active == 0 and controller.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_full_user_queue_rejects_only_that_user():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue_per_user=1)
+        holder = await controller.acquire("profe", "fisica")
+        first = asyncio.create_task(controller.acquire("ana", "fisica"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("ana", "fisica")
+        assert rejected.value.reason == "user_queue_full"
+        assert rejected.value.retry_after >= 1
+        other = asyncio.create_task(controller.acquire("luis", "fisica"))
+        await asyncio.sleep(0)
+        assert controller.queued == 2
+
+        holder.release()
+        (await first).release()
+        (await other).release()
+        assert controller.rejected["user_queue_full"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_waiter_times_out_and_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_timeout=0.05)
+        holder = await controller.acquire("profe", "fisica")
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("ana", "fisica")
+        assert rejected.value.reason == "queue_timeout"
+        assert controller.queued == 0 and not controller.get_stats()["queued_by_theme"]
+
+        holder.release()
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_waiter_does_not_keep_a_slot():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1)
+        holder = await controller.acquire("profe", "fisica")
+        waiter = asyncio.create_task(controller.acquire("ana", "fisica"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.queued == 0
+
+        holder.release()
+        assert controller.active == 0
+        (await asyncio.wait_for(controller.acquire("luis", "fisica"), 1)).release()
+
+    asyncio.run(scenario())
+
+
+def test_a_waiter_cancelled_after_being_granted_gives_the_slot_back():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1)
+        holder = await controller.acquire("profe", "fisica")
+        waiter = asyncio.create_task(controller.acquire("ana", "fisica"))
+        await asyncio.sleep(0)
+
+        # The slot is handed over, but the client leaves before the waiter resumes
+        holder.release()
+        assert controller.active == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.active == 0 and controller.queued == 0
+
+    asyncio.run(scenario())
+
+
+class BusyServer:
+    """Chat server whose admission queues are always full."""
+
+    async def admit(self, message):
+        raise AdmissionRejected("queue_full", 7)
+
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream"])
+def test_rejected_requests_get_429_with_retry_after(path):
+    async def scenario():
+        app.state.chat_server = BusyServer()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post(path, json={"message": "Hola", "user_id": "ana", "theme": "fisica"})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+    assert "queue_full" in response.json()["detail"]
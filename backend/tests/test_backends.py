@@ -0,0 +1,42 @@
+"""
+LlamaCppBackend with a stand-in model: one generation on the model at a time, cancelled or not.
+"""
+import asyncio
+
+import pytest
+
+
+def test_generations_take_turns_on_the_model(local_backend):
+    async def scenario():
+        backend = local_backend(0.05)
+        results = await asyncio.gather(*(backend.generate(f"p{i}", 5) for i in range(3)))
+        assert results == ["re: p0", "re: p1", "re: p2"]
+        assert backend.model.max_running == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_generation_keeps_the_model_until_its_thread_is_done(local_backend):
+    async def scenario():
+        backend = local_backend(0.3)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(backend.generate("slow", 5), 0.05)
+        assert await backend.generate("next", 5) == "re: next"
+        assert backend.model.max_running == 1
+        assert backend.model.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_streams_and_generations_do_not_overlap(local_backend):
+    async def scenario():
+        backend = local_backend(0.06)
+
+        async def read_stream():
+            return "".join([token async for token in backend.stream("p", 5)])
+
+        streamed, generated = await asyncio.gather(read_stream(), backend.generate("q", 5))
+        assert streamed == "uno dos tres" and generated == "re: q"
+        assert backend.model.max_running == 1
+
+    asyncio.run(scenario())
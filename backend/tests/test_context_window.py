@@ -0,0 +1,61 @@
+"""
+Token-budgeted conversation contexts: older turns folded into the rolling summary, newest kept verbatim.
+"""
+from scripts.chatManager import Conversation
+from scripts.contextWindow import RollingSummary, token_counter
+from utils.messages import SimpleChatMessage
+
+
+def history(turns):
+    messages = [SimpleChatMessage("Eres un tutor de biología.", "system", 0.0)]
+    for i in range(turns):
+        messages.append(SimpleChatMessage(f"Pregunta {i} sobre las células. Con algo más de detalle.", "user", float(i)))
+        messages.append(SimpleChatMessage(f"Respuesta {i}: la célula es la unidad de la vida. Y sigue.", "bot", float(i)))
+    return messages
+
+
+def context_tokens(context):
+    return sum(token_counter.count(entry["content"]) for entry in context)
+
+
+def test_history_over_the_budget_is_summarised():
+    messages = history(8)
+    conversation = Conversation("ana", messages, max_tokens=200)
+    context = conversation.get_context()
+
+    assert context[0] == {"role": "system", "content": "Eres un tutor de biología."}
+    assert context[1]["role"] == "system"
+    assert context[1]["content"].startswith("Summary of the earlier conversation:\n")
+    # The summary ends with the first sentence of the last message folded away
+    last_folded = messages[-len(context[2:]) - 1]
+    assert last_folded.content.startswith("Respuesta")
+    assert context[1]["content"].endswith("\nTutor: " + last_folded.content.split(". ")[0] + ".")
+    assert context_tokens(context) <= 200
+
+
+def test_the_newest_turns_are_kept_verbatim():
+    messages = history(8)
+    conversation = Conversation("ana", messages, max_tokens=200)
+    context = conversation.get_context()
+
+    turns = context[2:]
+    assert 0 < len(turns) < 16
+    expected = [("assistant" if m.sender == "bot" else "user", m.content) for m in messages[-len(turns):]]
+    assert [(entry["role"], entry["content"]) for entry in turns] == expected
+
+
+def test_history_within_the_budget_is_sent_whole():
+    conversation = Conversation("ana", history(2), max_tokens=2048)
+    context = conversation.get_context()
+
+    assert len(context) == 5
+    assert not conversation.summary
+
+
+def test_the_summary_drops_its_oldest_lines_past_its_budget():
+    summary = RollingSummary(max_tokens=20)
+    summary.fold([SimpleChatMessage(f"Mensaje número {i}. Otra frase.", "user", 0.0) for i in range(10)])
+
+    assert summary.tokens <= 20
+    assert summary.lines[-1] == "Student: Mensaje número 9."
+    assert "Mensaje número 0." not in summary.text
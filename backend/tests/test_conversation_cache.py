@@ -0,0 +1,114 @@
+"""
+ConversationCache LRU and idle expiry, and ChatMemoryManager loading each conversation once for concurrent misses.
+"""
+import asyncio
+import time
+
+from scripts.chatManager import ChatMemoryManager, Conversation
+from scripts.conversationStore import ConversationCache, LocalConversationStore
+from utils.messages import SimpleChatMessage
+
+KEY = ("ana", "fisica")
+
+
+class SlowDatabase:
+    """Serves a theme prompt once released, counting history loads."""
+
+    def __init__(self):
+        self.loads = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def get_chat_history(self, user_id, theme, limit=20, theme_prompt=None):
+        self.loads += 1
+        await self.release.wait()
+        return [SimpleChatMessage(content=f"Eres un tutor de {theme}", sender="system", timestamp=0.0)]
+
+
+def manager_for(database):
+    return ChatMemoryManager(database, store=LocalConversationStore(max_entries=100, ttl_seconds=1800))
+
+
+def test_the_least_recently_used_conversation_is_evicted_at_capacity():
+    cache = ConversationCache(max_size=2, ttl_seconds=1800)
+    cache.put(("ana", "fisica"), Conversation("ana"))
+    cache.put(("beto", "fisica"), Conversation("beto"))
+    # Reading ana makes beto the least recently used
+    assert cache.get(("ana", "fisica")) is not None
+    cache.put(("eva", "fisica"), Conversation("eva"))
+
+    assert ("beto", "fisica") not in cache
+    assert ("ana", "fisica") in cache and ("eva", "fisica") in cache
+    assert len(cache) == 2 and cache.evictions == 1
+
+
+def test_expired_conversations_are_dropped_on_read_and_by_the_sweep():
+    cache = ConversationCache(max_size=10, ttl_seconds=60)
+    stale, live = Conversation("ana"), Conversation("beto")
+    cache.put(("ana", "fisica"), stale)
+    cache.put(("beto", "fisica"), live)
+    cache.put(("eva", "fisica"), Conversation("eva"))
+    stale.last_activity = time.time() - 120
+
+    assert cache.sweep() == 1
+    live.last_activity = time.time() - 120
+    assert cache.get(("beto", "fisica")) is None
+    assert len(cache) == 1 and cache.expirations == 2
+
+
+def test_an_expired_conversation_is_loaded_again():
+    async def scenario():
+        database = SlowDatabase()
+        manager = manager_for(database)
+        first = await manager.get_conversation(*KEY)
+        assert await manager.get_conversation(*KEY) is first
+        assert database.loads == 1
+
+        first.last_activity = time.time() - manager.conversation_timeout - 1
+        second = await manager.get_conversation(*KEY)
+        assert second is not first
+        assert database.loads == 2
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_misses_share_one_database_load():
+    async def scenario():
+        database = SlowDatabase()
+        database.release.clear()
+        manager = manager_for(database)
+        callers = [asyncio.create_task(manager.get_conversation(*KEY)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        database.release.set()
+        conversations = await asyncio.gather(*callers)
+
+        assert database.loads == 1
+        assert all(conversation is conversations[0] for conversation in conversations)
+        assert manager.coalesced_loads == 9
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_the_caller_that_started_the_load_does_not_abort_it():
+    async def scenario():
+        database = SlowDatabase()
+        database.release.clear()
+        manager = manager_for(database)
+        first = asyncio.create_task(manager.get_conversation(*KEY))
+        await asyncio.sleep(0.01)
+        others = [asyncio.create_task(manager.get_conversation(*KEY)) for _ in range(4)]
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        database.release.set()
+        conversations = await asyncio.gather(*others)
+
+        assert first.cancelled()
+        assert database.loads == 1
+        assert all(conversation is conversations[0] for conversation in conversations)
+        # The load finished and was stored, so the next caller hits the store
+        assert await manager.get_conversation(*KEY) is conversations[0]
+        assert database.loads == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,209 @@
+"""
+Shared conversation stores: RedisConversationStore against the in-process Redis stand-in (versions,
+WATCH aborts and save retries) and SharedMemoryConversationStore on a temporary file.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from loadtest.fakeRedis import FakeRedis, serve
+from scripts.chatManager import ChatMemoryManager, Conversation
+from scripts.conversationStore import RedisConversationStore, SharedMemoryConversationStore, VersionConflict
+from utils.messages import ChatMessage, SimpleChatMessage
+
+KEY = ("ana", "fisica")
+
+
+class WriteOnFirstRead(FakeRedis):
+    """Another worker writes the key right after the next GET of it, inside the WATCH window."""
+
+    def __init__(self):
+        super().__init__()
+        self.target = None
+
+    def run(self, args):
+        reply = super().run(args)
+        if self.target is not None and args[0].upper() == b"GET" and args[1] == self.target:
+            self.target = None
+            super().run([b"SET", args[1], reply])
+        return reply
+
+
+class FakeDatabase:
+    async def get_chat_history(self, user_id, theme, limit=20, theme_prompt=None):
+        return [SimpleChatMessage(content="Eres un tutor de física", sender="system", timestamp="")]
+
+
+class FakeWriter:
+    def __init__(self):
+        self.turns = []
+
+    async def enqueue(self, message):
+        self.turns.append(message)
+
+
+def with_redis(scenario, redis=None):
+    """Run scenario(redis, make_store) with a fake Redis server on a free port."""
+    redis = redis or FakeRedis()
+
+    async def main():
+        server = await serve(redis, port=0)
+        port = server.sockets[0].getsockname()[1]
+        stores = []
+
+        def make_store():
+            store = RedisConversationStore(Conversation.from_bytes, 100, 1800, url=f"redis://127.0.0.1:{port}/0")
+            stores.append(store)
+            return store
+
+        try:
+            return await scenario(redis, make_store)
+        finally:
+            for store in stores:
+                await store.close()
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(main())
+
+
+def conversation(*turns):
+    conversation = Conversation("ana", [SimpleChatMessage(content="prompt", sender="system", timestamp="")])
+    for text in turns:
+        conversation.add_message(text, "user")
+    return conversation
+
+
+def test_writes_against_a_stale_version_conflict():
+    async def scenario(redis, make_store):
+        first, second = make_store(), make_store()
+        await first.start()
+        assert await first.put(KEY, conversation("hola"), expected_version=0) == 1
+        seen = await second.get(KEY)
+        assert seen.version == 1 and [m.content for m in seen.messages] == ["hola"]
+
+        assert await first.put(KEY, conversation("hola", "otra"), expected_version=1) == 2
+        with pytest.raises(VersionConflict, match="is at version 2, not 1"):
+            await second.put(KEY, seen, expected_version=1)
+        assert second.conflicts == 1
+        # The conflicting copy is dropped, so the next read decodes the newer one
+        assert [m.content for m in (await second.get(KEY)).messages] == ["hola", "otra"]
+
+    with_redis(scenario)
+
+
+def test_a_write_inside_the_watch_window_aborts_the_transaction():
+    async def scenario(redis, make_store):
+        store = make_store()
+        await store.put(KEY, conversation("hola"), expected_version=0)
+        redis.target = store._key(KEY)
+        with pytest.raises(VersionConflict, match="written by another worker"):
+            await store.put(KEY, conversation("hola", "otra"), expected_version=1)
+        assert redis.aborted_transactions == 1
+
+    with_redis(scenario, WriteOnFirstRead())
+
+
+def test_concurrent_saves_from_two_workers_are_retried_on_the_newer_copy():
+    async def scenario(redis, make_store):
+        managers = [
+            ChatMemoryManager(FakeDatabase(), writer=FakeWriter(), store=make_store()) for _ in range(2)
+        ]
+        for manager in managers:
+            await manager.start()
+        try:
+            # Both workers hold version 1 of the conversation
+            for manager in managers:
+                assert (await manager.get_conversation(*KEY)).version == 1
+            # Both read the conversation before either writes, so one of the writes conflicts
+            await asyncio.gather(
+                managers[0].save_and_cache_message(ChatMessage(message="uno", user_id="ana", theme="fisica"), "r1", 5),
+                managers[1].save_and_cache_message(ChatMessage(message="dos", user_id="ana", theme="fisica"), "r2", 5),
+            )
+        finally:
+            for manager in managers:
+                await manager.stop()
+
+        assert sum(manager.version_conflicts for manager in managers) == 1
+        stored = await make_store().get(KEY)
+        contents = [m.content for m in stored.messages]
+        assert sorted([contents[:2], contents[2:]]) == [["dos", "r2"], ["uno", "r1"]]
+        assert stored.version == 3
+
+    with_redis(scenario)
+
+
+def with_shared_memory(scenario, slot_size=4096):
+    """Run scenario(make_store) with stores mapping one temporary file, as the workers of a host do."""
+    path = os.path.join(tempfile.mkdtemp(prefix="chat-shm-"), "conversations")
+
+    async def main():
+        stores = []
+
+        async def make_store():
+            store = SharedMemoryConversationStore(Conversation.from_bytes, 100, 1800, path=path,
+                                                  slots=16, slot_size=slot_size)
+            await store.start()
+            stores.append(store)
+            return store
+
+        try:
+            return await scenario(make_store)
+        finally:
+            for store in stores:
+                await store.close()
+
+    return asyncio.run(main())
+
+
+def test_shared_memory_round_trip_between_workers():
+    async def scenario(make_store):
+        first, second = await make_store(), await make_store()
+        assert await first.get(KEY) is None
+        assert await first.put(KEY, conversation("hola", "¿qué es la energía?"), expected_version=0) == 1
+
+        seen = await second.get(KEY)
+        assert seen.version == 1
+        assert seen.system_prompt == "prompt"
+        assert [m.content for m in seen.messages] == ["hola", "¿qué es la energía?"]
+        # Unchanged since the last read: the near-cached object is reused without decoding
+        assert await second.get(KEY) is seen and second.decodes == 1
+
+    with_shared_memory(scenario)
+
+
+def test_shared_memory_writes_against_a_stale_version_conflict():
+    async def scenario(make_store):
+        first, second = await make_store(), await make_store()
+        await first.put(KEY, conversation("hola"), expected_version=0)
+        seen = await second.get(KEY)
+        await first.put(KEY, conversation("hola", "otra"), expected_version=1)
+
+        with pytest.raises(VersionConflict, match="is at version 2, not 1"):
+            await second.put(KEY, seen, expected_version=1)
+        with pytest.raises(VersionConflict, match="is at version 2, not 0"):
+            await second.put(KEY, conversation("nueva"), expected_version=0)
+        assert second.conflicts == 2
+        assert [m.content for m in (await second.get(KEY)).messages] == ["hola", "otra"]
+
+    with_shared_memory(scenario)
+
+
+def test_a_conversation_too_large_for_a_slot_is_not_shared():
+    async def scenario(make_store):
+        first, second = await make_store(), await make_store()
+        await first.put(KEY, conversation("hola"), expected_version=0)
+        assert await second.get(KEY) is not None
+
+        # Random text does not compress, so the payload outgrows the 1 KiB slot
+        large = conversation("hola", os.urandom(2048).hex())
+        large.version = 1
+        assert await first.put(KEY, large, expected_version=1) == 2
+        assert first.oversized == 1
+        # The stale copy is gone, so every worker reloads the conversation from the database
+        assert await first.get(KEY) is None
+        assert await second.get(KEY) is None
+
+    with_shared_memory(scenario, slot_size=1024)
@@ -0,0 +1,116 @@
+"""
+DatabaseManager against SQLite: batched saves, history pages and running counters.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+
+def turns(user_id, theme, count, start=datetime(2024, 3, 1, 9, 0)):
+    return [
+        {"user_id": user_id, "theme": theme, "message": f"pregunta {i}", "response": f"respuesta {i}",
+         "response_time_ms": 10, "timestamp": start + timedelta(minutes=i)}
+        for i in range(count)
+    ]
+
+
+def test_history_pages_walk_back_in_chronological_pages(with_database):
+    async def scenario(database):
+        await database.register_theme("fisica", prompt="Eres un tutor de física")
+        await database.save_chat_messages(turns("ana", "fisica", 5))
+
+        first, cursor = await database.get_chat_history_page("ana", "fisica", limit=2)
+        assert first[0].sender == "system" and first[0].content == "Eres un tutor de física"
+        assert [m.content for m in first[1:]] == ["pregunta 3", "respuesta 3", "pregunta 4", "respuesta 4"]
+
+        second, cursor = await database.get_chat_history_page("ana", "fisica", limit=2, cursor=cursor)
+        assert [m.content for m in second if m.sender == "user"] == ["pregunta 1", "pregunta 2"]
+
+        last, cursor = await database.get_chat_history_page("ana", "fisica", limit=2, cursor=cursor)
+        assert [m.content for m in last if m.sender == "user"] == ["pregunta 0"]
+        assert cursor is None
+
+    with_database(scenario)
+
+
+def test_empty_history_returns_the_theme_prompt(with_database):
+    async def scenario(database):
+        await database.register_theme("quimica", prompt="Eres un tutor de química")
+        history = await database.get_chat_history("nadie", "quimica")
+        assert [(m.sender, m.content) for m in history] == [("system", "Eres un tutor de química")]
+
+    with_database(scenario)
+
+
+def test_batched_saves_keep_counters_and_users_in_step(with_database):
+    async def scenario(database):
+        await database.register_user("ana")
+        await database.save_chat_messages(turns("ana", "fisica", 3) + turns("beto", "fisica", 2))
+
+        assert await database.get_overall_stats() == {"total_messages": 5, "total_users": 2}
+        assert (await database.get_user_stats("ana"))["message_count"] == 3
+        assert (await database.get_user_stats("beto"))["message_count"] == 2
+        # A recount finds nothing to correct
+        assert await database.reconcile_counters() == {"total_messages": 0, "total_users": 0}
+
+    with_database(scenario)
+
+
+class StatementCounter:
+    """Counts statements sent to the primary engine while active."""
+
+    def __init__(self):
+        from scripts.database import engine
+        self.engine = engine.sync_engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def test_history_of_a_conversation_never_archived_is_one_statement(with_database):
+    async def scenario(database):
+        await database.register_theme("fisica", prompt="Eres un tutor de física")
+        await database.save_chat_messages(turns("ana", "fisica", 3))
+        with StatementCounter() as statements:
+            await database.get_chat_history_page("ana", "fisica", limit=20)
+            await database.get_chat_history_page("ana", "fisica", limit=20, theme_prompt="Eres un tutor de física")
+            await database.get_chat_history_page("nadie", "fisica", limit=20)
+        assert statements.count == 3
+
+    with_database(scenario)
+
+
+def test_archived_turns_read_back_as_if_they_never_moved(with_database):
+    async def scenario(database):
+        await database.register_theme("fisica", prompt="Eres un tutor de física")
+        await database.save_chat_messages(turns("ana", "fisica", 5))
+
+        async def all_pages():
+            pages, cursor = [], None
+            while True:
+                page, cursor = await database.get_chat_history_page("ana", "fisica", limit=2, cursor=cursor)
+                pages.append([(m.sender, m.content) for m in page])
+                if cursor is None:
+                    return pages
+
+        before = await all_pages()
+        archived = await database.archive_idle_conversations(datetime(2024, 4, 1))
+        assert archived["conversations"] == 1 and archived["messages"] == 5
+        assert await all_pages() == before
+
+        # New turns go to the hot table; the page running past them reads on into the archive
+        await database.save_chat_messages(turns("ana", "fisica", 1, start=datetime(2024, 5, 1)))
+        with StatementCounter() as statements:
+            page, _ = await database.get_chat_history_page("ana", "fisica", limit=3)
+        assert statements.count == 2
+        assert [m.content for m in page if m.sender == "user"] == ["pregunta 3", "pregunta 4", "pregunta 0"]
+
+    with_database(scenario)
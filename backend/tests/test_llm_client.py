@@ -0,0 +1,29 @@
+"""
+LlamaApiClient against the fake LLM server: in-flight accounting for plain and streamed requests.
+"""
+import asyncio
+
+import httpx
+
+from loadtest.fakeLlm import FakeLlm, create_app
+from scripts.llmClient import LlamaApiClient
+
+
+def test_in_flight_counts_requests_until_they_finish():
+    async def scenario():
+        llm = FakeLlm(first_token_median=0.05, first_token_sigma=0, tokens_per_second=1000, max_tokens=5, seed=1)
+        client = LlamaApiClient("http://fake-llm/", max_concurrency=4)
+        client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(llm)))
+        payload = {"inputs": "hola", "parameters": {"max_new_tokens": 5}}
+
+        posting = asyncio.create_task(client.post(payload))
+        await asyncio.sleep(0.01)
+        assert client.get_stats()["in_flight"] == 1
+        await posting
+
+        tokens = [token async for token in client.stream(payload)]
+        assert tokens
+        assert client.get_stats()["in_flight"] == 0
+        await client.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+"""
+PromptBuffer renders exactly what a full render of the context would, as the conversation grows, trims and summarises.
+"""
+from scripts.chatManager import Conversation
+from scripts.chatbot import ChatBot, PromptBuffer
+from utils.messages import SimpleChatMessage
+
+
+def turn_context(conversation, question, material=None):
+    """The context ChatServer._build_context sends for a new question."""
+    context = conversation.get_context(reserve_tokens=conversation.count_tokens(question), material=material)
+    return context + [{"role": "user", "content": question}]
+
+
+def test_the_buffer_matches_a_full_render_after_every_turn():
+    chatbot = ChatBot(dummy=True)
+    conversation = Conversation("ana", [SimpleChatMessage("Eres un tutor de biología.", "system", 0.0)], max_tokens=300)
+    summaries = []
+    full_renders = 0
+    for i in range(30):
+        question = f"Pregunta {i}: ¿cómo se dividen las células?"
+        context = turn_context(conversation, question, material=["La mitosis tiene cuatro fases."] if i % 3 == 0 else None)
+        assert conversation.prompt_buffer.render(context) == chatbot._format_conversation(context)
+        full_renders += len(context)
+        if conversation.summary.text not in summaries:
+            summaries.append(conversation.summary.text)
+        conversation.add_message(question, "user")
+        conversation.add_message(f"Respuesta {i}: por mitosis, en cuatro fases.", "bot")
+
+    # Turns were folded into the summary several times along the way
+    assert len(summaries) > 2
+    assert len(conversation.messages) <= conversation.max_messages
+    # Only the messages after the reusable prefix were rendered again
+    assert conversation.prompt_buffer.rendered_messages < full_renders // 2
+
+
+def test_the_buffer_follows_a_context_that_shrinks_or_starts_over():
+    chatbot = ChatBot(dummy=True)
+    buffer = PromptBuffer()
+    system = {"role": "system", "content": "Eres un tutor."}
+    turns = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"mensaje {i}"} for i in range(6)]
+
+    for context in ([system] + turns, [system] + turns[:3], [system] + turns[4:], turns[2:], []):
+        assert buffer.render(context) == chatbot._format_conversation(context)
@@ -0,0 +1,215 @@
+"""
+CircuitBreaker state transitions and ResilientBackend retries, deadlines and hedging.
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from scripts.backends import LLMBackend
+from scripts.resilience import CircuitBreaker, CircuitOpenError, ResilientBackend
+
+
+class ScriptedBackend(LLMBackend):
+    """Replays a script of outcomes: a number is a delay before answering, an exception is raised."""
+
+    name = "scripted"
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    async def generate(self, prompt, max_tokens):
+        self.calls += 1
+        outcome = self.script.pop(0) if self.script else 0
+        if isinstance(outcome, Exception):
+            raise outcome
+        await asyncio.sleep(outcome)
+        return f"answer {self.calls}"
+
+
+def http_error(status):
+    request = httpx.Request("POST", "http://llm/")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes_once_after_the_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.rejections == 1
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one probe at a time
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_a_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_transient_errors_are_retried():
+    backend = ScriptedBackend([http_error(503), 0])
+    resilient = ResilientBackend(backend, max_timeout=1, min_timeout=0.1, max_retries=2)
+    assert asyncio.run(resilient.generate("p", 5)) == "answer 2"
+    assert resilient.retries == 1 and resilient.breaker.state == "closed"
+
+
+def test_client_errors_are_not_retried_and_do_not_count_against_the_backend():
+    backend = ScriptedBackend([http_error(400)])
+    resilient = ResilientBackend(backend, max_timeout=1, max_retries=2, failure_threshold=1)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(resilient.generate("p", 5))
+    assert backend.calls == 1 and resilient.breaker.state == "closed"
+
+
+def test_the_open_circuit_rejects_calls_without_reaching_the_backend():
+    backend = ScriptedBackend([ConnectionError("down")] * 3)
+    resilient = ResilientBackend(backend, max_timeout=1, max_retries=0, failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            asyncio.run(resilient.generate("p", 5))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilient.generate("p", 5))
+    assert backend.calls == 2
+
+
+def observed(resilient, seconds):
+    """Give the backend enough latency samples for adaptive deadlines."""
+    for _ in range(resilient.min_samples):
+        resilient.latency.record(seconds)
+
+
+def test_timeouts_of_a_remote_backend_are_retried_within_the_request_budget():
+    backend = ScriptedBackend([1, 0])
+    resilient = ResilientBackend(backend, max_timeout=1, min_timeout=0.05, max_retries=1)
+    observed(resilient, 0.01)
+    assert asyncio.run(resilient.generate("p", 5)) == "answer 2"
+    assert resilient.timeouts == 1
+
+
+def test_a_backend_that_always_hangs_fails_within_one_max_timeout():
+    async def scenario():
+        backend = ScriptedBackend([10] * 10)
+        resilient = ResilientBackend(backend, max_timeout=0.3, min_timeout=0.05, max_retries=5)
+        observed(resilient, 0.03)
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await resilient.generate("p", 5)
+        # Retries fit in the budget instead of each getting a full deadline
+        assert time.monotonic() - start < 0.3 + 0.05
+        assert 2 <= backend.calls <= 5
+
+    asyncio.run(scenario())
+
+
+def test_a_first_attempt_at_the_maximum_leaves_no_time_for_retries():
+    async def scenario():
+        backend = ScriptedBackend([10, 0])
+        resilient = ResilientBackend(backend, max_timeout=0.1, min_timeout=0.05, max_retries=2)
+        with pytest.raises(asyncio.TimeoutError):
+            await resilient.generate("p", 5)
+        assert backend.calls == 1 and resilient.retries == 0
+
+    asyncio.run(scenario())
+
+
+class StreamingBackend(LLMBackend):
+    """Streams tokens with a delay before each; a delay of None hangs."""
+
+    name = "streaming"
+
+    def __init__(self, delays):
+        self.delays = delays
+
+    async def stream(self, prompt, max_tokens):
+        for i, delay in enumerate(self.delays):
+            await asyncio.sleep(3600 if delay is None else delay)
+            yield f"t{i} "
+
+
+def collect(resilient, tokens):
+    async def run():
+        async for token in resilient.stream("p", 5):
+            tokens.append(token)
+
+    return run()
+
+
+def test_a_stream_stalling_after_its_first_token_times_out():
+    async def scenario():
+        resilient = ResilientBackend(StreamingBackend([0, None]), max_timeout=5, min_timeout=0.05)
+        observed(resilient, 0.05)
+        tokens = []
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await collect(resilient, tokens)
+        assert tokens == ["t0 "]
+        assert time.monotonic() - start < 0.5
+        assert resilient.timeouts == 1 and resilient.breaker.failures == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_stream_is_cut_at_max_timeout_even_while_tokens_flow():
+    async def scenario():
+        resilient = ResilientBackend(StreamingBackend([0.05] * 100), max_timeout=0.3, min_timeout=0.05)
+        tokens = []
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await collect(resilient, tokens)
+        assert 3 <= len(tokens) < 100
+        assert time.monotonic() - start < 0.3 + 0.05
+
+    asyncio.run(scenario())
+
+
+def test_a_slow_call_is_hedged_and_the_faster_copy_wins():
+    async def scenario():
+        backend = ScriptedBackend([0.001] * 20 + [1, 0.001])
+        resilient = ResilientBackend(backend, max_timeout=2, max_retries=0, hedge=True)
+        for _ in range(20):
+            await resilient.generate("p", 5)
+        assert await resilient.generate("p", 5) == "answer 22"
+        assert resilient.hedges == 1 and resilient.hedge_wins == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_local_timeout_is_neither_retried_nor_hedged(local_backend):
+    async def scenario():
+        backend = local_backend(0.3)
+        resilient = ResilientBackend(backend, max_timeout=0.05, max_retries=2, hedge=True)
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await resilient.generate("slow", 5)
+        # The caller gets the timeout without waiting for the generation
+        assert time.monotonic() - start < 0.25
+        assert resilient.timeouts == 1 and resilient.retries == 0 and resilient.abandoned == 1
+        assert resilient.breaker.failures == 1
+
+        # The abandoned generation still runs; the next one waits for it instead of overlapping
+        resilient.max_timeout = 2
+        assert await resilient.generate("next", 5) == "re: next"
+        assert backend.model.calls == 2 and backend.model.max_running == 1
+        assert resilient.hedges == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,66 @@
+"""
+ResponseCache around ChatBot streams that fail part way through.
+"""
+import asyncio
+
+import pytest
+
+from scripts.backends import LLMBackend
+from scripts.chatbot import ChatBot
+from scripts.responseCache import ResponseCache
+
+CONTEXT = [{"role": "system", "content": "Habla de fotosíntesis"}, {"role": "user", "content": "Hola"}]
+
+
+class BrokenStreamBackend(LLMBackend):
+    """Streams a couple of tokens, then loses the connection."""
+
+    name = "broken"
+
+    def __init__(self, tokens_before_error):
+        self.tokens_before_error = tokens_before_error
+
+    async def stream(self, prompt, max_tokens):
+        for token in ["La", " fotosíntesis", " es"][:self.tokens_before_error]:
+            yield token
+        raise ConnectionError("connection reset")
+
+
+async def stream_through_cache(cache, chatbot, sent):
+    """Stream a turn the way ChatServer.stream_message does, collecting what the client got."""
+    async for token in cache.stream_or_generate(
+        "biologia", CONTEXT,
+        lambda: chatbot.stream_response(CONTEXT),
+        accept=lambda text: not chatbot.is_fallback_response(text)
+    ):
+        sent.append(token)
+
+
+def test_a_stream_failing_mid_response_raises_and_caches_nothing(monkeypatch):
+    monkeypatch.setenv("LLM_RESILIENCE", "false")
+
+    async def scenario():
+        cache = ResponseCache(variants=1)
+        chatbot = ChatBot(backend=BrokenStreamBackend(tokens_before_error=2))
+        sent = []
+        with pytest.raises(ConnectionError):
+            await stream_through_cache(cache, chatbot, sent)
+        assert sent == ["La", " fotosíntesis"]
+        assert len(cache) == 0
+        assert cache.get(cache.make_key("biologia", CONTEXT)) is None
+
+    asyncio.run(scenario())
+
+
+def test_a_stream_failing_before_any_token_falls_back_without_caching(monkeypatch):
+    monkeypatch.setenv("LLM_RESILIENCE", "false")
+
+    async def scenario():
+        cache = ResponseCache(variants=1)
+        chatbot = ChatBot(backend=BrokenStreamBackend(tokens_before_error=0))
+        sent = []
+        await stream_through_cache(cache, chatbot, sent)
+        assert len(sent) == 1 and chatbot.is_fallback_response(sent[0])
+        assert len(cache) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+"""
+BatchScheduler with a stand-in batched backend, and the check enabling batching on remote endpoints.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from loadtest.fakeLlm import FakeLlm, create_app
+from scripts.backends import HuggingFaceBackend
+from scripts.scheduler import BatchScheduler
+
+
+class FakeBatchBackend:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    async def generate_batch(self, prompts, max_tokens):
+        self.batches.append(list(prompts))
+        await asyncio.sleep(self.delay)
+        return [f"echo {prompt}" for prompt in prompts]
+
+
+def test_concurrent_prompts_share_one_call_and_keep_their_results():
+    async def scenario():
+        backend = FakeBatchBackend()
+        scheduler = BatchScheduler(backend.generate_batch, max_batch_size=8, batch_window_ms=20, default_timeout=5)
+        results = await asyncio.gather(*(scheduler.submit(f"p{i}", 10) for i in range(5)))
+        await scheduler.stop()
+        assert results == [f"echo p{i}" for i in range(5)]
+        assert backend.batches == [[f"p{i}" for i in range(5)]]
+
+    asyncio.run(scenario())
+
+
+def test_batches_are_capped_at_max_batch_size():
+    async def scenario():
+        backend = FakeBatchBackend()
+        scheduler = BatchScheduler(backend.generate_batch, max_batch_size=2, batch_window_ms=20, default_timeout=5)
+        await asyncio.gather(*(scheduler.submit(f"p{i}", 10) for i in range(5)))
+        await scheduler.stop()
+        assert [len(batch) for batch in backend.batches] == [2, 2, 1]
+        assert scheduler.get_stats()["mean_batch_size"] == 5 / 3
+
+    asyncio.run(scenario())
+
+
+def test_a_request_past_its_deadline_times_out_and_is_not_sent():
+    async def scenario():
+        backend = FakeBatchBackend()
+        scheduler = BatchScheduler(backend.generate_batch, max_batch_size=8, batch_window_ms=100, default_timeout=5)
+        late = asyncio.create_task(scheduler.submit("late", 10, timeout=0.01))
+        on_time = asyncio.create_task(scheduler.submit("on time", 10))
+        with pytest.raises(asyncio.TimeoutError):
+            await late
+        assert await on_time == "echo on time"
+        await scheduler.stop()
+        assert backend.batches == [["on time"]]
+
+    asyncio.run(scenario())
+
+
+def test_a_slow_backend_call_times_out():
+    async def scenario():
+        scheduler = BatchScheduler(FakeBatchBackend(delay=1).generate_batch, batch_window_ms=1, default_timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.submit("p", 10)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stop_cancels_batches_in_flight():
+    async def scenario():
+        scheduler = BatchScheduler(FakeBatchBackend(delay=60).generate_batch, batch_window_ms=1, default_timeout=30)
+        waiting = asyncio.create_task(scheduler.submit("p", 10))
+        await asyncio.sleep(0.05)
+        assert len(scheduler._dispatches) == 1
+        await scheduler.stop()
+        assert not scheduler._dispatches
+        with pytest.raises(RuntimeError, match="Scheduler stopped"):
+            await waiting
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("accept_batches", [True, False])
+def test_remote_batching_is_enabled_only_when_the_endpoint_takes_lists(monkeypatch, accept_batches):
+    monkeypatch.setenv("LLM_BATCH_SIZE", "4")
+
+    async def scenario():
+        llm = FakeLlm(first_token_median=0.001, tokens_per_second=10000, accept_batches=accept_batches, seed=1)
+        backend = HuggingFaceBackend(api_url="http://fake-llm/", token="test")
+        backend.client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(llm)))
+        await backend.start()
+        await backend.close()
+        return backend.supports_batching
+
+    assert asyncio.run(scenario()) is accept_batches
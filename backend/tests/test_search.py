@@ -0,0 +1,62 @@
+"""
+Chat search on SQLite FTS5: ranking, and theme and student filters inside the MATCH.
+"""
+from datetime import datetime, timedelta
+
+from scripts.chatSearch import fts5_match
+
+
+def turn(user_id, theme, message, response, minute):
+    return {"user_id": user_id, "theme": theme, "message": message, "response": response,
+            "response_time_ms": 10, "timestamp": datetime(2024, 3, 1) + timedelta(minutes=minute)}
+
+
+TURNS = [
+    turn("ana", "Física 1", "¿Qué es la fotosíntesis?", "Es como las plantas producen energía.", 0),
+    turn("ana", "Física 10", "Explica la fotosíntesis otra vez", "Las plantas usan luz.", 1),
+    turn("beto", "Física 1", "¿La fotosíntesis necesita luz?", "Sí, la fotosíntesis necesita luz solar.", 2),
+    turn("beto", "Química", "¿Qué es un átomo?", "La unidad más pequeña de la materia.", 3),
+]
+
+
+def test_filters_become_scope_tokens_in_the_match():
+    assert fts5_match("luz solar", None, None) == '{message response} : ("luz" "solar")'
+    assert fts5_match("luz", "Física", "ana") == (
+        '{message response} : ("luz") AND scope : "t46c3ad73696361" AND scope : "u616e61"'
+    )
+    assert fts5_match("¿?", "Física", None) == ""
+
+
+def test_search_ranks_and_filters_by_exact_theme_and_student(with_database):
+    async def scenario(database):
+        await database.save_chat_messages(TURNS)
+
+        results, next_offset = await database.search_chat_messages("fotosintesis")
+        assert len(results) == 3 and next_offset is None
+        # Mentioned in both the question and the answer, so it ranks first
+        assert results[0]["user_id"] == "beto"
+        assert results[0]["snippet"].startswith("¿La [fotosíntesis]")
+
+        results, _ = await database.search_chat_messages("fotosintesis", theme="Física 1")
+        assert sorted(r["user_id"] for r in results) == ["ana", "beto"]
+        results, _ = await database.search_chat_messages("fotosintesis", theme="Física 1", user_id="ana")
+        assert [r["message"] for r in results] == ["¿Qué es la fotosíntesis?"]
+        results, _ = await database.search_chat_messages("fotosintesis", user_id="nadie")
+        assert results == []
+
+        # A reply-only hit gets its snippet from the reply
+        [result], _ = await database.search_chat_messages("materia")
+        assert "[materia]" in result["snippet"]
+
+    with_database(scenario)
+
+
+def test_pages_do_not_overlap(with_database):
+    async def scenario(database):
+        await database.save_chat_messages(TURNS)
+        first, next_offset = await database.search_chat_messages("fotosintesis", limit=2)
+        second, last = await database.search_chat_messages("fotosintesis", limit=2, offset=next_offset)
+        assert next_offset == 2 and last is None
+        assert len({r["id"] for r in first + second}) == 3
+
+    with_database(scenario)
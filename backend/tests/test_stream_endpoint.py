@@ -0,0 +1,117 @@
+"""
+POST /chat/stream end to end: event framing and the turn saved for complete, failed and abandoned streams.
+"""
+import asyncio
+import json
+
+import httpx
+
+from main import app
+from scripts.backends import LLMBackend
+from scripts.chatbot import ChatBot
+from scripts.server import ChatServer, TRUNCATED_MARKER
+from utils.messages import ChatMessage
+
+
+class ScriptedBackend(LLMBackend):
+    """Streams fixed tokens, optionally failing after them."""
+
+    name = "scripted"
+
+    def __init__(self, tokens, error=None):
+        self.tokens = tokens
+        self.error = error
+
+    async def generate(self, prompt, max_tokens):
+        return "".join(self.tokens)
+
+    async def stream(self, prompt, max_tokens):
+        for token in self.tokens:
+            await asyncio.sleep(0)
+            yield token
+        if self.error is not None:
+            raise self.error
+
+
+def with_chat_server(monkeypatch, backend, scenario):
+    """Run scenario(server) against a started ChatServer on an emptied database."""
+    monkeypatch.setenv("LLM_RESILIENCE", "false")
+
+    async def main():
+        server = ChatServer()
+        server.chatBot = ChatBot(backend=backend)
+        await server.startup()
+        await server.db_manager.clear_all_data()
+        try:
+            return await scenario(server)
+        finally:
+            await server.shutdown()
+
+    return asyncio.run(main())
+
+
+async def post_stream(server, body):
+    app.state.chat_server = server
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/chat/stream", json=body)
+
+
+def parse_events(text):
+    """Split a server-sent event body into (event, data) pairs."""
+    events = []
+    for frame in text.split("\n\n"):
+        if not frame:
+            continue
+        event, data = "message", ""
+        for line in frame.split("\n"):
+            field, _, value = line.partition(": ")
+            if field == "event":
+                event = value
+            elif field == "data":
+                data += value
+        events.append((event, json.loads(data)))
+    return events
+
+
+async def saved_responses(server, user_id, theme):
+    await server.writer.flush()
+    history = await server.db_manager.get_chat_history(user_id, theme)
+    return [m.content for m in history if m.sender == "bot"]
+
+
+def test_tokens_arrive_as_message_events_followed_by_done(monkeypatch):
+    async def scenario(server):
+        response = await post_stream(server, {"message": "¿Qué es?", "user_id": "ana", "theme": "biologia"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text.endswith("\n\n")
+
+        events = parse_events(response.text)
+        assert events[:-1] == [("message", {"token": t}) for t in ["La", " fotosíntesis", " es luz"]]
+        assert events[-1][0] == "done" and "response_time_ms" in events[-1][1]
+        assert await saved_responses(server, "ana", "biologia") == ["La fotosíntesis es luz"]
+
+    with_chat_server(monkeypatch, ScriptedBackend(["La", " fotosíntesis", " es luz"]), scenario)
+
+
+def test_a_stream_failing_mid_response_sends_an_error_and_saves_a_marked_turn(monkeypatch):
+    async def scenario(server):
+        response = await post_stream(server, {"message": "¿Qué es?", "user_id": "ana", "theme": "biologia"})
+        events = parse_events(response.text)
+        assert [e for e, _ in events] == ["message", "message", "error"]
+        assert await saved_responses(server, "ana", "biologia") == ["La fotosíntesis" + TRUNCATED_MARKER]
+
+    backend = ScriptedBackend(["La", " fotosíntesis"], error=ConnectionError("connection reset"))
+    with_chat_server(monkeypatch, backend, scenario)
+
+
+def test_a_client_leaving_mid_stream_still_saves_the_turn(monkeypatch):
+    async def scenario(server):
+        message = ChatMessage(message="¿Qué es?", user_id="ana", theme="biologia")
+        stream = server.stream_message(message)
+        assert await stream.__anext__() == "La"
+        # What the ASGI server does to the response generator when the socket closes
+        await stream.aclose()
+        assert await saved_responses(server, "ana", "biologia") == ["La" + TRUNCATED_MARKER]
+
+    with_chat_server(monkeypatch, ScriptedBackend(["La", " fotosíntesis", " es luz"]), scenario)
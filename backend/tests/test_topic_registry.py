@@ -0,0 +1,45 @@
+"""
+TopicRegistry writes through to the database, updates existing topics and follows changes made by other workers.
+"""
+from scripts.topicRegistry import TopicRegistry
+from scripts.topicRetrieval import HashingEmbedder, TopicRetriever
+
+
+def test_registering_an_existing_topic_updates_it_and_bumps_the_version(with_database):
+    async def scenario(database):
+        registry = TopicRegistry(database)
+        other_worker = TopicRegistry(database)
+        await registry.load()
+        await other_worker.load()
+
+        await registry.register("fisica", objectives="Leyes de Newton", prompt="Eres un tutor de física")
+        first = registry.version
+        await registry.register("fisica", objectives="Leyes de Newton", prompt="Eres un tutor de física")
+        assert registry.version == first
+
+        await registry.register("fisica", objectives="Energía", prompt="Eres un tutor de física, habla de energía")
+        assert registry.version == first + 1
+        assert registry.get_prompt("fisica") == "Eres un tutor de física, habla de energía"
+        # Topics are not emptied between tests, so look at this one only
+        stored = [topic for topic in await database.get_topic_details() if topic["theme"] == "fisica"]
+        assert stored == [{"theme": "fisica", "objectives": "Energía", "prompt": "Eres un tutor de física, habla de energía"}]
+
+        assert await other_worker.refresh_if_stale()
+        assert other_worker.get_prompt("fisica") == "Eres un tutor de física, habla de energía"
+
+    with_database(scenario)
+
+
+def test_an_updated_prompt_is_indexed_again(with_database):
+    async def scenario(database):
+        retriever = TopicRetriever(embedder=HashingEmbedder(), min_tokens=1, chunk_tokens=40)
+        registry = TopicRegistry(database, retriever=retriever)
+        await registry.load()
+        indexed = retriever.indexed
+
+        await registry.register("biologia", prompt="Eres un tutor de biología.\n\nLa mitosis divide una célula en dos.")
+        await registry.register("biologia", prompt="Eres un tutor de biología.\n\nLa meiosis produce gametos.")
+        assert retriever.indexed - indexed == 2
+        assert await registry.get_material("biologia", "¿Qué produce la meiosis?") == ["La meiosis produce gametos."]
+
+    with_database(scenario)
@@ -0,0 +1,76 @@
+"""
+TopicRetriever with the hashing embedder: ranking the relevant paragraph and re-indexing changed topics.
+"""
+import asyncio
+
+import pytest
+
+from scripts import topicRetrieval
+from scripts.topicRetrieval import HashingEmbedder, TopicRetriever
+
+LESSON = """Eres un tutor de biología para estudiantes de secundaria. Responde con preguntas.
+
+La fotosíntesis ocurre en los cloroplastos de las hojas. Las plantas usan la luz solar, el agua y el dióxido de carbono para producir glucosa y liberar oxígeno.
+
+La mitosis es la división de una célula en dos células hijas idénticas. Sus fases son profase, metafase, anafase y telofase.
+
+Un ecosistema reúne a los seres vivos de un lugar y su ambiente. Los depredadores, las presas y los descomponedores forman cadenas alimentarias."""
+
+REVISED = LESSON.replace("La mitosis es la división", "La meiosis produce gametos con la mitad de cromosomas. La mitosis es la división")
+
+
+def retriever():
+    return TopicRetriever(embedder=HashingEmbedder(), top_k=1, chunk_tokens=80, min_tokens=1, min_score=0.0)
+
+
+@pytest.fixture
+def no_threads(monkeypatch):
+    """Fail if embedding leaves the event loop; hashing is cheaper than the thread hop."""
+    def to_thread(*args, **kwargs):
+        raise AssertionError("the hashing embedder should run inline")
+
+    monkeypatch.setattr(topicRetrieval.asyncio, "to_thread", to_thread)
+
+
+def test_the_paragraph_a_question_is_about_ranks_first(no_threads):
+    async def scenario():
+        topics = retriever()
+        index = await topics.index_topic("biologia", LESSON)
+        assert len(index.chunks) == 4
+        assert topics.lead("biologia").startswith("Eres un tutor de biología")
+
+        for question, expected in [
+            ("¿Cómo hacen las plantas la fotosíntesis con la luz?", "La fotosíntesis"),
+            ("¿Cuáles son las fases de la mitosis?", "La mitosis"),
+            ("¿Qué es una cadena alimentaria en un ecosistema?", "Un ecosistema"),
+        ]:
+            material = await topics.retrieve("biologia", question)
+            assert len(material) == 1 and material[0].startswith(expected)
+
+    asyncio.run(scenario())
+
+
+def test_a_changed_topic_is_indexed_again(no_threads):
+    async def scenario():
+        topics = retriever()
+        first = await topics.index_topic("biologia", LESSON)
+        assert await topics.index_topic("biologia", LESSON) is first
+        before = await topics.retrieve("biologia", "¿Qué son los gametos de la meiosis?")
+        assert "meiosis" not in before[0]
+
+        revised = await topics.index_topic("biologia", REVISED)
+        assert revised is not first and topics.indexed == 2
+        # Retrievals cached for the old text are dropped with it
+        after = await topics.retrieve("biologia", "¿Qué son los gametos de la meiosis?")
+        assert after[0].startswith("La meiosis produce gametos")
+
+    asyncio.run(scenario())
+
+
+def test_a_short_topic_is_not_indexed():
+    async def scenario():
+        topics = TopicRetriever(embedder=HashingEmbedder(), min_tokens=400)
+        assert await topics.index_topic("biologia", LESSON) is None
+        assert await topics.retrieve("biologia", "¿Qué es la mitosis?") == []
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+"""
+WriteBehindQueue with a stand-in database: retries, dead letters, backpressure and spill files.
+"""
+import asyncio
+import glob
+import json
+import os
+
+from scripts.writeBehind import WriteBehindQueue
+
+
+class FakeDatabase:
+    """Records saved turns; rejects turns saying "poison" and everything while down."""
+
+    def __init__(self):
+        self.saved = []
+        self.down = False
+        self.calls = 0
+
+    async def save_chat_messages(self, batch):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("database is down")
+        if any(message["message"] == "poison" for message in batch):
+            raise ValueError("bad row")
+        self.saved.extend(message["message"] for message in batch)
+
+    async def ping(self):
+        if self.down:
+            raise ConnectionError("database is down")
+
+
+def make_queue(database, tmp_path, **kwargs):
+    return WriteBehindQueue(
+        database, flush_interval=60, spill_path=str(tmp_path / "pending.jsonl"),
+        dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs
+    )
+
+
+def test_a_poison_turn_is_dead_lettered_and_the_rest_written(tmp_path):
+    async def scenario():
+        database = FakeDatabase()
+        queue = make_queue(database, tmp_path, max_attempts=2)
+        for text in ["uno", "poison", "dos"]:
+            await queue.enqueue({"user_id": "ana", "message": text})
+
+        assert await queue.flush() == 0
+        assert queue.get_stats()["pending_turns"] == 3
+        assert await queue.flush() == 2
+        assert database.saved == ["uno", "dos"]
+        assert queue.get_stats()["pending_turns"] == 0
+        assert queue.dead_lettered == 1
+
+        [path] = glob.glob(str(tmp_path / "dead.*.jsonl"))
+        assert path.endswith(f".{os.getpid()}.jsonl")
+        with open(path, encoding="utf-8") as f:
+            [dead] = [json.loads(line) for line in f]
+        assert dead["message"] == "poison" and dead["error"] == "bad row"
+
+    asyncio.run(scenario())
+
+
+def test_an_outage_keeps_every_turn_queued(tmp_path):
+    async def scenario():
+        database = FakeDatabase()
+        database.down = True
+        queue = make_queue(database, tmp_path, max_attempts=1)
+        await queue.enqueue({"user_id": "ana", "message": "uno"})
+        for _ in range(3):
+            await queue.flush()
+        assert queue.get_stats()["pending_turns"] == 1
+        assert queue.dead_lettered == 0
+
+        database.down = False
+        assert await queue.flush() == 1
+        assert database.saved == ["uno"]
+
+    asyncio.run(scenario())
+
+
+def test_enqueue_waits_for_room_when_the_queue_is_full(tmp_path):
+    async def scenario():
+        database = FakeDatabase()
+        queue = make_queue(database, tmp_path, max_pending=2)
+        await queue.enqueue({"message": "uno"})
+        await queue.enqueue({"message": "dos"})
+        third = asyncio.create_task(queue.enqueue({"message": "tres"}))
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        assert queue.backpressure_waits == 1
+
+        await queue.flush()
+        await asyncio.wait_for(third, 1)
+        assert queue.get_stats()["pending_turns"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_spilled_turns_are_recovered_once(tmp_path):
+    async def scenario():
+        database = FakeDatabase()
+        database.down = True
+        queue = make_queue(database, tmp_path)
+        await queue.start()
+        await queue.enqueue({"user_id": "ana", "message": "uno"})
+        await queue.enqueue({"user_id": "ana", "message": "dos"})
+        await queue.stop()
+
+        [path] = glob.glob(str(tmp_path / "pending.*.jsonl"))
+        assert os.path.basename(path).startswith(f"pending.{os.getpid()}-")
+
+        # Two workers starting together: the first claims the file, the second finds nothing
+        database.down = False
+        first, second = make_queue(database, tmp_path), make_queue(database, tmp_path)
+        await first.start()
+        await second.start()
+        assert first.get_stats()["pending_turns"] == 2
+        assert second.get_stats()["pending_turns"] == 0
+        assert os.listdir(tmp_path) == []
+
+        await first.stop()
+        await second.stop()
+        assert database.saved == ["uno", "dos"]
+
+    asyncio.run(scenario())